@@ -0,0 +1,73 @@
+"""
+Benchmarks sequential `gigalixir ps` calls with and without `gigalixir agent`.
+
+    python benchmarks/agent_bench.py --calls 200
+
+The calls go to gigalixir.fake_api on localhost:4000, which is where
+`--env dev` points, so the numbers show the cli's own overhead.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from gigalixir import fake_api
+
+AGENT_START_TIMEOUT = 30
+
+def gigalixir(*args):
+    return [sys.executable, '-m', 'gigalixir_agent_client'] + list(args)
+
+def run(label, env, calls):
+    timings = []
+    for _ in range(calls):
+        started = time.time()
+        subprocess.check_call(gigalixir('--env', 'dev', 'ps', '-a', 'bench'), env=env, stdout=subprocess.DEVNULL)
+        timings.append(time.time() - started)
+    timings.sort()
+    print("%-16s %4d calls %8.2fs total %7.1fms p50 %7.1fms p95" % (
+        label, calls, sum(timings), 1000 * timings[len(timings) // 2], 1000 * timings[int(len(timings) * 0.95)]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    server = fake_api.serve('localhost', 4000)
+    server.api.add_app('bench')
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT,
+        'HOME': directory,
+        'GIGALIXIR_EMAIL': 'bench@example.com',
+        'GIGALIXIR_API_KEY': 'bench',
+        'GIGALIXIR_AGENT_SOCKET': os.path.join(directory, 'agent.sock'),
+    })
+    try:
+        run('without agent', dict(env, GIGALIXIR_NO_AGENT='1'), args.calls)
+        agent = subprocess.Popen(gigalixir('agent'), env=env)
+        deadline = time.time() + AGENT_START_TIMEOUT
+        while not os.path.exists(env['GIGALIXIR_AGENT_SOCKET']):
+            if agent.poll() is not None:
+                sys.exit("gigalixir agent exited with %s before listening." % agent.returncode)
+            if time.time() > deadline:
+                agent.kill()
+                agent.wait()
+                sys.exit("gigalixir agent did not listen within %ss." % AGENT_START_TIMEOUT)
+            time.sleep(0.05)
+        try:
+            run('with agent', env, args.calls)
+        finally:
+            subprocess.call(gigalixir('agent', '--stop'), env=env)
+            agent.wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmarks `gigalixir logs:search` over a synthetic archive.
+
+    python benchmarks/log_search_bench.py --gb 5 --dir /tmp/gigalixir-logs
+
+The corpus is generated once into --dir (segments are written in parallel)
+and reused on later runs as long as it is at least --gb big. Each query is
+run with a single process and with one process per cpu.
+"""
+import argparse
+import calendar
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gigalixir import log_archive
+from gigalixir import log_search
+
+START = 1506384000
+LINES_PER_SECOND = 2000
+LEVELS = ['debug', 'info', 'info', 'info', 'warning', 'error']
+MESSAGES = [
+    'Sent 200 in %dms',
+    'GET /api/apps/%d/releases',
+    'Processing with GigalixirWeb.AppController.show/2 params=%d',
+    'Postgrex.Protocol (#PID<0.%d.0>) disconnected',
+    'QUERY OK source="apps" db=%dms',
+]
+# a rare line for the literal queries to find
+NEEDLE = '** (DBConnection.ConnectionError) tcp recv: closed'
+NEEDLE_RATE = 1e-5
+
+def segment_lines(seed, start, count):
+    rand = random.Random(seed)
+    for i in range(count):
+        t = start + float(i) / LINES_PER_SECOND
+        stamp = log_archive.timestamp(t)
+        if rand.random() < NEEDLE_RATE:
+            message = NEEDLE
+        else:
+            message = rand.choice(MESSAGES) % rand.randint(1, 100000)
+        yield u"%s %s web.%d [%s] request_id=%016x %s\n" % (
+            stamp, stamp, rand.randint(1, 4), rand.choice(LEVELS), rand.getrandbits(64), message)
+
+def write_segment(directory, n, segment_bytes):
+    lines_per_segment = segment_bytes // 120
+    start = START + n * float(lines_per_segment) / LINES_PER_SECOND
+    segment = log_archive.Segment(directory, 'bench', log_archive.default_compression(), start)
+    block, size = [], 0
+    for line in segment_lines(n, start, lines_per_segment):
+        block.append(line)
+        size += len(line)
+        if size >= log_archive.BLOCK_BYTES:
+            segment.write_block(block, block[0][:log_search.TIMESTAMP_WIDTH], block[-1][:log_search.TIMESTAMP_WIDTH])
+            block, size = [], 0
+    if block:
+        segment.write_block(block, block[0][:log_search.TIMESTAMP_WIDTH], block[-1][:log_search.TIMESTAMP_WIDTH])
+    segment.close()
+    return segment.index['bytes']
+
+def corpus_bytes(directory):
+    return sum(log_archive.read_index(segment)['bytes'] for segment in log_archive.segments(directory))
+
+def generate(directory, total_bytes, segment_bytes):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    existing = corpus_bytes(directory)
+    if existing >= total_bytes:
+        print("reusing %.2f GB corpus in %s" % (existing / 1e9, directory))
+        return
+    count = int(total_bytes // segment_bytes) + 1
+    started = time.time()
+    with ProcessPoolExecutor() as pool:
+        list(pool.map(write_segment, [directory] * count, range(count), [segment_bytes] * count))
+    print("generated %.2f GB in %.1fs" % (corpus_bytes(directory) / 1e9, time.time() - started))
+
+def run(label, directory, jobs, **query):
+    started = time.time()
+    matches = sum(1 for _ in log_search.search(directory, jobs=jobs, **query))
+    print("%-40s jobs=%-3d %8d lines %8.2fs" % (label, jobs, matches, time.time() - started))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gb', type=float, default=5.0, help='uncompressed corpus size')
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), 'gigalixir-log-search-bench'))
+    parser.add_argument('--segment-mb', type=int, default=64)
+    args = parser.parse_args()
+
+    generate(args.dir, int(args.gb * 1e9), args.segment_mb * 1024 * 1024)
+    index = log_archive.read_index(log_archive.segments(args.dir)[-1])
+    middle = (START + calendar.timegm(time.strptime(index['last'][:19], '%Y-%m-%dT%H:%M:%S'))) / 2
+    def at(offset):
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(middle + offset))
+    queries = [
+        ('one minute window', dict(since=at(0), until=at(60))),
+        ('rare literal', dict(grep='ConnectionError')),
+        ('rare literal in one hour', dict(grep='ConnectionError', since=at(0), until=at(3600))),
+        ('regex without literals (full scan)', dict(grep=r'web\.[1-4] \[error\] .*db=9\d{4}ms')),
+    ]
+    for label, query in queries:
+        for jobs in sorted(set([1, os.cpu_count() or 1])):
+            run(label, args.dir, jobs, **query)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Latency benchmarks for everyday commands, run against gigalixir.fake_api
+with an injected round trip time, and a gate that compares them with a
+baseline.
+
+    python benchmarks/suite.py run --out baseline.json
+    python benchmarks/suite.py run --out current.json --rtt 0.02
+    python benchmarks/suite.py compare baseline.json current.json --threshold 0.2
+
+`run --baseline baseline.json` runs and compares in one go. compare exits
+with 1 when a benchmark's p50 or p95 got more than --threshold slower than
+the baseline and by more than --min-delta seconds, which keeps tiny
+benchmarks from failing on noise. Baselines are only comparable when made
+on the same machine with the same --rtt.
+
+Commands run in this process through click's CliRunner, except those
+marked subprocess, which start a fresh interpreter to include the cost of
+starting up.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from click.testing import CliRunner
+import gigalixir
+from gigalixir import fake_api
+
+RTT = 0.01
+THRESHOLD = 0.2
+MIN_DELTA = 0.005
+
+def setup_one_app(api):
+    api.add_app('app-0', replicas=2)
+
+def setup_releases(api):
+    api.add_app('app-0', releases=10000)
+
+def setup_logs(api):
+    # roughly 4MB of log lines
+    api.add_app('app-0', log_lines=50000)
+
+def setup_many_apps(api):
+    for i in range(100):
+        api.add_app('app-%s' % i, log_lines=0)
+
+# name, setup, argv, runs, how
+BENCHMARKS = [
+    ('cold_start', setup_one_app, ['--help'], 10, 'subprocess'),
+    ('cold_ps', setup_one_app, ['ps', '-a', 'app-0'], 10, 'subprocess'),
+    ('ps', setup_one_app, ['ps', '-a', 'app-0'], 30, 'runner'),
+    ('config', setup_one_app, ['config', '-a', 'app-0'], 30, 'runner'),
+    ('releases_10k', setup_releases, ['releases', '-a', 'app-0'], 10, 'runner'),
+    ('logs', setup_logs, ['logs', '-a', 'app-0', '-n', '50000', '-t'], 10, 'runner'),
+    ('config_set_500', setup_one_app, ['config:set', '-a', 'app-0'] + ['KEY_%s=value %s' % (i, i) for i in range(500)], 10, 'runner'),
+    ('fanout_100', setup_many_apps, ['--all-apps', 'ps'], 10, 'runner'),
+]
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def environment(url, home):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': ROOT,
+        'HOME': home,
+        'GIGALIXIR_DEV_HOST': url,
+        'GIGALIXIR_EMAIL': 'bench@example.com',
+        'GIGALIXIR_API_KEY': 'bench',
+        'GIGALIXIR_NO_AGENT': '1',
+        'GIGALIXIR_NO_CACHE': '1',
+    })
+    return env
+
+def run_subprocess(argv, env):
+    started = time.time()
+    process = subprocess.Popen([sys.executable, '-m', 'gigalixir_agent_client', '--env', 'dev'] + argv,
+                               env=env, cwd=env['HOME'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    elapsed = time.time() - started
+    if process.returncode != 0:
+        raise Exception("%s failed: %s" % (' '.join(argv), err.decode('utf-8', 'replace')))
+    return elapsed, len(out)
+
+def run_in_process(argv, env):
+    runner = CliRunner(env=env)
+    started = time.time()
+    result = runner.invoke(gigalixir.cli, ['--env', 'dev'] + argv)
+    elapsed = time.time() - started
+    if result.exit_code != 0:
+        raise Exception("%s failed: %s" % (' '.join(argv[:4]), result.output))
+    return elapsed, len(result.output_bytes)
+
+def measure(name, setup, argv, runs, how, rtt):
+    api = fake_api.FakeApi(latency=rtt, seed=0)
+    setup(api)
+    with fake_api.running(api=api) as server:
+        env = environment(server.url, tempfile.mkdtemp())
+        run_one = run_subprocess if how == 'subprocess' else run_in_process
+        # the first run warms up caches e.g. imports and pyc files
+        run_one(argv, env)
+        samples, output_bytes = [], 0
+        for _ in range(runs):
+            elapsed, output_bytes = run_one(argv, env)
+            samples.append(elapsed)
+    result = {
+        "runs": runs,
+        "how": how,
+        "p50": percentile(samples, 0.5),
+        "p95": percentile(samples, 0.95),
+        "mean": sum(samples) / len(samples),
+        "min": min(samples),
+        "output_bytes": output_bytes,
+    }
+    result["mb_per_s"] = output_bytes / 1e6 / result["p50"]
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    selected = [benchmark for benchmark in BENCHMARKS if not args.only or benchmark[0] in args.only]
+    results = {}
+    for name, setup, argv, runs, how in selected:
+        result = measure(name, setup, argv, args.runs or runs, how, args.rtt)
+        results[name] = result
+        # throughput only says something for commands that print a lot
+        throughput = "%9.2f MB/s" % result["mb_per_s"] if result["output_bytes"] > 1e6 else ""
+        print(("%-16s %-10s %8.1fms p50 %8.1fms p95 %s" % (name, how, 1000 * result["p50"], 1000 * result["p95"], throughput)).rstrip())
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rtt": args.rtt,
+            "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            return compare(json.load(f), report, args.threshold, args.min_delta)
+    return 0
+
+def compare(baseline, current, threshold=THRESHOLD, min_delta=MIN_DELTA):
+    """
+    Prints how every benchmark changed and returns 1 if any regressed.
+    """
+    if baseline["meta"].get("rtt") != current["meta"].get("rtt"):
+        print("warning: baseline was made with rtt %s, this run with %s" % (baseline["meta"].get("rtt"), current["meta"].get("rtt")))
+    regressions = []
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        if name not in current["results"]:
+            print("%-16s missing from this run" % name)
+            continue
+        if name not in baseline["results"]:
+            print("%-16s new, no baseline" % name)
+            continue
+        changes = []
+        for stat in ('p50', 'p95'):
+            before, after = baseline["results"][name][stat], current["results"][name][stat]
+            ratio = after / before if before else float('inf')
+            regressed = ratio > 1 + threshold and after - before > min_delta
+            if regressed:
+                regressions.append("%s %s" % (name, stat))
+            changes.append("%s %7.1fms -> %7.1fms %+6.1f%%%s" % (
+                stat, 1000 * before, 1000 * after, 100 * (ratio - 1), ' REGRESSED' if regressed else ''))
+        print("%-16s %s" % (name, '   '.join(changes)))
+    if regressions:
+        print("%s regressed by more than %d%%: %s" % (len(regressions), 100 * threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help="run the benchmarks")
+    run_parser.add_argument('--rtt', type=float, default=RTT, help="seconds the fake api waits before every response")
+    run_parser.add_argument('--runs', type=int, help="runs per benchmark instead of each one's default")
+    run_parser.add_argument('--only', nargs='+', choices=[benchmark[0] for benchmark in BENCHMARKS])
+    run_parser.add_argument('--out', help="write the results to this json file")
+    run_parser.add_argument('--baseline', help="compare the results with this json file")
+    compare_parser = commands.add_parser('compare', help="compare two results files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    for command_parser in (run_parser, compare_parser):
+        command_parser.add_argument('--threshold', type=float, default=THRESHOLD, help="allowed slowdown, 0.2 is 20%%")
+        command_parser.add_argument('--min-delta', type=float, default=MIN_DELTA, help="seconds a slowdown must exceed to count")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        sys.exit(run(args))
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(compare(baseline, current, args.threshold, args.min_delta))
+    else:
+        parser.print_help()
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,5 @@
+from . import timing
+_imports_started = timing.now()
 from .shell import cast, call
 from .routers.linux import LinuxRouter
 from .routers.darwin import DarwinRouter
@@ -5,39 +7,49 @@ from .routers.windows import WindowsRouter
 from .openers.linux import LinuxOpener
 from .openers.darwin import DarwinOpener
 from .openers.windows import WindowsOpener
-from . import observer as gigalixir_observer
-from . import user as gigalixir_user
-from . import app as gigalixir_app
-from . import config as gigalixir_config
-from . import permission as gigalixir_permission
-from . import release as gigalixir_release
-from . import api_key as gigalixir_api_key
-from . import ssh_key as gigalixir_ssh_key
-from . import log_drain as gigalixir_log_drain
-from . import payment_method as gigalixir_payment_method
-from . import domain as gigalixir_domain
-from . import invoice as gigalixir_invoice
-from . import usage as gigalixir_usage
-from . import database as gigalixir_database
-from . import free_database as gigalixir_free_database
-from . import canary as gigalixir_canary
+from .lazy import LazyModule
+# resource modules pull in requests, stripe, pygments, etc. They are imported
+# the first time a command touches them so `gigalixir help` and
+# `gigalixir version` stay fast.
+gigalixir_observer = LazyModule('gigalixir.observer')
+gigalixir_user = LazyModule('gigalixir.user')
+gigalixir_app = LazyModule('gigalixir.app')
+gigalixir_config = LazyModule('gigalixir.config')
+gigalixir_permission = LazyModule('gigalixir.permission')
+gigalixir_release = LazyModule('gigalixir.release')
+gigalixir_api_key = LazyModule('gigalixir.api_key')
+gigalixir_ssh_key = LazyModule('gigalixir.ssh_key')
+gigalixir_log_drain = LazyModule('gigalixir.log_drain')
+gigalixir_payment_method = LazyModule('gigalixir.payment_method')
+gigalixir_domain = LazyModule('gigalixir.domain')
+gigalixir_invoice = LazyModule('gigalixir.invoice')
+gigalixir_usage = LazyModule('gigalixir.usage')
+gigalixir_database = LazyModule('gigalixir.database')
+gigalixir_free_database = LazyModule('gigalixir.free_database')
+gigalixir_canary = LazyModule('gigalixir.canary')
+gigalixir_cache = LazyModule('gigalixir.cache')
+gigalixir_fanout = LazyModule('gigalixir.fanout')
+gigalixir_log_search = LazyModule('gigalixir.log_search')
+gigalixir_agent = LazyModule('gigalixir.agent')
+gigalixir_batch = LazyModule('gigalixir.batch')
+gigalixir_fleet = LazyModule('gigalixir.fleet')
+gigalixir_snapshot = LazyModule('gigalixir.snapshot')
+gigalixir_profiling = LazyModule('gigalixir.profiling')
+gigalixir_ssh_master = LazyModule('gigalixir.ssh_master')
+presenter = LazyModule('gigalixir.presenter')
+from .api_session import ApiSession, DEFAULT_RETRIES
+from .log_stream import LEVELS as LOG_LEVELS
+from .presenter import OUTPUTS
 from . import git
 import click
-import requests
-import getpass
-import stripe
 import subprocess
 import sys
 import re
-import uuid
-import rollbar
 import logging
-import json
-import netrc
 import os
 import platform
 from functools import wraps
-import pkg_resources
+timing.record('imports', _imports_started, timing.now())
 
 def _show_usage_error(self, file=None):
     if file is None:
@@ -51,17 +63,31 @@ def _show_usage_error(self, file=None):
 click.exceptions.UsageError.show = _show_usage_error
 
 ROLLBAR_POST_CLIENT_ITEM = "40403cdd48904a12b6d8d27050b12343"
-# kinda sorta duplicated in this file as an option to cli Command.
-# we need this at the "top" level so that handle_exception has access to rollbar
-# when it was in cli(), it didn't work. I guess that gets run a bit later, after
-# the command not found exception is raised.
-env = os.environ.get("GIGALIXIR_ENV", "prod")
-if env == "prod":
-    rollbar.init(ROLLBAR_POST_CLIENT_ITEM, 'production', enabled=True, allow_logging_basic_config=False)
-elif env == "dev":
-    rollbar.init(ROLLBAR_POST_CLIENT_ITEM, 'development', enabled=False, allow_logging_basic_config=False)
-else:
-    raise Exception("Invalid GIGALIXIR_ENV")
+STRIPE_API_KEYS = {
+    "prod": 'pk_live_45dmSl66k4xLy4X4yfF3RVpd',
+    "dev": 'pk_test_6tMDkFKTz4N0wIFQZHuzOUyW',
+}
+
+_rollbar = None
+
+def get_rollbar():
+    """
+    Imports and initializes rollbar the first time an error is reported.
+    This reads GIGALIXIR_ENV itself rather than the --env option because
+    handle_exception can run before cli() does e.g. for unknown commands.
+    """
+    global _rollbar
+    if _rollbar is None:
+        import rollbar
+        env = os.environ.get("GIGALIXIR_ENV", "prod")
+        if env == "prod":
+            rollbar.init(ROLLBAR_POST_CLIENT_ITEM, 'production', enabled=True, allow_logging_basic_config=False)
+        elif env == "dev":
+            rollbar.init(ROLLBAR_POST_CLIENT_ITEM, 'development', enabled=False, allow_logging_basic_config=False)
+        else:
+            raise Exception("Invalid GIGALIXIR_ENV")
+        _rollbar = rollbar
+    return _rollbar
 
 def detect_app_name(f):
     @wraps(f)
@@ -81,7 +107,7 @@ def report_errors(f):
         except:
             logging.getLogger("gigalixir-cli").error(sys.exc_info()[1])
             # rollbar.report_exc_info()
-            rollbar.report_exc_info(sys.exc_info(), payload_data={'fingerprint': rollbar_fingerprint(sys.exc_info())})
+            get_rollbar().report_exc_info(sys.exc_info(), payload_data={'fingerprint': rollbar_fingerprint(sys.exc_info())})
             sys.exit(1)
     return wrapper
 
@@ -128,9 +154,72 @@ def CatchAllExceptions(cls, handler):
 
 def handle_exception(cmd, info_name, exc):
     msg = 'command:{} {} error:{}'.format(info_name, cmd._original_args, exc)
-    rollbar.report_message(msg, 'warning')
+    get_rollbar().report_message(msg, 'warning')
+
+# read-only commands that can run against many apps at once with --apps or
+# --all-apps. Maps the command name to the function that fetches its data.
+FANOUT_COMMANDS = {
+    'ps': (gigalixir_app, 'app_status'),
+    'config': (gigalixir_config, 'configs'),
+    'releases': (gigalixir_release, 'releases'),
+    'pg': (gigalixir_database, 'databases'),
+    'drains': (gigalixir_log_drain, 'drains'),
+    'domains': (gigalixir_domain, 'domains'),
+    'canary': (gigalixir_canary, 'canaries'),
+    'access': (gigalixir_permission, 'permissions'),
+}
+
+def fanout_command(name):
+    @click.command(name=name)
+    @click.pass_context
+    @report_errors
+    def command(ctx):
+        session = ctx.obj['session']
+        app_names = ctx.obj['apps']
+        if app_names is None:
+            app_names = [app['unique_name'] for app in gigalixir_app.apps(session)]
+        module, function_name = FANOUT_COMMANDS[name]
+        results = gigalixir_fanout.run(session, app_names, getattr(module, function_name))
+        presenter.echo_json(results)
+        failures = [app_name for app_name in results if "error" in results[app_name]]
+        if len(failures) > 0:
+            raise Exception("%s failed for %s of %s apps." % (name, len(failures), len(results)))
+    return command
+
+PROFILE_KINDS = ['cpu', 'mem']
 
 class AliasedGroup(click.Group):
+    def parse_args(self, ctx, args):
+        # click 6 has no options with an optional value, so a bare --profile
+        # before the command gets its default here
+        args = list(args)
+        for i, arg in enumerate(args):
+            if arg == '--profile':
+                if i + 1 == len(args) or args[i + 1] not in PROFILE_KINDS:
+                    args.insert(i + 1, 'cpu')
+                break
+            if self.get_command(ctx, arg) is not None:
+                break
+        return click.Group.parse_args(self, ctx, args)
+
+    def invoke(self, ctx):
+        # profiles the group callback, the command and its report_errors
+        # handler so failures are profiled too
+        kind = ctx.params.get('profile')
+        if not kind:
+            return click.Group.invoke(self, ctx)
+        args = ctx.protected_args + ctx.args
+        with gigalixir_profiling.profiled(kind, ctx.params.get('profile_dir'), args[0] if args else None):
+            return click.Group.invoke(self, ctx)
+
+    def resolve_command(self, ctx, args):
+        cmd_name, cmd, args = click.Group.resolve_command(self, ctx, args)
+        if cmd is not None and (ctx.params.get('apps') or ctx.params.get('all_apps')):
+            if cmd.name not in FANOUT_COMMANDS:
+                ctx.fail("%s can not be used with --apps or --all-apps." % cmd_name)
+            cmd = fanout_command(cmd.name)
+        return cmd_name, cmd, args
+
     def get_command(self, ctx, cmd_name):
         rv = click.Group.get_command(self, ctx, cmd_name)
         if rv is not None:
@@ -187,9 +276,19 @@ class AliasedGroup(click.Group):
             return click.Group.get_command(self, ctx, aliases[cmd_name])
 
 def detect_app():
+    with timing.span('detect_app'):
+        return _detect_app()
+
+def _detect_app():
     try:
-        git.check_for_git()
-        remote = call("git remote -v")
+        # reading .git/config directly saves forking git twice on every
+        # command. git itself is only needed when the config is not plain.
+        urls = git.remote_urls()
+        if urls is not None:
+            remote = ''.join('%s \n' % url for url in urls)
+        else:
+            git.check_for_git()
+            remote = call("git remote -v")
         # matches first instance of
         # git.gigalixir.com/foo.git
         # git.gigalixir.com/foo.git/
@@ -203,26 +302,93 @@ def detect_app():
     except (AttributeError, subprocess.CalledProcessError):
         raise Exception("Could not detect app name. Try passing the app name explicitly with the `-a` flag or create an app with `gigalixir create`.")
 
+def start_timing(ctx, show_timing, trace, trace_format):
+    """
+    Times the command and reports the spans when it is done. The spans are
+    cleared either way so a long-lived process, e.g. the agent, does not
+    collect them forever.
+    """
+    if show_timing or trace:
+        timing.enable()
+    command = timing.span(ctx.invoked_subcommand or 'cli')
+    command.__enter__()
+
+    def finish():
+        command.__exit__(None, None, None)
+        try:
+            if show_timing:
+                for line in timing.summary():
+                    click.echo(line, err=True)
+            if trace:
+                timing.write_trace(trace, trace_format)
+        finally:
+            timing.reset()
+    ctx.call_on_close(finish)
+
+# group options batch does not pass on to its commands: it is the batch
+# that gets profiled, --apps and --all-apps can not be used with it and
+# every command gets a trace file of its own
+BATCH_SKIPPED_OPTIONS = ('apps', 'all_apps', 'profile', 'profile_dir', 'trace')
+
+def group_argv(ctx, skipped=()):
+    """
+    The group options ctx was invoked with, as they would be typed.
+    """
+    argv = []
+    for param in cli.params:
+        value = ctx.params.get(param.name)
+        if param.name in skipped or value is None or value is False:
+            continue
+        option = max(param.opts, key=len)
+        if param.is_flag:
+            argv.append(option)
+        else:
+            argv.extend([option, '%s' % value])
+    return argv
+
 @click.group(cls=AliasedGroup, context_settings=CONTEXT_SETTINGS)
 # @click.group(cls=CatchAllExceptions(AliasedGroup, handler=handle_exception), context_settings=CONTEXT_SETTINGS)
 @click.option('--env', envvar='GIGALIXIR_ENV', default='prod', help="GIGALIXIR environment [prod, dev].")
-@click.pass_context
-def cli(ctx, env):
+@click.option('--no-cache', 'no_cache', envvar='GIGALIXIR_NO_CACHE', is_flag=True, help="Do not use or update the local api response cache.")
+@click.option('--apps', help="Comma separated app names to run a read-only command against, e.g. ps, config, releases, pg, drains, domains, canary or access.")
+@click.option('--all-apps', 'all_apps', is_flag=True, help="Run a read-only command against every app in your account.")
+@click.option('--retries', envvar='GIGALIXIR_RETRIES', type=int, default=DEFAULT_RETRIES, help="Times to retry a request that failed with a connection error, 429, 502, 503 or 504.")
+@click.option('-o', '--output', type=click.Choice(OUTPUTS), help="Output format. Defaults to json, highlighted when printing to a terminal.")
+@click.option('--fields', help="Comma separated fields to print e.g. unique_name,size. Use dots for nested fields.")
+@click.option('--timing', 'show_timing', envvar='GIGALIXIR_TIMING', is_flag=True, help="Print how long each phase and request took to stderr.")
+@click.option('--trace', envvar='GIGALIXIR_TRACE', type=click.Path(dir_okay=False), help="Write the timings to this file as Chrome trace events.")
+@click.option('--trace-format', 'trace_format', envvar='GIGALIXIR_TRACE_FORMAT', type=click.Choice(timing.TRACE_FORMATS), default='chrome', help="Format of the --trace file, chrome or otlp json.")
+@click.option('--profile', envvar='GIGALIXIR_PROFILE', type=click.Choice(PROFILE_KINDS), help="Profile the command with cProfile (cpu, the default) or tracemalloc (mem) and write the reports, including a flame graph's collapsed stacks.")
+@click.option('--profile-dir', 'profile_dir', envvar='GIGALIXIR_PROFILE_DIR', type=click.Path(file_okay=False, exists=True), help="Directory to write --profile reports to. Defaults to the current directory.")
+@click.pass_context
+def cli(ctx, env, no_cache, apps, all_apps, retries, output, fields, show_timing, trace, trace_format, profile, profile_dir):
     ctx.obj = {}
+    start_timing(ctx, show_timing, trace, trace_format)
+    ctx.obj['output'] = output
+    ctx.obj['fields'] = presenter.parse_fields(fields)
+    if apps and all_apps:
+        raise click.UsageError("--apps and --all-apps can not be used together.")
+    ctx.obj['apps'] = gigalixir_fanout.parse_app_names(apps) if apps else None
     logging.basicConfig(format='%(message)s')
     logging.getLogger("gigalixir-cli").setLevel(logging.INFO)
 
     if env == "prod":
-        stripe.api_key = 'pk_live_45dmSl66k4xLy4X4yfF3RVpd'
         host = "https://api.gigalixir.com"
     elif env == "dev":
-        stripe.api_key = 'pk_test_6tMDkFKTz4N0wIFQZHuzOUyW'
-        host = "http://localhost:4000"
+        # e.g. a gigalixir.fake_api server on another port
+        host = os.environ.get('GIGALIXIR_DEV_HOST', "http://localhost:4000")
     else:
         raise Exception("Invalid GIGALIXIR_ENV")
 
     ctx.obj['host'] = host
     ctx.obj['env'] = env
+    ctx.obj['stripe_api_key'] = STRIPE_API_KEYS[env]
+    if no_cache:
+        response_cache = None
+    else:
+        response_cache = gigalixir_cache.ResponseCache(gigalixir_cache.response_cache_dir())
+    ctx.obj['session'] = ApiSession(host, response_cache, retries)
+    ctx.call_on_close(ctx.obj['session'].close)
 
     PLATFORM = platform.system().lower() # linux, darwin, or windows
     if PLATFORM == "linux":
@@ -280,7 +446,7 @@ def status(ctx, app_name):
     """
     Current app status.
     """
-    gigalixir_app.status(ctx.obj['host'], app_name)
+    gigalixir_app.status(ctx.obj['session'], app_name)
 
 @cli.command(name='pg:scale')
 @click.option('-a', '--app_name')
@@ -293,7 +459,16 @@ def scale_database(ctx, app_name, database_id, size):
     """
     Scale database. Find the database id by running `gigalixir pg`
     """
-    gigalixir_database.scale(ctx.obj['host'], app_name, database_id, size)
+    gigalixir_database.scale(ctx.obj['session'], app_name, database_id, size)
+
+@cli.command(name='cache:clear')
+@click.pass_context
+@report_errors
+def cache_clear(ctx):
+    """
+    Delete locally cached api responses.
+    """
+    gigalixir_cache.clear()
 
 @cli.command(name='ps:scale')
 @click.option('-a', '--app_name')
@@ -308,7 +483,7 @@ def scale(ctx, app_name, replicas, size):
     """
     if not app_name:
         raise Exception("app_name is required")
-    gigalixir_app.scale(ctx.obj['host'], app_name, replicas, size)
+    gigalixir_app.scale(ctx.obj['session'], app_name, replicas, size)
 
 @cli.command(name='releases:rollback')
 @click.option('-a', '--app_name')
@@ -320,7 +495,7 @@ def rollback(ctx, app_name, version):
     """
     Rollback to a previous release. 
     """
-    gigalixir_app.rollback(ctx.obj['host'], app_name, version)
+    gigalixir_app.rollback(ctx.obj['session'], app_name, version)
 
 
 @cli.command(name='ps:remote_console')
@@ -333,7 +508,7 @@ def remote_console(ctx, app_name, ssh_opts):
     """
     Drop into a remote console on a live production node.
     """
-    gigalixir_app.remote_console(ctx.obj['host'], app_name, ssh_opts)
+    gigalixir_app.remote_console(ctx.obj['session'], app_name, ssh_opts)
 
 @cli.command(name='ps:run')
 @click.option('-a', '--app_name')
@@ -346,7 +521,7 @@ def ps_run(ctx, app_name, ssh_opts, command):
     """
     Run a shell command on your running container.
     """
-    gigalixir_app.ps_run(ctx.obj['host'], app_name, ssh_opts, *command)
+    gigalixir_app.ps_run(ctx.obj['session'], app_name, ssh_opts, *command)
 
 @cli.command(name='ps:ssh')
 @click.option('-a', '--app_name')
@@ -359,7 +534,7 @@ def ssh(ctx, app_name, ssh_opts, command):
     """
     Ssh into app. Be sure you added your ssh key using gigalixir create ssh_key. Configs are not loaded automatically.
     """
-    gigalixir_app.ssh(ctx.obj['host'], app_name, ssh_opts, *command)
+    gigalixir_app.ssh(ctx.obj['session'], app_name, ssh_opts, *command)
 
 @cli.command(name='ps:distillery')
 @click.option('-a', '--app_name')
@@ -372,7 +547,7 @@ def distillery(ctx, app_name, ssh_opts, distillery_command):
     """
     Runs a distillery command to run on the remote container e.g. ping, remote_console. Be sure you've added your ssh key.
     """
-    gigalixir_app.distillery_command(ctx.obj['host'], app_name, ssh_opts, *distillery_command)
+    gigalixir_app.distillery_command(ctx.obj['session'], app_name, ssh_opts, *distillery_command)
 
 @cli.command(name='ps:restart')
 @click.option('-a', '--app_name')
@@ -383,7 +558,7 @@ def restart(ctx, app_name):
     """
     Restart app.
     """
-    gigalixir_app.restart(ctx.obj['host'], app_name)
+    gigalixir_app.restart(ctx.obj['session'], app_name)
 
 
 # gigalixir run mix ecto.migrate
@@ -397,7 +572,7 @@ def run(ctx, app_name, command):
     """
     Run shell command as a job in a separate process. Useful for migrating databases before the app is running.
     """
-    gigalixir_app.run(ctx.obj['host'], app_name, command)
+    gigalixir_app.run(ctx.obj['session'], app_name, command)
 
 @cli.command(name='ps:migrate')
 @click.option('-a', '--app_name')
@@ -410,7 +585,7 @@ def ps_migrate(ctx, app_name, migration_app_name, ssh_opts):
     """
     Run Ecto Migrations on a production node.
     """
-    gigalixir_app.migrate(ctx.obj['host'], app_name, migration_app_name, ssh_opts)
+    gigalixir_app.migrate(ctx.obj['session'], app_name, migration_app_name, ssh_opts)
 
 # @update.command()
 @cli.command(name='account:payment_method:set')
@@ -424,7 +599,7 @@ def set_payment_method(ctx, card_number, card_exp_month, card_exp_year, card_cvc
     """
     Set your payment method.
     """
-    gigalixir_payment_method.update(ctx.obj['host'], card_number, card_exp_month, card_exp_year, card_cvc)
+    gigalixir_payment_method.update(ctx.obj['session'], ctx.obj['stripe_api_key'], card_number, card_exp_month, card_exp_year, card_cvc)
 
 @cli.command(name='account:upgrade')
 @click.option('-y', '--yes', is_flag=True)
@@ -435,7 +610,7 @@ def upgrade(ctx, yes):
     Upgrade from free tier to standard tier.
     """
     if yes or click.confirm('Are you sure you want to upgrade to the standard tier?'):
-        gigalixir_user.upgrade(ctx.obj['host'])
+        gigalixir_user.upgrade(ctx.obj['session'])
 
 # @reset.command()
 @cli.command(name='account:password:set')
@@ -447,7 +622,7 @@ def set_password(ctx, token, password):
     """
     Set password using reset password token. Deprecated. Use the web form instead.
     """
-    gigalixir_user.reset_password(ctx.obj['host'], token, password)
+    gigalixir_user.reset_password(ctx.obj['session'], token, password)
 
 # @update.command()
 @cli.command(name='account:password:change')
@@ -460,7 +635,7 @@ def change_password(ctx, email, current_password, new_password):
     """
     Change password.
     """
-    gigalixir_user.change_password(ctx.obj['host'], email, current_password, new_password)
+    gigalixir_user.change_password(ctx.obj['session'], email, current_password, new_password)
 
 @cli.command()
 @click.pass_context
@@ -469,7 +644,7 @@ def account(ctx):
     """
     Account information.
     """
-    gigalixir_user.account(ctx.obj['host'])
+    gigalixir_user.account(ctx.obj['session'])
 
 # @update.command()
 @cli.command(name='account:api_key:reset')
@@ -482,7 +657,7 @@ def reset_api_key(ctx, email, password, yes):
     """
     Regenerate a replacement api key. 
     """
-    gigalixir_api_key.regenerate(ctx.obj['host'], email, password, yes, ctx.obj['env'])
+    gigalixir_api_key.regenerate(ctx.obj['session'], email, password, yes, ctx.obj['env'])
 
 
 @cli.command()
@@ -504,21 +679,41 @@ def login(ctx, email, password, yes):
     """
     Login and receive an api key.
     """
-    gigalixir_user.login(ctx.obj['host'], email, password, yes, ctx.obj['env'])
+    gigalixir_user.login(ctx.obj['session'], email, password, yes, ctx.obj['env'])
 
 # @get.command()
 @cli.command()
 @click.option('-a', '--app_name')
 @click.option('-n', '--num')
 @click.option('-t', '--no_tail', is_flag=True)
+@click.option('-g', '--grep', help='Only show lines matching this regular expression.')
+@click.option('-l', '--level', type=click.Choice(LOG_LEVELS), help='Only show lines at or above this level.')
+@click.option('-r', '--replica', help='Only show lines from this replica.')
+@click.option('--archive', type=click.Path(file_okay=False), help='Write compressed log segments to this directory instead of stdout.')
+@click.option('--rotate_mb', type=int, default=64, help='Start a new archive segment after this many megabytes of logs.')
+@click.option('--rotate_minutes', type=int, default=60, help='Start a new archive segment after this many minutes.')
 @click.pass_context
 @report_errors
 @detect_app_name
-def logs(ctx, app_name, num, no_tail):
+def logs(ctx, app_name, num, no_tail, grep, level, replica, archive, rotate_mb, rotate_minutes):
     """
     Stream logs from app.
     """
-    gigalixir_app.logs(ctx.obj['host'], app_name, num, no_tail)
+    gigalixir_app.logs(ctx.obj['session'], app_name, num, no_tail, grep, level, replica, archive, rotate_mb * 1024 * 1024, rotate_minutes * 60)
+
+@cli.command(name='logs:search')
+@click.option('--archive', type=click.Path(exists=True, file_okay=False), required=True, help='Directory written by logs --archive.')
+@click.option('--since', help='Only lines received at or after this time e.g. 2017-09-25T21:26:17 or 2h.')
+@click.option('--until', help='Only lines received at or before this time.')
+@click.option('-g', '--grep', help='Only lines matching this regular expression.')
+@click.option('-j', '--jobs', type=int, help='Number of processes to search with. Defaults to the number of cpus.')
+@click.pass_context
+@report_errors
+def logs_search(ctx, archive, since, until, grep, jobs):
+    """
+    Search archived logs.
+    """
+    gigalixir_log_search.echo_search(archive, since, until, grep, jobs)
 
 # @get.command()
 @cli.command(name='account:payment_method')
@@ -528,7 +723,7 @@ def payment_method(ctx):
     """
     Get your payment method.
     """
-    gigalixir_payment_method.get(ctx.obj['host'])
+    gigalixir_payment_method.get(ctx.obj['session'])
 
 # @get.command()
 @cli.command(name='drains')
@@ -540,7 +735,7 @@ def log_drains(ctx, app_name):
     """
     Get your log drains.
     """
-    gigalixir_log_drain.get(ctx.obj['host'], app_name)
+    gigalixir_log_drain.get(ctx.obj['session'], app_name)
 
 
 # @get.command()
@@ -551,7 +746,7 @@ def ssh_keys(ctx):
     """
     Get your ssh keys.
     """
-    gigalixir_ssh_key.get(ctx.obj['host'])
+    gigalixir_ssh_key.get(ctx.obj['session'])
 
 @cli.command(name="apps:info")
 @click.option('-a', '--app_name')
@@ -562,7 +757,7 @@ def app_info(ctx, app_name):
     """
     Get app info
     """
-    gigalixir_app.info(ctx.obj['host'], app_name)
+    gigalixir_app.info(ctx.obj['session'], app_name)
 
 # @get.command()
 @cli.command()
@@ -572,7 +767,7 @@ def apps(ctx):
     """
     Get apps.
     """
-    gigalixir_app.get(ctx.obj['host'])
+    gigalixir_app.get(ctx.obj['session'])
 
 # @get.command()
 @cli.command()
@@ -584,7 +779,7 @@ def releases(ctx, app_name):
     """
     Get previous releases for app.
     """
-    gigalixir_release.get(ctx.obj['host'], app_name)
+    gigalixir_release.get(ctx.obj['session'], app_name)
 
 
 # @get.command()
@@ -597,7 +792,7 @@ def permissions(ctx, app_name):
     """
     Get permissions for app.
     """
-    gigalixir_permission.get(ctx.obj['host'], app_name)
+    gigalixir_permission.get(ctx.obj['session'], app_name)
 
 # @create.command()
 @cli.command(name='drains:add')
@@ -610,7 +805,7 @@ def add_log_drain(ctx, app_name, url):
     """
     Add a drain to send your logs to.
     """
-    gigalixir_log_drain.create(ctx.obj['host'], app_name, url)
+    gigalixir_log_drain.create(ctx.obj['session'], app_name, url)
 
 
 # @create.command()
@@ -623,7 +818,7 @@ def add_ssh_key(ctx, ssh_key):
     Add an ssh key. Make sure you use the actual key and not the filename as the argument. For example,
     don't use ~/.ssh/id_rsa.pub, use the contents of that file.
     """
-    gigalixir_ssh_key.create(ctx.obj['host'], ssh_key)
+    gigalixir_ssh_key.create(ctx.obj['session'], ssh_key)
 
 # @create.command()
 @cli.command(name='domains:add')
@@ -636,7 +831,7 @@ def add_domain(ctx, app_name, fully_qualified_domain_name):
     """
     Adds a custom domain name to your app. 
     """
-    gigalixir_domain.create(ctx.obj['host'], app_name, fully_qualified_domain_name)
+    gigalixir_domain.create(ctx.obj['session'], app_name, fully_qualified_domain_name)
 
 # @create.command()
 @cli.command(name='deprecated:set_config')
@@ -650,7 +845,7 @@ def set_config(ctx, app_name, key, value):
     """
     Set an app configuration/environment variable.
     """
-    gigalixir_config.create(ctx.obj['host'], app_name, key, value)
+    gigalixir_config.create(ctx.obj['session'], app_name, key, value)
 
 @cli.command(name="config:copy")
 @click.option('-s', '--src_app_name', required=True)
@@ -666,7 +861,7 @@ def config_copy(ctx, src_app_name, dst_app_name, yes):
     """
     logging.getLogger("gigalixir-cli").info("WARNING: This will copy all configs from %s to %s. This might overwrite some configs in %s." % (src_app_name, dst_app_name, dst_app_name))
     if yes or click.confirm('Are you sure you want to continue?'):
-        gigalixir_config.copy(ctx.obj['host'], src_app_name, dst_app_name)
+        gigalixir_config.copy(ctx.obj['session'], src_app_name, dst_app_name)
 
 @cli.command(name="config:set")
 @click.option('-a', '--app_name')
@@ -686,7 +881,7 @@ def config_set(ctx, app_name, assignments):
     for assignment in assignments:
         key, value = assignment.split('=', 1)
         configs[key] = value
-    gigalixir_config.create_multiple(ctx.obj['host'], app_name, configs)
+    gigalixir_config.create_multiple(ctx.obj['session'], app_name, configs)
 
 # @get.command()
 @cli.command(name='account:confirmation:resend')
@@ -697,7 +892,7 @@ def send_email_confirmation_token(ctx, email):
     """
     Regenerate a email confirmation token and send to email.
     """
-    gigalixir_user.get_confirmation_token(ctx.obj['host'], email)
+    gigalixir_user.get_confirmation_token(ctx.obj['session'], email)
 
 # @get.command()
 @cli.command(name='account:password:reset')
@@ -708,7 +903,7 @@ def send_reset_password_token(ctx, email):
     """
     Send reset password token to email.
     """
-    gigalixir_user.get_reset_password_token(ctx.obj['host'], email)
+    gigalixir_user.get_reset_password_token(ctx.obj['session'], email)
 
 # @get.command()
 @cli.command(name='pg')
@@ -720,7 +915,7 @@ def databases(ctx, app_name):
     """
     Get databases for your app.
     """
-    gigalixir_database.get(ctx.obj['host'], app_name)
+    gigalixir_database.get(ctx.obj['session'], app_name)
 
 # @get.command()
 # deprecated. pg/databases above lists free and standard.
@@ -733,7 +928,7 @@ def free_databases(ctx, app_name):
     """
     Get free databases for your app.
     """
-    gigalixir_free_database.get(ctx.obj['host'], app_name)
+    gigalixir_free_database.get(ctx.obj['session'], app_name)
 
 # @get.command()
 @cli.command()
@@ -745,7 +940,7 @@ def domains(ctx, app_name):
     """
     Get custom domains for your app.
     """
-    gigalixir_domain.get(ctx.obj['host'], app_name)
+    gigalixir_domain.get(ctx.obj['session'], app_name)
 
 # @get.command()
 @cli.command()
@@ -757,7 +952,7 @@ def config(ctx, app_name):
     """
     Get app configuration/environment variables.
     """
-    gigalixir_config.get(ctx.obj['host'], app_name)
+    gigalixir_config.get(ctx.obj['session'], app_name)
 
 # @delete.command()
 @cli.command(name='drains:remove')
@@ -770,7 +965,7 @@ def delete_log_drain(ctx, app_name, drain_id):
     """
     Deletes a log drain. Find the drain_id from gigalixir log_drains.
     """
-    gigalixir_log_drain.delete(ctx.obj['host'], app_name, drain_id)
+    gigalixir_log_drain.delete(ctx.obj['session'], app_name, drain_id)
 
 # @delete.command()
 @cli.command(name='account:ssh_keys:remove')
@@ -781,7 +976,7 @@ def delete_ssh_key(ctx, key_id):
     """
     Deletes your ssh key. Find the key_id from gigalixir get_ssh_keys.
     """
-    gigalixir_ssh_key.delete(ctx.obj['host'], key_id)
+    gigalixir_ssh_key.delete(ctx.obj['session'], key_id)
 
 @cli.command(name='apps:destroy')
 @click.option('-a', '--app_name')
@@ -795,7 +990,7 @@ def delete_app(ctx, app_name, yes):
     """
     logging.getLogger("gigalixir-cli").info("WARNING: Deleting an app can not be undone and the name can not be reused.")
     if yes or click.confirm('Do you want to delete your app?'):
-        gigalixir_app.delete(ctx.obj['host'], app_name)
+        gigalixir_app.delete(ctx.obj['session'], app_name)
 
 # @delete.command()
 @cli.command(name='access:remove')
@@ -808,7 +1003,7 @@ def delete_permission(ctx, app_name, email):
     """
     Denies user access to app.
     """
-    gigalixir_permission.delete(ctx.obj['host'], app_name, email)
+    gigalixir_permission.delete(ctx.obj['session'], app_name, email)
 
 # @delete.command()
 @cli.command(name='pg:destroy')
@@ -826,7 +1021,7 @@ def delete_database(ctx, app_name, yes, database_id):
     logging.getLogger("gigalixir-cli").info("WARNING: This can not be undone.")
     logging.getLogger("gigalixir-cli").info("WARNING: Please make sure you backup your data first.")
     if yes or click.confirm('Do you want to delete your database and all backups?'):
-        gigalixir_database.delete(ctx.obj['host'], app_name, database_id)
+        gigalixir_database.delete(ctx.obj['session'], app_name, database_id)
 
 # @delete.command()
 # is this command still needed? i think delete_database/pg:destroy above can delete free databases?
@@ -845,7 +1040,7 @@ def delete_free_database(ctx, app_name, yes, database_id):
     logging.getLogger("gigalixir-cli").info("WARNING: This can not be undone.")
     logging.getLogger("gigalixir-cli").info("WARNING: Please make sure you backup your data first.")
     if yes or click.confirm('Do you want to delete your database?'):
-        gigalixir_free_database.delete(ctx.obj['host'], app_name, database_id)
+        gigalixir_free_database.delete(ctx.obj['session'], app_name, database_id)
 
 # @delete.command()
 @cli.command(name='domains:remove')
@@ -858,7 +1053,7 @@ def delete_domain(ctx, app_name, fully_qualified_domain_name):
     """
     Delete custom domain from your app.
     """
-    gigalixir_domain.delete(ctx.obj['host'], app_name, fully_qualified_domain_name)
+    gigalixir_domain.delete(ctx.obj['session'], app_name, fully_qualified_domain_name)
 
 # @delete.command()
 @cli.command(name='config:unset')
@@ -871,7 +1066,7 @@ def delete_config(ctx, app_name, key):
     """
     Delete app configuration/environment variables.
     """
-    gigalixir_config.delete(ctx.obj['host'], app_name, key)
+    gigalixir_config.delete(ctx.obj['session'], app_name, key)
 
 # @create.command()
 @cli.command(name='access:add')
@@ -884,7 +1079,7 @@ def add_permission(ctx, app_name, email):
     """
     Grants a user permission to deploy an app.
     """
-    gigalixir_permission.create(ctx.obj['host'], app_name, email)
+    gigalixir_permission.create(ctx.obj['session'], app_name, email)
 
 
 @cli.command(name='pg:psql')
@@ -896,7 +1091,7 @@ def pg_psql(ctx, app_name):
     """
     Connect to the database using psql
     """
-    gigalixir_database.psql(ctx.obj['host'], app_name)
+    gigalixir_database.psql(ctx.obj['session'], app_name)
 
 @cli.command(name='pg:create')
 @click.option('-a', '--app_name')
@@ -917,9 +1112,9 @@ def create_database(ctx, app_name, size, cloud, region, free, yes):
             raise Exception("Sorry, free tier databases only run on gcp in us-central1. Try creating a standard database instead.")
         else:
             if yes or click.confirm("A word of caution: Free tier databases are not suitable for production and migrating from a free db to a standard db is not trivial. Do you wish to continue?"):
-                gigalixir_free_database.create(ctx.obj['host'], app_name)
+                gigalixir_free_database.create(ctx.obj['session'], app_name)
     else:
-        gigalixir_database.create(ctx.obj['host'], app_name, size, cloud, region)
+        gigalixir_database.create(ctx.obj['session'], app_name, size, cloud, region)
 
 @cli.command(name='deprecated:create_free_database')
 @click.option('-a', '--app_name')
@@ -930,7 +1125,7 @@ def create_free_database(ctx, app_name):
     """
     Create a new free database for app.
     """
-    gigalixir_free_database.create(ctx.obj['host'], app_name)
+    gigalixir_free_database.create(ctx.obj['session'], app_name)
 
 # @create.command()
 @cli.command(name='git:remote')
@@ -941,7 +1136,7 @@ def set_git_remote(ctx, app_name):
     """
     Set the gigalixir git remote.
     """
-    gigalixir_app.set_git_remote(ctx.obj['host'], app_name)
+    gigalixir_app.set_git_remote(ctx.obj['session'], app_name)
 
 # @create.command()
 @cli.command(name='apps:create')
@@ -955,7 +1150,7 @@ def create(ctx, name, cloud, region, stack):
     """
     Create a new app.
     """
-    gigalixir_app.create(ctx.obj['host'], name, cloud, region, stack)
+    gigalixir_app.create(ctx.obj['session'], name, cloud, region, stack)
 
 @cli.command(name='account:invoices')
 @click.pass_context
@@ -964,7 +1159,7 @@ def invoices(ctx):
     """
     List all previous invoices.
     """
-    gigalixir_invoice.get(ctx.obj['host'])
+    gigalixir_invoice.get(ctx.obj['session'])
 
 @cli.command(name='account:usage')
 @click.pass_context
@@ -973,7 +1168,7 @@ def current_period_usage(ctx):
     """
     See the usage so far this month.
     """
-    gigalixir_usage.get(ctx.obj['host'])
+    gigalixir_usage.get(ctx.obj['session'])
 
 # @create.command()
 @cli.command()
@@ -994,13 +1189,13 @@ def signup(ctx, email, password, accept_terms_of_service_and_privacy_policy):
 
     if email == None:
         email = click.prompt('Email')
-    gigalixir_user.validate_email(ctx.obj['host'], email)
+    gigalixir_user.validate_email(ctx.obj['session'], email)
 
     if password == None:
         password = click.prompt('Password', hide_input=True)
-    gigalixir_user.validate_password(ctx.obj['host'], password)
+    gigalixir_user.validate_password(ctx.obj['session'], password)
 
-    gigalixir_user.create(ctx.obj['host'], email, password, accept_terms_of_service_and_privacy_policy)
+    gigalixir_user.create(ctx.obj['session'], email, password, accept_terms_of_service_and_privacy_policy)
 
 @cli.command(name='ps:observer')
 @click.option('-a', '--app_name')
@@ -1015,6 +1210,26 @@ def observer(ctx, app_name, cookie, ssh_opts):
     """
     gigalixir_observer.observer(ctx, app_name, cookie, ssh_opts)
 
+@cli.command(name='ssh:connections')
+@click.option('-a', '--app_name', help="Only this app's connections.")
+@click.option('--close', is_flag=True, help="Close the connections instead of listing them.")
+@click.pass_context
+@report_errors
+def ssh_connections(ctx, app_name, close):
+    """
+    List or close shared ssh connections.
+
+    ps:ssh, ps:run, ps:migrate, ps:remote_console, ps:distillery and
+    ps:observer share one ssh connection per app, which stays open for
+    10 minutes after the last command. Set GIGALIXIR_SSH_MULTIPLEX=0 to
+    connect separately every time.
+    """
+    if close:
+        presenter.echo_json(gigalixir_ssh_master.close(app_name))
+    else:
+        connections = gigalixir_ssh_master.connections()
+        presenter.echo_json([c for c in connections if app_name is None or c["app"] == app_name])
+
 @cli.command()
 @click.pass_context
 @report_errors
@@ -1022,8 +1237,130 @@ def version(ctx):
     """
     Show the CLI version.
     """
-    click.echo(pkg_resources.get_distribution("gigalixir").version)
+    try:
+        from importlib import metadata
+        click.echo(metadata.version("gigalixir"))
+    except ImportError:
+        import pkg_resources
+        click.echo(pkg_resources.get_distribution("gigalixir").version)
+
+@cli.command(name='snapshot')
+@click.option('--config-values', 'config_values', is_flag=True, help="Store config values too. By default only config keys are stored.")
+@click.option('--db', type=click.Path(dir_okay=False), help="SQLite file to keep the snapshot in. Defaults to ~/.cache/gigalixir/snapshot.sqlite3.")
+@click.pass_context
+@report_errors
+def snapshot(ctx, config_values, db):
+    """
+    Copy the state of all your apps into a local database.
 
+    Stores apps, status, releases, configs, databases, domains, drains and
+    canaries so that `gigalixir query` can answer questions about all of
+    them at once. Running it again only downloads what changed.
+    """
+    summary = gigalixir_snapshot.refresh(ctx.obj['session'], db or gigalixir_snapshot.db_path(), config_values)
+    presenter.echo_json(summary)
+    if "errors" in summary:
+        raise Exception("Could not refresh %s resources." % len(summary["errors"]))
+
+@cli.command(name='query')
+@click.argument('sql')
+@click.option('--db', type=click.Path(dir_okay=False), help="SQLite file the snapshot is in. Defaults to ~/.cache/gigalixir/snapshot.sqlite3.")
+@click.pass_context
+@report_errors
+def query(ctx, sql, db):
+    """
+    Query the local snapshot with SQL.
+
+    Does not contact the api. Tables are apps, status, releases, configs,
+    databases, domains, drains and canaries, each with an app column, e.g.
+
+    gigalixir query "select app from status where replicas_desired > 2"
+    """
+    presenter.echo_json(gigalixir_snapshot.query(db or gigalixir_snapshot.db_path(), sql))
+
+@cli.command(name='plan')
+@click.option('-f', '--file', 'fleet_file', type=click.File('r'), required=True, help="Fleet file with the settings of each app.")
+@click.option('--parallel', type=click.IntRange(1, None), default=8, help="Number of requests to make at the same time.")
+@click.pass_context
+@report_errors
+def plan(ctx, fleet_file, parallel):
+    """
+    Show what apply would change.
+
+    Compares the apps in a fleet file with their current replicas, size,
+    stack, configs, domains, drains, canary and permissions and prints the
+    changes needed to make them match. Config values are not printed.
+    """
+    desired = gigalixir_fleet.load(fleet_file)
+    changes = gigalixir_fleet.plan(ctx.obj['session'], desired, parallel)
+    presenter.echo_json([gigalixir_fleet.describe(change) for change in changes])
+
+@cli.command(name='apply')
+@click.option('-f', '--file', 'fleet_file', type=click.File('r'), required=True, help="Fleet file with the settings of each app.")
+@click.option('--parallel', type=click.IntRange(1, None), default=8, help="Number of requests to make at the same time. Each app's changes are applied one at a time.")
+@click.pass_context
+@report_errors
+def apply(ctx, fleet_file, parallel):
+    """
+    Make apps match a fleet file.
+
+    Only the settings that differ are changed, so a fleet that is already
+    up to date makes no changes. See `gigalixir plan`.
+    """
+    session = ctx.obj['session']
+    desired = gigalixir_fleet.load(fleet_file)
+    changes = gigalixir_fleet.plan(session, desired, parallel)
+    results = gigalixir_fleet.apply(session, changes, parallel)
+    presenter.echo_json(results)
+    failures = [result for result in results if "error" in result]
+    if len(failures) > 0:
+        raise Exception("%s of %s changes failed." % (len(failures), len(results)))
+
+@cli.command(name='batch')
+@click.option('-f', '--file', 'commands_file', type=click.File('r'), default='-', help="File with one command per line. Defaults to stdin.")
+@click.option('--parallel', type=click.IntRange(1, None), default=1, help="Number of commands to run at the same time. Only use this for commands that do not depend on each other.")
+@click.option('--stop-on-error', 'stop_on_error', is_flag=True, help="Skip the remaining commands once one fails.")
+@click.option('--report', type=click.File('w'), default='-', help="Where to write the report. Defaults to stdout.")
+@click.pass_context
+@report_errors
+def batch(ctx, commands_file, parallel, stop_on_error, report):
+    """
+    Run many commands in one process.
+
+    Each line is a command as you would type it after `gigalixir`, e.g.
+    `config:set -a my-app FOO=bar`. Blank lines and lines starting with #
+    are skipped. Every command shares the same api connections. Prints a
+    line of json per command with its exit code, timing and output.
+
+    Options given before `batch`, e.g. --env or --retries, apply to every
+    command. With --trace each command writes its own trace, to the
+    given path plus its line number.
+    """
+    commands = gigalixir_batch.parse(commands_file)
+    results = gigalixir_batch.run(commands, parallel, stop_on_error,
+                                  group_argv(ctx.parent, BATCH_SKIPPED_OPTIONS), ctx.parent.params['trace'])
+    failures = gigalixir_batch.write_report(results, report)
+    if failures > 0:
+        raise Exception("%s of %s commands failed." % (failures, len(commands)))
+
+@cli.command(name='agent')
+@click.option('--stop', is_flag=True, help="Stop the running agent.")
+@click.pass_context
+@report_errors
+def run_agent(ctx, stop):
+    """
+    Run commands from a background agent to skip startup costs.
+
+    Keeps imports, credentials and api connections warm so that scripts
+    calling gigalixir many times run faster. Runs until stopped, so start it
+    with `gigalixir agent &`. Commands fall back to running on their own
+    when no agent is running.
+    """
+    if stop:
+        if not gigalixir_agent.stop():
+            raise Exception("No agent is running.")
+    else:
+        gigalixir_agent.serve()
 
 @cli.command(name='open')
 @click.option('-a', '--app_name')
@@ -1043,7 +1380,7 @@ def pg_backups(ctx, app_name, database_id):
     """
     List available backups. Find the database id by running `gigalixir pg`
     """
-    gigalixir_database.backups(ctx.obj['host'], app_name, database_id)
+    gigalixir_database.backups(ctx.obj['session'], app_name, database_id)
 
 @cli.command(name='pg:backups:restore')
 @click.option('-a', '--app_name')
@@ -1057,7 +1394,7 @@ def pg_backups_restore(ctx, app_name, database_id, backup_id):
     Restore database from backup. Find the database id by running `gigalixir pg`
 
     """
-    gigalixir_database.restore(ctx.obj['host'], app_name, database_id, backup_id)
+    gigalixir_database.restore(ctx.obj['session'], app_name, database_id, backup_id)
 
 @cli.command(name='stack:set')
 @click.option('-a', '--app_name')
@@ -1069,7 +1406,7 @@ def set_stack(ctx, app_name, stack):
     """
     Set your app stack.
     """
-    gigalixir_app.set_stack(ctx.obj['host'], app_name, stack)
+    gigalixir_app.set_stack(ctx.obj['session'], app_name, stack)
 
 @cli.command(name='canary')
 @click.option('-a', '--app_name')
@@ -1080,7 +1417,7 @@ def canary(ctx, app_name):
     """
     Get canary
     """
-    gigalixir_canary.get(ctx.obj['host'], app_name)
+    gigalixir_canary.get(ctx.obj['session'], app_name)
 
 @cli.command(name='canary:set')
 @click.option('-a', '--app_name')
@@ -1093,7 +1430,7 @@ def set_canary(ctx, app_name, canary_name, weight):
     """
     Set a canary and weight for your app.
     """
-    gigalixir_canary.set(ctx.obj['host'], app_name, canary_name, weight)
+    gigalixir_canary.set(ctx.obj['session'], app_name, canary_name, weight)
 
 @cli.command(name='canary:unset')
 @click.option('-a', '--app_name')
@@ -1105,5 +1442,5 @@ def unset_canary(ctx, app_name, canary_name):
     """
     Unset a canary for your app.
     """
-    gigalixir_canary.delete(ctx.obj['host'], app_name, canary_name)
+    gigalixir_canary.delete(ctx.obj['session'], app_name, canary_name)
 
@@ -0,0 +1,3 @@
+from gigalixir_agent_client import main
+
+main()
@@ -0,0 +1,175 @@
+"""
+The `gigalixir agent` process. It runs the commands gigalixir_agent_client
+hands it one at a time, because they share the process' stdout,
+environment and working directory, and keeps the api connections, parsed
+credentials and git config warm between them.
+"""
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+from gigalixir_agent_client import (
+    STOP, STDOUT, STDERR, STDIN, EXIT,
+    socket_path, send_frame, recv_frame, command_name, connect, forward,
+)
+
+class FrameWriter(io.RawIOBase):
+    def __init__(self, sock, kind, tty):
+        self.sock = sock
+        self.kind = kind
+        self.tty = tty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, data):
+        send_frame(self.sock, self.kind, bytes(data))
+        return len(data)
+
+class FrameReader(io.RawIOBase):
+    """
+    Reads the client's stdin only when a command asks for input, e.g. to
+    confirm deleting an app.
+    """
+    def __init__(self, sock, tty):
+        self.sock = sock
+        self.tty = tty
+
+    def readable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def readinto(self, b):
+        send_frame(self.sock, STDIN, struct.pack('!I', len(b)))
+        kind, data = recv_frame(self.sock)
+        b[:len(data)] = data
+        return len(data)
+
+class StderrProxy(object):
+    """
+    Logging handlers keep the stream they were created with. This one always
+    writes to whichever client is running a command.
+    """
+    def write(self, data):
+        sys.stderr.write(data)
+
+    def flush(self):
+        sys.stderr.flush()
+
+def run_command(sock, request):
+    """
+    Runs the requested command with the client's stdio, environment and
+    working directory and returns its exit code.
+    """
+    from . import runner
+    saved = sys.stdin, sys.stdout, sys.stderr, dict(os.environ), os.getcwd()
+    sys.stdin = io.TextIOWrapper(io.BufferedReader(FrameReader(sock, request['stdin_tty'])), encoding='utf-8')
+    sys.stdout = io.TextIOWrapper(io.BufferedWriter(FrameWriter(sock, STDOUT, request['stdout_tty'])), encoding='utf-8', line_buffering=True)
+    sys.stderr = io.TextIOWrapper(io.BufferedWriter(FrameWriter(sock, STDERR, request['stderr_tty'])), encoding='utf-8', line_buffering=True)
+    os.environ.clear()
+    os.environ.update(request['env'])
+    try:
+        try:
+            os.chdir(request['cwd'])
+        except OSError as e:
+            sys.stderr.write('%s\n' % e)
+            code = 1
+        else:
+            code = runner.exit_code(request['argv'])
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        sys.stdin, sys.stdout, sys.stderr, env, cwd = saved
+        os.environ.clear()
+        os.environ.update(env)
+        os.chdir(cwd)
+    return code
+
+class Agent(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.server = None
+
+    def handle(self, sock):
+        try:
+            kind, payload = recv_frame(sock)
+            if kind == STOP:
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            request = json.loads(payload.decode('utf-8'))
+            with self.lock:
+                code = run_command(sock, request)
+            send_frame(sock, EXIT, json.dumps(code).encode('utf-8'))
+        except (EOFError, socket.error):
+            # the client went away
+            pass
+
+    def serve(self):
+        import logging
+        from six.moves import socketserver
+        from . import api_session
+        agent = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                agent.handle(self.request)
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        api_session.share_sessions()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        running = connect(self.path)
+        if running is not None:
+            running.close()
+            raise Exception("An agent is already listening on %s." % self.path)
+        if os.path.exists(self.path):
+            # left behind by an agent that was killed
+            os.unlink(self.path)
+        old_umask = os.umask(0o077)
+        try:
+            self.server = Server(self.path, Handler)
+        finally:
+            os.umask(old_umask)
+        # route the cli's messages to the client instead of the agent's
+        # terminal
+        logger = logging.getLogger("gigalixir-cli")
+        handler = logging.StreamHandler(StderrProxy())
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        propagate, logger.propagate = logger.propagate, False
+        try:
+            self.server.serve_forever()
+        finally:
+            logger.removeHandler(handler)
+            logger.propagate = propagate
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+def serve(path=None):
+    Agent(path or socket_path()).serve()
+
+def stop(path=None):
+    """
+    Asks the agent to exit. Returns False if none is running.
+    """
+    sock = connect(path)
+    if sock is None:
+        return False
+    try:
+        send_frame(sock, STOP)
+    finally:
+        sock.close()
+    return True
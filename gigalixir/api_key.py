@@ -1,12 +1,11 @@
-import requests
 from . import auth
 from . import netrc
 import json
 import click
 import logging
 
-def regenerate(host, email, password, yes, env):
-    r = requests.post('%s/api/api_keys' % host, auth = (email, password))
+def regenerate(session, email, password, yes, env):
+    r = session.post('/api/api_keys', auth = (email, password))
     if r.status_code != 201:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -0,0 +1,206 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from . import cache
+from . import credentials
+from . import timing
+
+# The pool is sized for commands that issue several requests in a row (ssh,
+# observer) as well as for callers that share one session across threads.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+# Transient failures are retried with jittered exponential backoff. Only
+# requests that are safe to repeat are retried: reads, and requests sent
+# with idempotent=True. Some PUTs are actions e.g. restart, so PUT and
+# DELETE are only retried when the caller says so.
+DEFAULT_RETRIES = 3
+RETRY_STATUSES = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 10
+# never wait longer than this for a Retry-After
+RETRY_AFTER_MAX = 60
+
+# host => requests.Session kept open across commands by `gigalixir agent`.
+# None unless share_sessions() was called.
+_shared_sessions = None
+# guards creating sessions, which fan-out commands do from several threads
+# at once
+_session_lock = threading.Lock()
+
+def share_sessions():
+    """
+    Makes every ApiSession for a host reuse one pool of connections instead
+    of opening its own, for processes that run many commands.
+    """
+    global _shared_sessions
+    if _shared_sessions is None:
+        _shared_sessions = {}
+
+class ApiSession(object):
+    """
+    Keep-alive connection to the GIGALIXIR api. One of these is created per
+    cli invocation and passed to every resource module instead of the host so
+    that consecutive requests reuse the same TCP+TLS connection.
+
+    Read-only requests made with cached=True are answered from the on-disk
+    response cache when possible. Any other request to a resource drops the
+    cached entries for it.
+    """
+    def __init__(self, host, response_cache=None, retries=DEFAULT_RETRIES):
+        self.host = host
+        self.cache = response_cache
+        self.retries = retries
+        self._session = None
+
+    @property
+    def session(self):
+        # requests is slow to import, so wait until the first api call.
+        if self._session is None:
+            with _session_lock:
+                if self._session is None:
+                    self._session = self._new_session()
+        return self._session
+
+    def _new_session(self):
+        session = None
+        if _shared_sessions is not None:
+            session = _shared_sessions.get(self.host)
+        if session is None:
+            session = new_session()
+            if _shared_sessions is not None:
+                _shared_sessions[self.host] = session
+        else:
+            session.cookies.clear()
+        # resolve the credentials once instead of letting requests parse
+        # ~/.netrc on every request. requests still honors an explicit
+        # auth= passed to a single request e.g. for login.
+        session.auth = credentials.get_auth(self.host)
+        return session
+
+    def url(self, path):
+        return '%s%s' % (self.host, path)
+
+    def request(self, method, path, cached=False, retries=None, idempotent=False, **kwargs):
+        """
+        retries overrides the session's number of retries for this request.
+        idempotent=True sends an Idempotency-Key and allows retries, for
+        POSTs, PUTs and DELETEs the api can safely get twice.
+        """
+        if idempotent:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers.setdefault('Idempotency-Key', str(uuid.uuid4()))
+            kwargs['headers'] = headers
+        if not (idempotent or method in IDEMPOTENT_METHODS):
+            retries = 0
+        elif retries is None:
+            retries = self.retries
+        if self.cache is not None:
+            if method == 'GET' and cached:
+                return self._cached_get(path, retries, **kwargs)
+            elif method != 'GET':
+                self.cache.invalidate(cache.invalidation_prefix(path))
+        return self._send(method, path, retries, **kwargs)
+
+    def _send(self, method, path, retries, **kwargs):
+        import requests
+        attempt = 0
+        while True:
+            try:
+                with timing.span('%s %s' % (method, path), 'http', attempt=attempt) as request_span:
+                    r = self.session.request(method, self.url(path), **kwargs)
+                    request_span.args['status'] = r.status_code
+                    headers_at = timing.headers_received_at()
+                    if headers_at is not None and headers_at > request_span.start and not kwargs.get('stream'):
+                        timing.record('download', headers_at, timing.now(), 'http')
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= retries:
+                    raise
+                delay = retry_delay(attempt)
+                logging.getLogger("gigalixir-cli").debug("%s %s failed: %s" % (method, path, e))
+            else:
+                if r.status_code not in RETRY_STATUSES or attempt >= retries:
+                    return r
+                delay = retry_delay(attempt, r.headers.get('Retry-After'))
+                r.close()
+                logging.getLogger("gigalixir-cli").debug("%s %s returned %s" % (method, path, r.status_code))
+            logging.getLogger("gigalixir-cli").info("Retrying in %.1fs." % delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _login(self):
+        if isinstance(self.session.auth, tuple):
+            return self.session.auth[0]
+        return None
+
+    def _cached_get(self, path, retries, **kwargs):
+        key = self.cache.key(self.url(path), kwargs.get('params'), self._login())
+        entry = self.cache.get(key)
+        ttl = cache.ttl_for(path) or 0
+        if entry is not None and time.time() - entry['stored_at'] < ttl:
+            return cache.to_response(entry)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        r = self._send('GET', path, retries, headers=headers, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            entry['stored_at'] = time.time()
+            self.cache.put(key, entry)
+            return cache.to_response(entry)
+        if r.status_code == 200:
+            self.cache.put(key, cache.from_response(path, r))
+        return r
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        if self._session is not None and _shared_sessions is None:
+            self._session.close()
+
+def new_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    if timing.enabled():
+        timing.instrument(adapter)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Content-Type': 'application/json',
+    })
+    return session
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Seconds to wait before retry number attempt + 1. A Retry-After header,
+    either in seconds or an http date, takes precedence.
+    """
+    if retry_after:
+        from email.utils import parsedate_tz, mktime_tz
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            parsed = parsedate_tz(retry_after)
+            seconds = mktime_tz(parsed) - time.time() if parsed else None
+        if seconds is not None:
+            return min(RETRY_AFTER_MAX, max(0, seconds))
+    delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
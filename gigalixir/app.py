@@ -4,32 +4,39 @@ import logging
 import urllib
 import json
 import subprocess
-import requests
 import click
 from .shell import cast, call
 from . import auth
 from . import presenter
+from . import json_stream
 from . import ssh_key
+from . import ssh_master
 from . import git
+from . import log_stream
+from . import log_archive
 from contextlib import closing
 from six.moves.urllib.parse import quote
 
-def get(host):
-    r = requests.get('%s/api/apps' % host, headers = {
-        'Content-Type': 'application/json',
-    })
+def apps(session):
+    r = session.get('/api/apps')
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
 
-def info(host, app_name):
-    r = requests.get('%s/api/apps/%s' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def get(session):
+    with closing(session.get('/api/apps', stream=True)) as r:
+        if r.status_code != 200:
+            if r.status_code == 401:
+                raise auth.AuthException()
+            raise Exception(r.text)
+        else:
+            presenter.echo_json_list(json_stream.iter_response_data(r))
+
+def info(session, app_name):
+    r = session.get('/api/apps/%s' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -38,7 +45,7 @@ def info(host, app_name):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def set_git_remote(host, app_name):
+def set_git_remote(session, app_name):
     git.check_for_git()
 
     remotes = call('git remote').splitlines()
@@ -47,7 +54,7 @@ def set_git_remote(host, app_name):
     cast('git remote add gigalixir https://git.gigalixir.com/%s.git/' % app_name)
     logging.getLogger("gigalixir-cli").info("Set git remote: gigalixir.")
 
-def create(host, unique_name, cloud, region, stack):
+def create(session, unique_name, cloud, region, stack):
     git.check_for_git()
 
     body = {}
@@ -59,9 +66,7 @@ def create(host, unique_name, cloud, region, stack):
         body["region"] = region
     if stack != None:
         body["stack"] = stack
-    r = requests.post('%s/api/apps' % host, headers = {
-        'Content-Type': 'application/json',
-    }, json = body)
+    r = session.post('/api/apps', idempotent=True, json = body)
     if r.status_code != 201:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -71,42 +76,42 @@ def create(host, unique_name, cloud, region, stack):
         unique_name = data["unique_name"]
         logging.getLogger("gigalixir-cli").info("Created app: %s." % unique_name)
 
-        set_git_remote(host, unique_name)
+        set_git_remote(session, unique_name)
         click.echo(unique_name)
 
-def status(host, app_name):
-    r = requests.get('%s/api/apps/%s/status' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def app_status(session, app_name):
+    r = session.get('/api/apps/%s/status' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
 
-def scale(host, app_name, replicas, size):
+def status(session, app_name):
+    data = app_status(session, app_name)
+    presenter.echo_json(data)
+
+def update_scale(session, app_name, replicas, size):
     body = {}
     if replicas != None:
         body["replicas"] = replicas
     if size != None:
         body["size"] = size 
-    r = requests.put('%s/api/apps/%s/scale' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = body)
+    r = session.put('/api/apps/%s/scale' % quote(app_name.encode('utf-8')), idempotent=True, json = body)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
 
-def customer_app_name(host, app_name):
-    r = requests.get('%s/api/apps/%s/releases/latest' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def scale(session, app_name, replicas, size):
+    data = update_scale(session, app_name, replicas, size)
+    presenter.echo_json(data)
+
+def customer_app_name(session, app_name):
+    r = session.get('/api/apps/%s/releases/latest' % quote(app_name.encode('utf-8')), cached=True)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -115,33 +120,31 @@ def customer_app_name(host, app_name):
         data = json.loads(r.text)["data"]
         return data["customer_app_name"]
 
-def distillery_eval(host, app_name, ssh_opts, expression):
+def distillery_eval(session, app_name, ssh_opts, expression):
     # capture_output == True as this isn't interactive
     # and we want to return the result as a string rather than
     # print it out to the screen
-    return ssh_helper(host, app_name, ssh_opts, True, "gigalixir_run", "distillery_eval", "--", expression)
+    return ssh_helper(session, app_name, ssh_opts, True, "gigalixir_run", "distillery_eval", "--", expression)
 
-def distillery_command(host, app_name, ssh_opts, *args):
-    ssh(host, app_name, ssh_opts, "gigalixir_run", "shell", "--", "bin/%s" % customer_app_name(host, app_name), *args)
+def distillery_command(session, app_name, ssh_opts, *args):
+    ssh(session, app_name, ssh_opts, "gigalixir_run", "shell", "--", "bin/%s" % customer_app_name(session, app_name), *args)
 
-def ssh(host, app_name, ssh_opts, *args):
+def ssh(session, app_name, ssh_opts, *args):
     # capture_output == False for interactive mode which is
     # used by ssh, remote_console, distillery_command
-    ssh_helper(host, app_name, ssh_opts, False, *args)
+    ssh_helper(session, app_name, ssh_opts, False, *args)
 
 # if using this from a script, and you want the return
 # value in a variable, use capture_output=True
 # capture_output needs to be False for remote_console
 # and regular ssh to work.
-def ssh_helper(host, app_name, ssh_opts, capture_output, *args):
+def ssh_helper(session, app_name, ssh_opts, capture_output, *args):
     # verify SSH keys exist
-    keys = ssh_key.ssh_keys(host)
+    keys = ssh_key.ssh_keys(session, cached=True)
     if len(keys) == 0:
         raise Exception("You don't have any ssh keys yet. See `gigalixir account:ssh_keys:add --help`")
 
-    r = requests.get('%s/api/apps/%s/ssh_ip' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+    r = session.get('/api/apps/%s/ssh_ip' % quote(app_name.encode('utf-8')), cached=True)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -149,6 +152,7 @@ def ssh_helper(host, app_name, ssh_opts, capture_output, *args):
     else:
         data = json.loads(r.text)["data"]
         ssh_ip = data["ssh_ip"]
+        ssh_opts = ssh_master.multiplexed(app_name, ssh_ip, ssh_opts)
         if len(args) > 0:
             escaped_args = [pipes.quote(arg) for arg in args]
             command = " ".join(escaped_args)
@@ -160,10 +164,8 @@ def ssh_helper(host, app_name, ssh_opts, capture_output, *args):
             cast("ssh %s -t root@%s" % (ssh_opts, ssh_ip))
 
 
-def restart(host, app_name):
-    r = requests.put('%s/api/apps/%s/restart' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def restart(session, app_name):
+    r = session.put('/api/apps/%s/restart' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -172,12 +174,10 @@ def restart(host, app_name):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def rollback(host, app_name, version):
+def rollback(session, app_name, version):
     if version == None:
-        version = second_most_recent_version(host, app_name)
-    r = requests.post('%s/api/apps/%s/releases/%s/rollback' % (host, quote(app_name.encode('utf-8')), quote(str(version).encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+        version = second_most_recent_version(session, app_name)
+    r = session.post('/api/apps/%s/releases/%s/rollback' % (quote(app_name.encode('utf-8')), quote(str(version).encode('utf-8'))))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -186,10 +186,8 @@ def rollback(host, app_name, version):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def second_most_recent_version(host, app_name):
-    r = requests.get('%s/api/apps/%s/releases' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def second_most_recent_version(session, app_name):
+    r = session.get('/api/apps/%s/releases' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -201,11 +199,9 @@ def second_most_recent_version(host, app_name):
         else:
             return data[1]["version"]
 
-def run(host, app_name, command):
+def run(session, app_name, command):
     # runs command in a new container
-    r = requests.post('%s/api/apps/%s/run' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+    r = session.post('/api/apps/%s/run' % quote(app_name.encode('utf-8')), idempotent=True, json = {
         "command": command,
     })
     if r.status_code != 200:
@@ -217,38 +213,51 @@ def run(host, app_name, command):
         click.echo("See `gigalixir logs` for any output.")
         click.echo("See `gigalixir ps` for job info.")
 
-def ps_run(host, app_name, ssh_opts, *command):
+def ps_run(session, app_name, ssh_opts, *command):
     # runs command in same container app is running
-    ssh(host, app_name, ssh_opts, "gigalixir_run", "shell", "--", *command)
+    ssh(session, app_name, ssh_opts, "gigalixir_run", "shell", "--", *command)
 
-def remote_console(host, app_name, ssh_opts):
-    ssh(host, app_name, ssh_opts, "gigalixir_run", "remote_console")
+def remote_console(session, app_name, ssh_opts):
+    ssh(session, app_name, ssh_opts, "gigalixir_run", "remote_console")
 
-def migrate(host, app_name, migration_app_name, ssh_opts):
+def migrate(session, app_name, migration_app_name, ssh_opts):
     if migration_app_name is None:
-        ssh(host, app_name, ssh_opts, "gigalixir_run", "migrate")
+        ssh(session, app_name, ssh_opts, "gigalixir_run", "migrate")
     else:
-        ssh(host, app_name, ssh_opts, "gigalixir_run", "migrate", "-m", migration_app_name)
-
-def logs(host, app_name, num, no_tail):
-    payload = {
-        "num_lines": num,
-        "follow": not no_tail
-    }
-    with closing(requests.get('%s/api/apps/%s/logs' % (host, quote(app_name.encode('utf-8'))), stream=True, params=payload)) as r:
+        ssh(session, app_name, ssh_opts, "gigalixir_run", "migrate", "-m", migration_app_name)
+
+def logs(session, app_name, num, no_tail, grep=None, level=None, replica=None, archive=None, rotate_bytes=None, rotate_seconds=None):
+    def connect(num_lines):
+        payload = {
+            "num_lines": num_lines,
+            "follow": not no_tail
+        }
+        timeout = None if no_tail else (log_stream.CONNECT_TIMEOUT, log_stream.STALL_TIMEOUT)
+        r = session.get('/api/apps/%s/logs' % quote(app_name.encode('utf-8')), stream=True, params=payload, timeout=timeout)
         if r.status_code != 200:
-            if r.status_code == 401:
-                raise auth.AuthException()
-            raise Exception(r.text)
+            with closing(r):
+                if r.status_code == 401:
+                    raise auth.AuthException()
+                raise Exception(r.text)
+        return r
+
+    def write(lines):
+        lines = log_stream.filter_lines(lines, grep, level, replica)
+        if archive is None:
+            log_stream.echo_lines(lines)
         else:
-            for chunk in r.iter_content(chunk_size=None):
-                if chunk:
-                    click.echo(chunk, nl=False)
+            log_archive.archive_lines(lines, archive, app_name,
+                rotate_bytes=rotate_bytes or log_archive.ROTATE_BYTES,
+                rotate_seconds=rotate_seconds or log_archive.ROTATE_SECONDS)
 
-def delete(host, app_name):
-    r = requests.delete('%s/api/apps/%s' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+    if no_tail:
+        with closing(connect(num)) as r:
+            write(log_stream.decode_lines(r.iter_content(chunk_size=None)))
+    else:
+        write(log_stream.follow(connect, num))
+
+def delete(session, app_name):
+    r = session.delete('/api/apps/%s' % quote(app_name.encode('utf-8')), idempotent=True)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -257,18 +266,19 @@ def delete(host, app_name):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def set_stack(host, app_name, stack):
+def update_stack(session, app_name, stack):
     body = {}
     if stack != None:
         body["stack"] = stack
-    r = requests.put('%s/api/apps/%s/stack' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = body)
+    r = session.put('/api/apps/%s/stack' % quote(app_name.encode('utf-8')), idempotent=True, json = body)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
+
+def set_stack(session, app_name, stack):
+    data = update_stack(session, app_name, stack)
+    presenter.echo_json(data)
 
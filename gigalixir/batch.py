@@ -0,0 +1,90 @@
+import json
+import shlex
+import threading
+import time
+from . import api_session
+from . import runner
+from . import timing
+
+def parse(f):
+    """
+    Returns (line number, argv) for every command in f. Lines are split like
+    a shell would. Blank lines and lines starting with # are skipped.
+    """
+    commands = []
+    for number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            raise Exception("Line %s: %s" % (number, e))
+        if argv[0] == 'gigalixir':
+            argv = argv[1:]
+        commands.append((number, argv))
+    return commands
+
+def run_one(streams, number, argv, group_argv=(), trace=None):
+    out, err = runner.text_buffer(), runner.text_buffer()
+    started = time.time()
+    full_argv = list(group_argv)
+    if trace:
+        full_argv.extend(['--trace', '%s.%s' % (trace, number)])
+    # commands running side by side must not report or clear each
+    # other's timings
+    with runner.route(streams[0], streams[1], out, err), timing.recording():
+        code = runner.exit_code(full_argv + list(argv))
+    return {
+        "line": number,
+        "command": argv,
+        "exit_code": code,
+        "seconds": round(time.time() - started, 3),
+        "stdout": runner.getvalue(out),
+        "stderr": runner.getvalue(err),
+    }
+
+def run(commands, parallel=1, stop_on_error=False, group_argv=(), trace=None):
+    """
+    Runs the commands in this process and yields a result for each one, in
+    the order they were given. Up to parallel commands run at the same time.
+    With stop_on_error, commands that did not start before a failure are
+    reported as skipped.
+
+    group_argv, e.g. ['--env', 'dev'], goes before every command. With
+    trace, each command writes its trace to trace plus its line number.
+    """
+    # every command shares one pool of api connections
+    api_session.share_sessions()
+    failed = threading.Event()
+    with runner.routed_output() as streams:
+        def task(number, argv):
+            if stop_on_error and failed.is_set():
+                return {"line": number, "command": argv, "skipped": True}
+            result = run_one(streams, number, argv, group_argv, trace)
+            if result["exit_code"] != 0:
+                failed.set()
+            return result
+
+        if parallel <= 1:
+            for number, argv in commands:
+                yield task(number, argv)
+            return
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            futures = [pool.submit(task, number, argv) for number, argv in commands]
+            for future in futures:
+                yield future.result()
+
+def write_report(results, f):
+    """
+    Writes each result to f as a line of json as soon as it is available and
+    returns the number of commands that failed.
+    """
+    failures = 0
+    for result in results:
+        if result.get("exit_code"):
+            failures += 1
+        f.write(json.dumps(result, sort_keys=True) + '\n')
+        f.flush()
+    return failures
@@ -0,0 +1,146 @@
+import errno
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+# How long, in seconds, a cached response is used without asking the api at
+# all. Once an entry is older than this it is revalidated with If-None-Match
+# if the api gave us an ETag for it.
+TTLS = [
+    (re.compile(r'^/api/ssh_keys$'), 300),
+    (re.compile(r'^/api/apps/[^/]+/ssh_ip$'), 60),
+    (re.compile(r'^/api/apps/[^/]+/releases/latest$'), 300),
+]
+
+def cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.environ['HOME'], '.cache')
+    return os.path.join(base, 'gigalixir')
+
+def response_cache_dir():
+    return os.path.join(cache_dir(), 'responses')
+
+def ttl_for(path):
+    for pattern, ttl in TTLS:
+        if pattern.match(path):
+            return ttl
+    return None
+
+def invalidation_prefix(path):
+    # anything that changes an app can change any of its cached resources
+    match = re.match(r'^(/api/apps/[^/]+)', path)
+    if match:
+        return match.group(1)
+    return path
+
+def clear():
+    ResponseCache(response_cache_dir()).clear()
+
+class ResponseCache(object):
+    """
+    Size-bounded, least-recently-used cache of api responses. Each entry is a
+    small json file. The file mtime is bumped on every hit and the oldest
+    files are evicted first once the directory grows past max_bytes.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, url, params, login):
+        return json.dumps([url, sorted((params or {}).items()), login])
+
+    def _filename(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return []
+            raise
+        return [os.path.join(self.directory, name) for name in names if name.endswith('.json')]
+
+    def get(self, key):
+        fname = self._filename(key)
+        try:
+            with open(fname) as f:
+                entry = json.load(f)
+            os.utime(fname, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def put(self, key, entry):
+        entry['key'] = key
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp, self._filename(key))
+        self.evict()
+
+    def invalidate(self, prefix):
+        for fname in self._entries():
+            try:
+                with open(fname) as f:
+                    path = json.load(f).get('path', '')
+                if path.startswith(prefix):
+                    os.remove(fname)
+            except (IOError, OSError, ValueError):
+                # another gigalixir process got to it first
+                pass
+
+    def clear(self):
+        for fname in self._entries():
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+
+    def evict(self):
+        entries = []
+        for fname in self._entries():
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fname))
+        total = sum(size for _, size, _ in entries)
+        for _, size, fname in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            total -= size
+
+def from_response(path, r):
+    return {
+        'path': path,
+        'url': r.url,
+        'stored_at': time.time(),
+        'status': r.status_code,
+        'etag': r.headers.get('ETag'),
+        'headers': {'Content-Type': r.headers.get('Content-Type', 'application/json')},
+        'body': r.text,
+    }
+
+def to_response(entry):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    r = requests.models.Response()
+    r.status_code = entry['status']
+    r.url = entry['url']
+    r.headers = CaseInsensitiveDict(entry['headers'])
+    r.encoding = 'utf-8'
+    r._content = entry['body'].encode('utf-8')
+    return r
@@ -1,4 +1,3 @@
-import requests
 from . import auth
 import urllib
 import json
@@ -6,43 +5,46 @@ import click
 from . import presenter
 from six.moves.urllib.parse import quote
 
-def get(host, app_name):
-    r = requests.get('%s/api/apps/%s/canaries' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def canaries(session, app_name):
+    r = session.get('/api/apps/%s/canaries' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
 
-def set(host, app_name, canary_name, weight):
+def get(session, app_name):
+    data = canaries(session, app_name)
+    presenter.echo_json(data)
+
+def update(session, app_name, canary_name, weight):
     body = {}
     if canary_name != None:
         body["canary"] = canary_name
     if weight != None:
         body["weight"] = weight 
-    r = requests.put('%s/api/apps/%s/canaries' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = body)
+    r = session.put('/api/apps/%s/canaries' % quote(app_name.encode('utf-8')), idempotent=True, json = body)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
+
+def set(session, app_name, canary_name, weight):
+    data = update(session, app_name, canary_name, weight)
+    presenter.echo_json(data)
 
-def delete(host, app_name, canary_name):
-    r = requests.delete('%s/api/apps/%s/canaries/%s' % (host, quote(app_name.encode('utf-8')), quote(canary_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def remove(session, app_name, canary_name):
+    r = session.delete('/api/apps/%s/canaries/%s' % (quote(app_name.encode('utf-8')), quote(canary_name.encode('utf-8'))), idempotent=True)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
+
+def delete(session, app_name, canary_name):
+    data = remove(session, app_name, canary_name)
+    presenter.echo_json(data)
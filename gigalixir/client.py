@@ -0,0 +1,135 @@
+"""
+asyncio client for the GIGALIXIR api, for programs that manage many apps
+from one event loop e.g.
+
+    async with AsyncClient() as client:
+        statuses = await asyncio.gather(*[client.app_status(app) for app in names])
+
+Every coroutine returns the parsed "data" of the response instead of printing
+it. Failures raise the same exceptions the cli does. Besides request(),
+there are coroutines for the reads the cli fans out across apps. Requires python 3.5+
+and httpx, which is installed with the "async" extra.
+"""
+import asyncio
+import json
+import uuid
+from six.moves.urllib.parse import quote
+from . import auth
+from . import api_session
+from . import credentials
+
+DEFAULT_HOST = "https://api.gigalixir.com"
+# connections shared by every request the client makes
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+TIMEOUT = 30
+
+def app_path(app_name, *rest):
+    return '/'.join(['/api/apps', quote(app_name.encode('utf-8'))] + [quote(str(part).encode('utf-8')) for part in rest])
+
+class AsyncClient(object):
+    """
+    One pool of keep-alive connections shared by every coroutine. Credentials
+    default to GIGALIXIR_EMAIL/GIGALIXIR_API_KEY or the ones `gigalixir login`
+    saved in ~/.netrc. Requests are retried with the same policy as the cli's
+    ApiSession.
+    """
+    def __init__(self, host=DEFAULT_HOST, auth=None, retries=api_session.DEFAULT_RETRIES,
+                 max_connections=MAX_CONNECTIONS, timeout=TIMEOUT):
+        try:
+            import httpx
+        except ImportError:
+            raise Exception("AsyncClient needs httpx. Try `pip install gigalixir[async]`.")
+        self.retries = retries
+        self.client = httpx.AsyncClient(
+            base_url=host,
+            auth=auth or credentials.get_auth(host),
+            headers={'Content-Type': 'application/json'},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=min(max_connections, MAX_KEEPALIVE_CONNECTIONS)),
+            timeout=timeout,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def request(self, method, path, expected=200, idempotent=False, retries=None, **kwargs):
+        """
+        Sends the request and returns the response's "data", or None if it
+        has no body. Raises unless the status is expected.
+        """
+        import httpx
+        if idempotent:
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers.setdefault('Idempotency-Key', str(uuid.uuid4()))
+            kwargs['headers'] = headers
+        if not (idempotent or method in api_session.IDEMPOTENT_METHODS):
+            retries = 0
+        elif retries is None:
+            retries = self.retries
+
+        attempt = 0
+        while True:
+            try:
+                r = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError:
+                if attempt >= retries:
+                    raise
+                delay = api_session.retry_delay(attempt)
+            else:
+                if r.status_code not in api_session.RETRY_STATUSES or attempt >= retries:
+                    break
+                delay = api_session.retry_delay(attempt, r.headers.get('Retry-After'))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if r.status_code != expected:
+            if r.status_code == 401:
+                raise auth.AuthException()
+            raise Exception(r.text)
+        if not r.text:
+            return None
+        return json.loads(r.text).get("data")
+
+    # The reads that `gigalixir --apps`/`--all-apps` fan out. Writes go
+    # through request() e.g.
+    #
+    #     await client.request('PUT', app_path(app_name, 'scale'), idempotent=True, json={"replicas": 2})
+    #
+    # so that what each endpoint expects is only spelled out once, in the
+    # resource modules the cli uses.
+
+    async def apps(self):
+        return await self.request('GET', '/api/apps')
+
+    async def app(self, app_name):
+        return await self.request('GET', app_path(app_name))
+
+    async def app_status(self, app_name):
+        return await self.request('GET', app_path(app_name, 'status'))
+
+    async def releases(self, app_name):
+        return await self.request('GET', app_path(app_name, 'releases'))
+
+    async def configs(self, app_name):
+        return await self.request('GET', app_path(app_name, 'configs'))
+
+    async def databases(self, app_name):
+        return await self.request('GET', app_path(app_name, 'databases'))
+
+    async def canaries(self, app_name):
+        return await self.request('GET', app_path(app_name, 'canaries'))
+
+    async def domains(self, app_name):
+        return await self.request('GET', app_path(app_name, 'domains'))
+
+    async def drains(self, app_name):
+        return await self.request('GET', app_path(app_name, 'drains'))
+
+    async def permissions(self, app_name):
+        return await self.request('GET', app_path(app_name, 'permissions'))
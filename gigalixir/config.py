@@ -1,4 +1,3 @@
-import requests
 from . import auth
 import urllib
 import json
@@ -6,22 +5,21 @@ import click
 from . import presenter
 from six.moves.urllib.parse import quote
 
-def get(host, app_name):
-    r = requests.get('%s/api/apps/%s/configs' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def configs(session, app_name):
+    r = session.get('/api/apps/%s/configs' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
 
-def create(host, app_name, key, value):
-    r = requests.post('%s/api/apps/%s/configs' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def get(session, app_name):
+    data = configs(session, app_name)
+    presenter.echo_json(data)
+
+def create(session, app_name, key, value):
+    r = session.post('/api/apps/%s/configs' % quote(app_name.encode('utf-8')), json = {
         "key": key,
         "value": value
     })
@@ -33,10 +31,8 @@ def create(host, app_name, key, value):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def create_multiple(host, app_name, configs):
-    r = requests.post('%s/api/apps/%s/configs' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def set_multiple(session, app_name, configs):
+    r = session.post('/api/apps/%s/configs' % quote(app_name.encode('utf-8')), json = {
         "configs": configs
     })
     if r.status_code != 201:
@@ -44,13 +40,14 @@ def create_multiple(host, app_name, configs):
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
+
+def create_multiple(session, app_name, configs):
+    data = set_multiple(session, app_name, configs)
+    presenter.echo_json(data)
 
-def copy(host, src_app_name, dst_app_name):
-    r = requests.post('%s/api/apps/%s/configs/copy' % (host, quote(dst_app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def copy(session, src_app_name, dst_app_name):
+    r = session.post('/api/apps/%s/configs/copy' % quote(dst_app_name.encode('utf-8')), json = {
         "from": src_app_name
     })
     if r.status_code != 200:
@@ -61,10 +58,8 @@ def copy(host, src_app_name, dst_app_name):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def delete(host, app_name, key):
-    r = requests.delete('%s/api/apps/%s/configs' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def unset(session, app_name, key):
+    r = session.delete('/api/apps/%s/configs' % quote(app_name.encode('utf-8')), idempotent=True, json = {
         "key": key,
     })
     if r.status_code != 200:
@@ -72,5 +67,8 @@ def delete(host, app_name, key):
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
+
+def delete(session, app_name, key):
+    data = unset(session, app_name, key)
+    presenter.echo_json(data)
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+import os
+import threading
+from six.moves.urllib.parse import urlparse
+from . import netrc
+from . import timing
+
+API_KEY_ENV = 'GIGALIXIR_API_KEY'
+EMAIL_ENV = 'GIGALIXIR_EMAIL'
+
+# netrc path => (mtime, parsed netrc). Parsed once per process and only
+# parsed again if the file changes.
+_netrc_cache = {}
+_lock = threading.Lock()
+
+def reset():
+    with _lock:
+        _netrc_cache.clear()
+
+def _parsed_netrc():
+    from netrc import netrc as Netrc, NetrcParseError
+    path = netrc.netrc_path()
+    try:
+        mtime = os.stat(path).st_mtime
+    except (OSError, KeyError):
+        return None
+    with _lock:
+        cached = _netrc_cache.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                with timing.span('netrc'):
+                    parsed = Netrc(path)
+            except (IOError, NetrcParseError):
+                # requests ignores a broken netrc too
+                parsed = None
+            cached = _netrc_cache[path] = (mtime, parsed)
+        return cached[1]
+
+def get_auth(host):
+    """
+    Returns the (login, api key) to use for host. GIGALIXIR_EMAIL and
+    GIGALIXIR_API_KEY take precedence, so CI jobs need no netrc file at all.
+    Otherwise the login `gigalixir login` saved in ~/.netrc is used.
+    """
+    api_key = os.environ.get(API_KEY_ENV)
+    if api_key:
+        email = os.environ.get(EMAIL_ENV)
+        if not email:
+            raise Exception("%s is set so %s must be set too." % (API_KEY_ENV, EMAIL_ENV))
+        return (email, api_key)
+    parsed = _parsed_netrc()
+    if parsed is None:
+        return None
+    authenticators = parsed.authenticators(urlparse(host).hostname)
+    if authenticators is None:
+        return None
+    login, account, password = authenticators
+    return (login or account, password)
@@ -1,7 +1,8 @@
-import requests
 import logging
 from . import auth
 from . import presenter
+from . import json_stream
+from contextlib import closing
 import urllib
 import json
 import click
@@ -9,22 +10,21 @@ from six.moves.urllib.parse import quote
 import os
 import errno
 
-def get(host, app_name):
-    r = requests.get('%s/api/apps/%s/databases' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def databases(session, app_name):
+    r = session.get('/api/apps/%s/databases' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
 
-def psql(host, app_name):
-    r = requests.get('%s/api/apps/%s/databases' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def get(session, app_name):
+    data = databases(session, app_name)
+    presenter.echo_json(data)
+
+def psql(session, app_name):
+    r = session.get('/api/apps/%s/databases' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -47,7 +47,7 @@ def psql(host, app_name):
                 else:
                     raise
 
-def create(host, app_name, size, cloud=None, region=None):
+def create(session, app_name, size, cloud=None, region=None):
     body = {
         "size": size
     }
@@ -55,9 +55,7 @@ def create(host, app_name, size, cloud=None, region=None):
         body["cloud"] = cloud
     if region != None:
         body["region"] = region
-    r = requests.post('%s/api/apps/%s/databases' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = body)
+    r = session.post('/api/apps/%s/databases' % quote(app_name.encode('utf-8')), idempotent=True, json = body)
     if r.status_code != 201:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -65,19 +63,15 @@ def create(host, app_name, size, cloud=None, region=None):
     logging.getLogger("gigalixir-cli").info("Creating new database.")
     logging.getLogger("gigalixir-cli").info("Please give us a few minutes to provision the new database.")
 
-def delete(host, app_name, database_id):
-    r = requests.delete('%s/api/apps/%s/databases/%s' % (host, quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def delete(session, app_name, database_id):
+    r = session.delete('/api/apps/%s/databases/%s' % (quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), idempotent=True)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
 
-def scale(host, app_name, database_id, size):
-    r = requests.put('%s/api/apps/%s/databases/%s' % (host, quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def scale(session, app_name, database_id, size):
+    r = session.put('/api/apps/%s/databases/%s' % (quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), idempotent=True, json = {
         "size": size,
     })
     if r.status_code != 200:
@@ -85,22 +79,17 @@ def scale(host, app_name, database_id, size):
             raise auth.AuthException()
         raise Exception(r.text)
 
-def backups(host, app_name, database_id):
-    r = requests.get('%s/api/apps/%s/databases/%s/backups' % (host, quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
-    if r.status_code != 200:
-        if r.status_code == 401:
-            raise auth.AuthException()
-        raise Exception(r.text)
-    else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+def backups(session, app_name, database_id):
+    with closing(session.get('/api/apps/%s/databases/%s/backups' % (quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), stream=True)) as r:
+        if r.status_code != 200:
+            if r.status_code == 401:
+                raise auth.AuthException()
+            raise Exception(r.text)
+        else:
+            presenter.echo_json_list(json_stream.iter_response_data(r))
 
-def restore(host, app_name, database_id, backup_id):
-    r = requests.post('%s/api/apps/%s/databases/%s/backups/%s/restore' % (host, quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8')), quote(backup_id.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def restore(session, app_name, database_id, backup_id):
+    r = session.post('/api/apps/%s/databases/%s/backups/%s/restore' % (quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8')), quote(backup_id.encode('utf-8'))))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
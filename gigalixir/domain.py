@@ -1,4 +1,3 @@
-import requests
 import logging
 from . import auth
 from . import presenter
@@ -7,22 +6,21 @@ import json
 import click
 from six.moves.urllib.parse import quote
 
-def get(host, app_name):
-    r = requests.get('%s/api/apps/%s/domains' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def domains(session, app_name):
+    r = session.get('/api/apps/%s/domains' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
+
+def get(session, app_name):
+    data = domains(session, app_name)
+    presenter.echo_json(data)
 
-def create(host, app_name, fqdn):
-    r = requests.post('%s/api/apps/%s/domains' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def create(session, app_name, fqdn):
+    r = session.post('/api/apps/%s/domains' % quote(app_name.encode('utf-8')), json = {
         "fqdn": fqdn,
     })
     if r.status_code != 201:
@@ -36,10 +34,8 @@ def create(host, app_name, fqdn):
     logging.getLogger("gigalixir-cli").info("Please give us a few minutes to set up a new TLS certificate.")
 
 
-def delete(host, app_name, fqdn):
-    r = requests.delete('%s/api/apps/%s/domains' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def delete(session, app_name, fqdn):
+    r = session.delete('/api/apps/%s/domains' % quote(app_name.encode('utf-8')), idempotent=True, json = {
         "fqdn": fqdn,
     })
     if r.status_code != 200:
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import api_session
+
+# kept below the session's connection pool size so every worker gets its own
+# keep-alive connection.
+MAX_WORKERS = 8
+
+def run(session, app_names, fetch, max_workers=MAX_WORKERS):
+    """
+    Calls fetch(session, app_name) for every app concurrently over the shared
+    session. Returns a dict keyed by app name holding either {"data": ...} or
+    {"error": "..."} so that one failing app does not hide the others.
+    """
+    results = {}
+    workers = max(1, min(max_workers, api_session.POOL_MAXSIZE, len(app_names)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(fetch, session, app_name), app_name) for app_name in app_names)
+        for future in as_completed(futures):
+            app_name = futures[future]
+            try:
+                results[app_name] = {"data": future.result()}
+            except Exception as e:
+                results[app_name] = {"error": str(e)}
+    return results
+
+def parse_app_names(apps):
+    return [app_name.strip() for app_name in apps.split(',') if app_name.strip()]
@@ -0,0 +1,272 @@
+"""
+Declarative settings for many apps, for `gigalixir plan` and `gigalixir
+apply`. A fleet file looks like
+
+    defaults:
+      stack: gigalixir-20
+      configs:
+        MIX_ENV: prod
+    apps:
+      my-app:
+        replicas: 2
+        size: 0.6
+        configs:
+          POOL_SIZE: "10"
+          OLD_SETTING: null
+        domains: [www.example.com]
+        drains: ["syslog+tls://logs.example.com:12345"]
+        canary: {name: my-app-canary, weight: 10}
+        permissions: [colleague@example.com]
+
+Only the settings a file mentions are managed. Configs are set, or unset
+when null, one key at a time so that configs set elsewhere are left alone.
+Domains, drains and permissions are lists of everything the app should
+have: missing entries are added and the others removed. A null canary
+removes the canary.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from . import api_session
+# imported by name because the cli's commands shadow some of these modules
+# as attributes of the gigalixir package e.g. gigalixir.canary
+from .app import app_status, update_scale, update_stack
+from .canary import canaries, update as update_canary, remove as remove_canary
+from .config import configs, set_multiple as set_configs, unset as unset_config
+from .domain import domains, create as add_domain, delete as remove_domain
+from .log_drain import drains, create as add_drain, delete as remove_drain
+from .permission import permissions, create as add_permission, delete as remove_permission
+
+MAX_WORKERS = 8
+
+SETTINGS = ('replicas', 'size', 'stack', 'configs', 'domains', 'drains', 'canary', 'permissions')
+
+# the request that returns the current value of each setting
+SOURCES = {
+    'replicas': 'status',
+    'size': 'status',
+    'stack': 'status',
+    'configs': 'configs',
+    'domains': 'domains',
+    'drains': 'drains',
+    'canary': 'canaries',
+    'permissions': 'permissions',
+}
+
+FETCHES = {
+    'status': app_status,
+    'configs': configs,
+    'domains': domains,
+    'drains': drains,
+    'canaries': canaries,
+    'permissions': permissions,
+}
+
+def parse(text):
+    # json is valid yaml, so PyYAML is only needed for files that use more
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        import yaml
+    except ImportError:
+        raise Exception("Reading yaml fleet files needs PyYAML. Try `pip install pyyaml`.")
+    return yaml.safe_load(text)
+
+def load(f):
+    """
+    Returns the settings of every app in the fleet file f, with the
+    defaults merged in.
+    """
+    fleet = parse(f.read()) or {}
+    if not isinstance(fleet, dict) or not isinstance(fleet.get('apps'), dict):
+        raise Exception("A fleet file needs an apps section.")
+    defaults = fleet.get('defaults') or {}
+    desired = {}
+    for app_name, settings in fleet['apps'].items():
+        merged = dict(defaults)
+        merged.update(settings or {})
+        if 'configs' in defaults and 'configs' in (settings or {}):
+            merged['configs'] = dict(defaults['configs'] or {}, **(settings['configs'] or {}))
+        unknown = sorted(set(merged) - set(SETTINGS))
+        if unknown:
+            raise Exception("Unknown settings for %s: %s" % (app_name, ', '.join(unknown)))
+        desired[app_name] = merged
+    return desired
+
+def pool_size(max_workers, tasks):
+    return max(1, min(max_workers, api_session.POOL_MAXSIZE, len(tasks)))
+
+def fetch(session, desired, max_workers=MAX_WORKERS):
+    """
+    Fetches what is needed to compare every app with its settings, all
+    concurrently. Returns {app name: {source: data}}.
+    """
+    tasks = sorted(set((app_name, SOURCES[setting]) for app_name, settings in desired.items() for setting in settings))
+    current = dict((app_name, {}) for app_name in desired)
+    errors = []
+    if not tasks:
+        return current
+    with ThreadPoolExecutor(max_workers=pool_size(max_workers, tasks)) as pool:
+        futures = [(app_name, source, pool.submit(FETCHES[source], session, app_name)) for app_name, source in tasks]
+        for app_name, source, future in futures:
+            try:
+                current[app_name][source] = future.result()
+            except Exception as e:
+                errors.append("%s %s: %s" % (app_name, source, e))
+    if errors:
+        raise Exception("Could not fetch the current state of\n%s" % "\n".join(errors))
+    return current
+
+def current_stack(status):
+    stack = status.get('stack')
+    if isinstance(stack, dict):
+        return stack.get('stack')
+    return stack
+
+def current_canary(canaries):
+    if isinstance(canaries, list):
+        canaries = canaries[0] if canaries else None
+    if not canaries or not canaries.get('canary'):
+        return None
+    return canaries
+
+def config_value(value):
+    # yaml reads true and 10 as a bool and an int but configs are strings
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return u'%s' % (value,)
+
+def diff_list(app_name, name, current, desired, key):
+    changes = []
+    for value in sorted(set(desired) - set(current)):
+        changes.append({"app": app_name, "action": "%s:add" % name, key: value})
+    for value in sorted(set(current) - set(desired)):
+        changes.append({"app": app_name, "action": "%s:remove" % name, key: value})
+    return changes
+
+def diff_app(app_name, settings, state):
+    """
+    Returns the changes that make the app match its settings.
+    """
+    changes = []
+    if 'replicas' in settings or 'size' in settings:
+        status = state['status']
+        replicas = status.get('replicas_desired', status.get('replicas'))
+        change = {}
+        if 'replicas' in settings and settings['replicas'] != replicas:
+            change['replicas'] = settings['replicas']
+        if 'size' in settings and (status.get('size') is None or abs(float(settings['size']) - float(status['size'])) > 1e-9):
+            change['size'] = settings['size']
+        if change:
+            change.update({"app": app_name, "action": "ps:scale"})
+            changes.append(change)
+    if 'stack' in settings and settings['stack'] != current_stack(state['status']):
+        changes.append({"app": app_name, "action": "stack:set", "stack": settings['stack']})
+    if 'configs' in settings:
+        current = state['configs'] or {}
+        desired = settings['configs'] or {}
+        updates = dict((key, config_value(value)) for key, value in desired.items()
+                       if value is not None and current.get(key) != config_value(value))
+        if updates:
+            # one request sets every key
+            changes.append({"app": app_name, "action": "config:set", "configs": updates})
+        for key in sorted(desired):
+            if desired[key] is None and key in current:
+                changes.append({"app": app_name, "action": "config:unset", "key": key})
+    if 'domains' in settings:
+        changes += diff_list(app_name, 'domains', state['domains'], settings['domains'] or [], 'fqdn')
+    if 'drains' in settings:
+        current = dict((drain['url'], drain['id']) for drain in state['drains'])
+        for change in diff_list(app_name, 'drains', current, settings['drains'] or [], 'url'):
+            if change['action'] == 'drains:remove':
+                change['drain_id'] = current[change['url']]
+            changes.append(change)
+    if 'canary' in settings:
+        current = current_canary(state['canaries'])
+        desired = settings['canary']
+        if desired is None:
+            if current is not None:
+                changes.append({"app": app_name, "action": "canary:unset", "canary": current['canary']})
+        elif current is None or current['canary'] != desired.get('name') or current.get('weight') != desired.get('weight'):
+            changes.append({"app": app_name, "action": "canary:set", "canary": desired.get('name'), "weight": desired.get('weight')})
+    if 'permissions' in settings:
+        changes += diff_list(app_name, 'access', state['permissions'], settings['permissions'] or [], 'email')
+    return changes
+
+def diff(desired, current):
+    changes = []
+    for app_name in sorted(desired):
+        changes += diff_app(app_name, desired[app_name], current[app_name])
+    return changes
+
+def plan(session, desired, max_workers=MAX_WORKERS):
+    return diff(desired, fetch(session, desired, max_workers))
+
+def describe(change):
+    """
+    The change as printed by plan and apply. Config values are left out
+    because they are often secrets.
+    """
+    change = dict(change)
+    if 'configs' in change:
+        change['keys'] = sorted(change.pop('configs'))
+    return change
+
+def apply_change(session, change):
+    app_name, action = change['app'], change['action']
+    if action == 'ps:scale':
+        update_scale(session, app_name, change.get('replicas'), change.get('size'))
+    elif action == 'stack:set':
+        update_stack(session, app_name, change['stack'])
+    elif action == 'config:set':
+        set_configs(session, app_name, change['configs'])
+    elif action == 'config:unset':
+        unset_config(session, app_name, change['key'])
+    elif action == 'domains:add':
+        add_domain(session, app_name, change['fqdn'])
+    elif action == 'domains:remove':
+        remove_domain(session, app_name, change['fqdn'])
+    elif action == 'drains:add':
+        add_drain(session, app_name, change['url'])
+    elif action == 'drains:remove':
+        remove_drain(session, app_name, change['drain_id'])
+    elif action == 'canary:set':
+        update_canary(session, app_name, change['canary'], change['weight'])
+    elif action == 'canary:unset':
+        remove_canary(session, app_name, change['canary'])
+    elif action == 'access:add':
+        add_permission(session, app_name, change['email'])
+    elif action == 'access:remove':
+        remove_permission(session, app_name, change['email'])
+    else:
+        raise Exception("Unknown change %s" % action)
+
+def apply_changes(session, changes, results):
+    # one at a time: every config write cuts a release, so writes to the
+    # same app must not race
+    for change, result in zip(changes, results):
+        try:
+            apply_change(session, change)
+        except Exception as e:
+            result['error'] = str(e)
+
+def apply(session, changes, max_workers=MAX_WORKERS):
+    """
+    Applies each app's changes in order, with up to max_workers apps at a
+    time. Returns the described changes, each with "error" set if it
+    failed.
+    """
+    results = [describe(change) for change in changes]
+    by_app = {}
+    for change, result in zip(changes, results):
+        app_changes, app_results = by_app.setdefault(change['app'], ([], []))
+        app_changes.append(change)
+        app_results.append(result)
+    if not by_app:
+        return results
+    with ThreadPoolExecutor(max_workers=pool_size(max_workers, by_app)) as pool:
+        futures = [pool.submit(apply_changes, session, app_changes, app_results) for app_changes, app_results in by_app.values()]
+        for future in futures:
+            future.result()
+    return results
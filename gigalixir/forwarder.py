@@ -0,0 +1,112 @@
+"""
+Local tcp port forwarding through an app's ssh connection, for
+`gigalixir ps:observer`. Listens on a free port on 127.0.0.1 and pipes
+every connection to it through `ssh -W` to a port on the container. Over a
+shared ssh master each connection is a new channel, not a new handshake.
+
+Nothing needs root: there are no routes, firewall rules or loopback
+aliases to add and nothing is left behind if the process is killed.
+"""
+import asyncio
+import logging
+import os
+import subprocess
+import threading
+
+CHUNK_SIZE = 64 * 1024
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(CHUNK_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        if writer.can_write_eof():
+            try:
+                writer.write_eof()
+            except OSError:
+                pass
+
+class Forwarder(object):
+    """
+    Forwards 127.0.0.1:port to remote_port on the container at ssh_ip, e.g.
+
+        forwarder = Forwarder(ssh_opts, ssh_ip, 'localhost', 9999)
+        port = forwarder.start()
+        ...
+        forwarder.stop()
+
+    The event loop runs in a thread of its own so the caller can block,
+    e.g. on erl.
+    """
+    def __init__(self, ssh_opts, ssh_ip, remote_host, remote_port, local_port=0):
+        self.command = ['ssh'] + ssh_opts.split() + ['-W', '%s:%s' % (remote_host, remote_port), 'root@%s' % ssh_ip]
+        self.local_port = local_port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.connections = set()
+
+    async def handle(self, client_reader, client_writer):
+        with open(os.devnull, 'wb') as devnull:
+            process = await asyncio.create_subprocess_exec(*self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=devnull)
+        self.connections.add(process)
+        try:
+            await asyncio.gather(pipe(client_reader, process.stdin), pipe(process.stdout, client_writer))
+        finally:
+            client_writer.close()
+            if process.returncode is None:
+                process.terminate()
+            await process.wait()
+            self.connections.discard(process)
+
+    def start(self):
+        """
+        Starts listening and returns the local port.
+        """
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, '127.0.0.1', self.local_port))
+                self.local_port = self.server.sockets[0].getsockname()[1]
+            except Exception as e:
+                errors.append(e)
+                ready.set()
+                self.loop.close()
+                return
+            ready.set()
+            try:
+                self.loop.run_forever()
+            finally:
+                self.server.close()
+                self.loop.run_until_complete(self.server.wait_closed())
+                for process in list(self.connections):
+                    if process.returncode is None:
+                        process.terminate()
+                pending = asyncio.all_tasks(self.loop)
+                if pending:
+                    self.loop.run_until_complete(asyncio.wait(pending, timeout=2))
+                self.loop.close()
+
+        self.thread = threading.Thread(target=run, name='gigalixir-forwarder')
+        self.thread.daemon = True
+        self.thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        logging.getLogger("gigalixir-cli").debug("Forwarding 127.0.0.1:%s with %s" % (self.local_port, ' '.join(self.command)))
+        return self.local_port
+
+    def stop(self):
+        if self.loop is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
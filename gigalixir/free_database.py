@@ -1,4 +1,3 @@
-import requests
 import logging
 from . import auth
 from . import presenter
@@ -7,10 +6,8 @@ import json
 import click
 from six.moves.urllib.parse import quote
 
-def get(host, app_name):
-    r = requests.get('%s/api/apps/%s/free_databases' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def get(session, app_name):
+    r = session.get('/api/apps/%s/free_databases' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -19,10 +16,8 @@ def get(host, app_name):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def create(host, app_name):
-    r = requests.post('%s/api/apps/%s/free_databases' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    }, json = {})
+def create(session, app_name):
+    r = session.post('/api/apps/%s/free_databases' % quote(app_name.encode('utf-8')), idempotent=True, json = {})
     if r.status_code != 201:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -30,10 +25,8 @@ def create(host, app_name):
     data = json.loads(r.text)["data"]
     presenter.echo_json(data)
 
-def delete(host, app_name, database_id):
-    r = requests.delete('%s/api/apps/%s/free_databases/%s' % (host, quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def delete(session, app_name, database_id):
+    r = session.delete('/api/apps/%s/free_databases/%s' % (quote(app_name.encode('utf-8')), quote(database_id.encode('utf-8'))), idempotent=True)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
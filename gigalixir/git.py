@@ -1,4 +1,5 @@
 import os
+import re
 import subprocess
 
 def check_for_git():
@@ -14,3 +15,109 @@ def check_for_git():
     except subprocess.CalledProcessError:
         raise Exception("You must call this from inside a git repository.")
 
+SECTION_RE = re.compile(r'^\s*\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+# config path => (mtime, size, remote urls)
+_remotes_cache = {}
+
+def find_git_dir(path=None):
+    """
+    Returns the .git directory of the repository containing path, following
+    the `gitdir:` file that worktrees and submodules use in place of a
+    directory, or None if there is no repository.
+    """
+    path = os.path.abspath(path or os.getcwd())
+    while True:
+        candidate = os.path.join(path, '.git')
+        if os.path.isdir(candidate):
+            return candidate
+        if os.path.isfile(candidate):
+            with open(candidate) as f:
+                content = f.read().strip()
+            if not content.startswith('gitdir:'):
+                return None
+            return os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def common_dir(git_dir):
+    """
+    Worktrees keep their config in the main repository's .git directory,
+    which the commondir file points to.
+    """
+    try:
+        with open(os.path.join(git_dir, 'commondir')) as f:
+            return os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    except (IOError, OSError):
+        return git_dir
+
+def _value(raw):
+    value = []
+    quoted = False
+    i = 0
+    while i < len(raw):
+        c = raw[i]
+        if c == '\\' and i + 1 < len(raw):
+            value.append({'n': '\n', 't': '\t'}.get(raw[i + 1], raw[i + 1]))
+            i += 2
+            continue
+        if c == '"':
+            quoted = not quoted
+        elif c in '#;' and not quoted:
+            break
+        else:
+            value.append(c)
+        i += 1
+    return ''.join(value).strip()
+
+def parse_remotes(config):
+    """
+    Returns [(remote name, url)] from the text of a git config file, or
+    None if the file uses includes or url rewriting, which only git itself
+    resolves correctly.
+    """
+    remotes = []
+    section = None
+    name = None
+    for line in config.splitlines():
+        match = SECTION_RE.match(line)
+        if match:
+            section = match.group(1).lower()
+            name = match.group(2)
+            if section in ('include', 'includeif'):
+                return None
+            line = match.group(3)
+        key, sep, raw = line.partition('=')
+        key = key.strip().lower()
+        if not key or key[0] in '#;':
+            continue
+        if section == 'url' and key in ('insteadof', 'pushinsteadof'):
+            return None
+        if section == 'remote' and name is not None and key in ('url', 'pushurl') and sep:
+            remotes.append((name, _value(raw)))
+    return remotes
+
+def remote_urls(path=None):
+    """
+    Returns the remote urls of the repository containing path sorted by
+    remote name, like `git remote -v` lists them, without running git.
+    Returns None when that can not be worked out from the files alone.
+    """
+    git_dir = find_git_dir(path)
+    if git_dir is None:
+        return None
+    config = os.path.join(common_dir(git_dir), 'config')
+    try:
+        st = os.stat(config)
+    except OSError:
+        return None
+    cached = _remotes_cache.get(config)
+    if cached is not None and cached[:2] == (st.st_mtime, st.st_size):
+        return cached[2]
+    with open(config) as f:
+        remotes = parse_remotes(f.read())
+    if remotes is not None:
+        remotes = [url for _, url in sorted(remotes, key=lambda remote: remote[0])]
+    _remotes_cache[config] = (st.st_mtime, st.st_size, remotes)
+    return remotes
@@ -1,19 +1,17 @@
-import requests
 from . import auth
 from . import presenter
+from . import json_stream
+from contextlib import closing
 import urllib
 import json
 import click
 
-def get(host):
-    r = requests.get('%s/api/invoices' % (host), headers = {
-        'Content-Type': 'application/json',
-    })
-    if r.status_code != 200:
-        if r.status_code == 401:
-            raise auth.AuthException()
-        raise Exception(r.text)
-    else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+def get(session):
+    with closing(session.get('/api/invoices', stream=True)) as r:
+        if r.status_code != 200:
+            if r.status_code == 401:
+                raise auth.AuthException()
+            raise Exception(r.text)
+        else:
+            presenter.echo_json_list(json_stream.iter_response_data(r))
 
@@ -0,0 +1,105 @@
+import codecs
+import json
+import re
+
+# bytes read from the socket at a time
+CHUNK_SIZE = 16 * 1024
+
+WHITESPACE = re.compile(r'\s*')
+
+class IncompleteJSON(ValueError):
+    pass
+
+class Reader(object):
+    """
+    Text buffer over a stream of byte chunks that reads json values one at a
+    time, pulling in more chunks whenever a value is not complete yet.
+    Consumed text is dropped so memory stays bounded by the largest value.
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            raise IncompleteJSON("Unexpected end of response.")
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer += self.decoder.decode(chunk)
+                return
+        self.buffer += self.decoder.decode(b'', final=True)
+        self.eof = True
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character without consuming it.
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected %r at %r" % (char, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # not all of it has arrived yet
+                self.fill()
+                continue
+            # a number at the very end of the buffer may continue in the
+            # next chunk
+            if end == len(self.buffer) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+def iter_data(chunks):
+    """
+    Yields the elements of the "data" list of a response body as soon as
+    each one has been received, e.g. for
+
+        {"data": [{"version": 2}, {"version": 1}]}
+
+    yields {"version": 2} and then {"version": 1}.
+    """
+    reader = Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        raise ValueError("Response has no data.")
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key != 'data':
+            reader.value()
+        elif reader.peek() != '[':
+            raise ValueError("Response data is not a list.")
+        else:
+            reader.expect('[')
+            if reader.peek() == ']':
+                return
+            while True:
+                yield reader.value()
+                if reader.peek() == ']':
+                    return
+                reader.expect(',')
+        if reader.peek() == '}':
+            raise ValueError("Response has no data.")
+        reader.expect(',')
+
+def iter_response_data(r):
+    return iter_data(r.iter_content(chunk_size=CHUNK_SIZE))
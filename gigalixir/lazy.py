@@ -0,0 +1,23 @@
+import importlib
+
+class LazyModule(object):
+    """
+    Stands in for a module and imports it on first attribute access. The cli
+    refers to every resource module through one of these so that resolving
+    and running a command only imports the modules (and the third party
+    dependencies) that command actually uses.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self._name
@@ -0,0 +1,293 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from six.moves import queue
+
+# A segment is a series of independently compressed blocks, so the whole
+# file still decompresses with plain gunzip/unzstd while a reader that has
+# the index can seek to any block and decompress just that one.
+BLOCK_BYTES = 1024 * 1024
+# a block is also cut once its first line is this old so a quiet app does not
+# keep lines in memory (and out of the archive) for long
+BLOCK_SECONDS = 10
+ROTATE_BYTES = 64 * 1024 * 1024
+ROTATE_SECONDS = 60 * 60
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Each archived block carries a bloom filter of the byte trigrams in it. A
+# search whose pattern requires a literal skips every block missing one of
+# the literal's trigrams without decompressing it.
+BLOOM_BITS_PER_TRIGRAM = 8
+BLOOM_HASHES = 3
+BLOOM_MIN_BITS = 1024
+
+SEGMENT_RE = re.compile(r'^(?P<app>.+)\.(?P<started>\d{8}T\d{6}Z)(-(?P<seq>\d+))?\.log\.(?P<ext>gz|zst)$')
+EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+
+def default_compression():
+    try:
+        import zstandard
+        return 'zstd'
+    except ImportError:
+        return 'gzip'
+
+def compress(data, compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress(data, compression):
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+def trigrams(data):
+    # zipping shifted copies is about twice as fast as slicing every offset
+    return set(bytes(gram) for gram in set(zip(data, data[1:], data[2:])))
+
+def _positions(trigram, bits):
+    # double hashing with two independent 32-bit hashes, so the positions
+    # cover the whole filter however large it is
+    h1, h2 = struct.unpack('<II', hashlib.sha1(trigram).digest()[:8])
+    h2 |= 1
+    return [(h1 + i * h2) % bits for i in range(BLOOM_HASHES)]
+
+def bloom(data):
+    """
+    Returns (bits, base64 bitmap) for the trigrams in data.
+    """
+    grams = trigrams(data)
+    bits = max(BLOOM_MIN_BITS, len(grams) * BLOOM_BITS_PER_TRIGRAM)
+    bits += -bits % 8
+    bitmap = bytearray(bits // 8)
+    for gram in grams:
+        for position in _positions(gram, bits):
+            bitmap[position >> 3] |= 1 << (position & 7)
+    return bits, base64.b64encode(bytes(bitmap)).decode('ascii')
+
+def might_contain(block, literals):
+    if 'bloom' not in block or not literals:
+        return True
+    bits = block['bloom_bits']
+    bitmap = bytearray(base64.b64decode(block['bloom']))
+    for literal in literals:
+        for gram in trigrams(literal):
+            for position in _positions(gram, bits):
+                if not bitmap[position >> 3] & (1 << (position & 7)):
+                    return False
+    return True
+
+def timestamp(t):
+    # fixed width so timestamps compare correctly as strings
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t)) + '.%06dZ' % int((t % 1) * 1000000)
+
+def index_path(segment):
+    return segment + '.idx.jsonl'
+
+def read_index(segment):
+    """
+    Returns the segment's compression, totals and blocks. The index is a
+    header line followed by a line per block, appended as each block is
+    written, so a block being appended right now may be cut short.
+    """
+    with open(index_path(segment)) as f:
+        lines = f.read().split('\n')
+    index = json.loads(lines[0])
+    index.update({'first': None, 'last': None, 'lines': 0, 'bytes': 0, 'blocks': []})
+    for line in lines[1:]:
+        try:
+            block = json.loads(line)
+        except ValueError:
+            # the last line is empty or still being written
+            break
+        index['blocks'].append(block)
+        if index['first'] is None:
+            index['first'] = block['first']
+        index['last'] = block['last']
+        index['lines'] += block['lines']
+        index['bytes'] += block['bytes']
+    return index
+
+def segments(directory):
+    """
+    Returns the segment files in directory, oldest first.
+    """
+    names = [name for name in os.listdir(directory) if SEGMENT_RE.match(name)]
+    def started(name):
+        match = SEGMENT_RE.match(name)
+        return (match.group('started'), int(match.group('seq') or 0))
+    names.sort(key=started)
+    return [os.path.join(directory, name) for name in names]
+
+def read_block(f, block, compression):
+    f.seek(block['offset'])
+    return decompress(f.read(block['length']), compression)
+
+class Segment(object):
+    def __init__(self, directory, app_name, compression, started):
+        prefix = os.path.join(directory, '%s.%s' % (app_name, time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(started))))
+        suffix = '.log.%s' % EXTENSIONS[compression]
+        self.path = prefix + suffix
+        seq = 0
+        while os.path.exists(self.path):
+            # rotated more than once within a second
+            seq += 1
+            self.path = '%s-%d%s' % (prefix, seq, suffix)
+        self.started = started
+        self.compression = compression
+        self.f = open(self.path, 'wb')
+        # opened with the first block, so a segment without one has no index
+        self.index_file = None
+        self.index = {
+            'compression': compression,
+            'first': None,
+            'last': None,
+            'lines': 0,
+            'bytes': 0,
+        }
+
+    def write_block(self, lines, first, last):
+        data = ''.join(lines).encode('utf-8')
+        compressed = compress(data, self.compression)
+        bloom_bits, bloom_bitmap = bloom(data)
+        offset = self.f.tell()
+        self.f.write(compressed)
+        self.f.flush()
+        self.write_index({
+            'offset': offset,
+            'length': len(compressed),
+            'first': first,
+            'last': last,
+            'lines': len(lines),
+            'bytes': len(data),
+            'bloom_bits': bloom_bits,
+            'bloom': bloom_bitmap,
+        })
+        if self.index['first'] is None:
+            self.index['first'] = first
+        self.index['last'] = last
+        self.index['lines'] += len(lines)
+        self.index['bytes'] += len(data)
+
+    def write_index(self, block):
+        # appends the block so writing the index costs the same for every
+        # block, however many came before it
+        if self.index_file is None:
+            self.index_file = open(index_path(self.path), 'w')
+            self.index_file.write(json.dumps({'compression': self.compression}) + '\n')
+        self.index_file.write(json.dumps(block) + '\n')
+        self.index_file.flush()
+
+    def close(self):
+        self.f.close()
+        if self.index_file is not None:
+            self.index_file.close()
+
+class ArchiveWriter(object):
+    """
+    Archives log lines into rotated, compressed segment files. Every line is
+    prefixed with the time it was received. Compression and disk writes
+    happen on a background thread behind an unbounded queue so a slow disk
+    never holds up reading from the socket.
+    """
+    def __init__(self, directory, app_name, compression=None, rotate_bytes=ROTATE_BYTES, rotate_seconds=ROTATE_SECONDS):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.app_name = app_name
+        self.compression = compression or default_compression()
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.segment = None
+        self.block = []
+        self.block_bytes = 0
+        self.block_started = None
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, line):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((time.time(), line))
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=BLOCK_SECONDS)
+            except queue.Empty:
+                item = False
+            try:
+                if item is None:
+                    self._flush()
+                    if self.segment is not None:
+                        self.segment.close()
+                    return
+                if item:
+                    self._add(*item)
+                if self.block and time.time() - self.block_started >= BLOCK_SECONDS:
+                    self._flush()
+            except Exception as e:
+                # stop archiving but keep draining so write() and close()
+                # never block
+                self.error = e
+                while item is not None:
+                    item = self.queue.get()
+                return
+
+    def _add(self, received, line):
+        if not line.endswith('\n'):
+            line += '\n'
+        if self.segment is not None and (self.segment.index['bytes'] >= self.rotate_bytes or received - self.segment.started >= self.rotate_seconds):
+            self._flush()
+            self.segment.close()
+            self.segment = None
+        if self.segment is None:
+            self.segment = Segment(self.directory, self.app_name, self.compression, received)
+            logging.getLogger("gigalixir-cli").info("Archiving to %s" % self.segment.path)
+        stamped = timestamp(received) + ' ' + line
+        if not self.block:
+            self.block_started = received
+            self.block_first = timestamp(received)
+        self.block.append(stamped)
+        self.block_bytes += len(stamped)
+        self.block_last = timestamp(received)
+        if self.block_bytes >= BLOCK_BYTES or self.segment.index['bytes'] + self.block_bytes >= self.rotate_bytes:
+            self._flush()
+
+    def _flush(self):
+        if self.block:
+            self.segment.write_block(self.block, self.block_first, self.block_last)
+            self.block = []
+            self.block_bytes = 0
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+def archive_lines(lines, directory, app_name, **kwargs):
+    with ArchiveWriter(directory, app_name, **kwargs) as writer:
+        for line in lines:
+            writer.write(line)
@@ -0,0 +1,183 @@
+import calendar
+import mmap
+import os
+import re
+import time
+from . import log_archive
+from . import log_stream
+
+# blocks handed to a worker process at a time
+BLOCKS_PER_TASK = 16
+
+RELATIVE_RE = re.compile(r'^(\d+)([smhd])$')
+UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+TIME_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+# where the receipt timestamp ends in an archived line
+TIMESTAMP_WIDTH = len(log_archive.timestamp(0))
+
+def required_literals(pattern):
+    """
+    Returns byte strings that every match of the regular expression pattern
+    must contain. Errs on the side of returning too little: anything inside
+    a group or class is ignored and patterns with alternation return none.
+    """
+    if '|' in pattern or '(?' in pattern:
+        return []
+    literals = []
+    current = []
+    depth = 0
+    i = 0
+    def end_run():
+        if len(current) >= 3:
+            literals.append(u''.join(current).encode('utf-8'))
+        del current[:]
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            escaped = pattern[i + 1:i + 2]
+            if depth == 0 and escaped and not escaped.isalnum():
+                current.append(escaped)
+            else:
+                end_run()
+            i += 2
+            continue
+        if c == '(':
+            end_run()
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '[':
+            end_run()
+            # skip the class, which may start with ] or ^]
+            i += 1
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif c in '*?{':
+            # the previous character is optional
+            if current:
+                current.pop()
+            end_run()
+            if c == '{':
+                while i < len(pattern) and pattern[i] != '}':
+                    i += 1
+        elif c == '+':
+            end_run()
+        elif c in '.^$':
+            end_run()
+        elif depth == 0:
+            current.append(c)
+        i += 1
+    end_run()
+    return literals
+
+def parse_time(value, now=None):
+    """
+    Accepts an absolute UTC time like 2017-09-25T21:26:17 or 2017-09-25 or a
+    relative one like 30m, 2h or 7d meaning that long ago. Returns an
+    archive timestamp string.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    match = RELATIVE_RE.match(value)
+    if match:
+        now = time.time() if now is None else now
+        return log_archive.timestamp(now - int(match.group(1)) * UNITS[match.group(2)])
+    stripped = value.rstrip('Z')
+    for fmt in TIME_FORMATS:
+        try:
+            return log_archive.timestamp(calendar.timegm(time.strptime(stripped, fmt)))
+        except ValueError:
+            pass
+    raise Exception("Invalid time %s. Use e.g. 2017-09-25T21:26:17, 2017-09-25 or 2h." % value)
+
+def overlaps(first, last, since, until):
+    if first is None:
+        return False
+    if since is not None and last < since:
+        return False
+    if until is not None and first > until:
+        return False
+    return True
+
+def candidates(directory, since=None, until=None, literals=None):
+    """
+    Uses the segment indexes to pick the blocks that can contain a match.
+    Returns a list of (segment path, compression, blocks) tasks in time
+    order, each with at most BLOCKS_PER_TASK blocks.
+    """
+    tasks = []
+    for segment in log_archive.segments(directory):
+        try:
+            index = log_archive.read_index(segment)
+        except (IOError, OSError, ValueError):
+            # the archiver has not finished the first block yet
+            continue
+        if not overlaps(index['first'], index['last'], since, until):
+            continue
+        blocks = [block for block in index['blocks']
+                  if overlaps(block['first'], block['last'], since, until) and log_archive.might_contain(block, literals)]
+        for i in range(0, len(blocks), BLOCKS_PER_TASK):
+            tasks.append((segment, index['compression'], blocks[i:i + BLOCKS_PER_TASK]))
+    return tasks
+
+def scan(task, since=None, until=None, grep=None):
+    """
+    Returns the lines in the task's blocks that fall between since and until
+    and match grep.
+    """
+    segment, compression, blocks = task
+    pattern = re.compile(grep) if grep else None
+    matches = []
+    with open(segment, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for block in blocks:
+                data = log_archive.decompress(m[block['offset']:block['offset'] + block['length']], compression)
+                check_time = not ((since is None or block['first'] >= since) and (until is None or block['last'] <= until))
+                for line in data.decode('utf-8', 'replace').splitlines(True):
+                    if check_time:
+                        stamp = line[:TIMESTAMP_WIDTH]
+                        if (since is not None and stamp < since) or (until is not None and stamp > until):
+                            continue
+                    if pattern is not None and not pattern.search(line):
+                        continue
+                    matches.append(line)
+        finally:
+            m.close()
+    return matches
+
+def _scan(args):
+    return scan(*args)
+
+def search(directory, since=None, until=None, grep=None, jobs=None):
+    """
+    Yields the archived lines in directory between since and until that
+    match grep, oldest first. Candidate blocks are scanned in parallel by a
+    pool of processes.
+    """
+    since = parse_time(since)
+    until = parse_time(until)
+    if grep:
+        re.compile(grep)
+    tasks = candidates(directory, since, until, required_literals(grep) if grep else None)
+    args = [(task, since, until, grep) for task in tasks]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(args) <= 1:
+        # not worth starting processes for
+        for lines in map(_scan, args):
+            for line in lines:
+                yield line
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=min(jobs, len(args))) as pool:
+        for lines in pool.map(_scan, args):
+            for line in lines:
+                yield line
+
+def echo_search(directory, since=None, until=None, grep=None, jobs=None):
+    log_stream.echo_lines(search(directory, since, until, grep, jobs))
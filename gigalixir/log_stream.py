@@ -0,0 +1,207 @@
+import codecs
+import collections
+import logging
+import random
+import re
+import threading
+import time
+import click
+from six.moves import queue
+
+# syslog severities in increasing order. Log lines carry one of these as an
+# elixir Logger style tag e.g. "[info]" or "[error]".
+LEVELS = ['debug', 'info', 'notice', 'warning', 'error', 'critical', 'alert', 'emergency']
+LEVEL_ALIASES = {
+    'warn': 'warning',
+    'err': 'error',
+    'crit': 'critical',
+    'emerg': 'emergency',
+}
+LEVEL_RE = re.compile(r'\[(%s)\]' % '|'.join(LEVELS + list(LEVEL_ALIASES)))
+
+# lines waiting to be written. Once this fills up the reader blocks which in
+# turn stops reading from the socket instead of buffering without bound.
+MAX_PENDING_LINES = 10000
+# lines written to stdout with a single write
+MAX_BATCH_LINES = 500
+
+# seconds without a single byte from the api before a followed stream is
+# considered dead and reconnected. Reconnecting a quiet but healthy stream is
+# harmless since the replayed lines are dropped.
+STALL_TIMEOUT = 90
+CONNECT_TIMEOUT = 10
+# lines asked for on reconnect and remembered to recognize them
+RESUME_LINES = 200
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+def level_index(level):
+    level = level.lower()
+    return LEVELS.index(LEVEL_ALIASES.get(level, level))
+
+def decode_lines(chunks, partial=True):
+    """
+    Turns a stream of byte chunks into complete lines. A chunk can end in the
+    middle of a line or even in the middle of a multi-byte character so both
+    are carried over to the next chunk. Each line keeps its trailing newline.
+    An unterminated last line is only yielded if partial is True.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    pending = u''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        pending += decoder.decode(chunk)
+        lines = pending.split(u'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + u'\n'
+    pending += decoder.decode(b'', final=True)
+    if pending and partial:
+        yield pending
+
+def filter_lines(lines, grep=None, level=None, replica=None):
+    """
+    Drops lines that do not match the regular expression grep, are tagged
+    with a level below level or come from a replica other than replica.
+    Lines without a level tag are kept since they are usually continuations
+    of a multi-line message.
+    """
+    pattern = re.compile(grep) if grep else None
+    minimum = level_index(level) if level else None
+    replica_re = re.compile(r'(^|[\s\[])%s([\s\]:]|$)' % re.escape(replica)) if replica else None
+    for line in lines:
+        if pattern is not None and not pattern.search(line):
+            continue
+        if replica_re is not None and not replica_re.search(line):
+            continue
+        if minimum is not None:
+            match = LEVEL_RE.search(line)
+            if match and level_index(match.group(1)) < minimum:
+                continue
+        yield line
+
+class SeenLines(object):
+    """
+    Hashes of the last size lines, used to recognize the lines the api replays
+    after a reconnect.
+    """
+    def __init__(self, size):
+        self.window = collections.deque(maxlen=size)
+        self.counts = collections.Counter()
+
+    def add(self, line):
+        if len(self.window) == self.window.maxlen:
+            oldest = self.window[0]
+            self.counts[oldest] -= 1
+            if not self.counts[oldest]:
+                del self.counts[oldest]
+        key = hash(line)
+        self.window.append(key)
+        self.counts[key] += 1
+
+    def __contains__(self, line):
+        return hash(line) in self.counts
+
+def backoff(attempt):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+def follow(connect, num_lines=None, resume_lines=RESUME_LINES):
+    """
+    Yields log lines, reconnecting with exponential backoff whenever the
+    stream drops or stalls. A stream the api ends properly is not resumed.
+    connect(num_lines) must open the stream and raise for http errors, which
+    are not retried.
+
+    After a reconnect the api replays the last resume_lines lines. Lines at
+    the start of the replay that were already yielded are dropped.
+    """
+    import requests
+    errors = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout)
+    seen = SeenLines(resume_lines)
+    attempt = 0
+    replaying = False
+    while True:
+        try:
+            r = connect(num_lines)
+            try:
+                # a line cut off by a dropped stream never comes out of
+                # decode_lines and the replay brings it back whole. The
+                # unterminated last line of a stream that ended properly is
+                # kept.
+                for line in decode_lines(r.iter_content(chunk_size=None)):
+                    attempt = 0
+                    if replaying:
+                        if line in seen:
+                            continue
+                        replaying = False
+                    seen.add(line)
+                    yield line
+            finally:
+                r.close()
+            return
+        except errors as e:
+            logging.getLogger("gigalixir-cli").debug(e)
+        delay = backoff(attempt)
+        logging.getLogger("gigalixir-cli").info("Log stream disconnected. Reconnecting in %.1fs." % delay)
+        time.sleep(delay)
+        attempt += 1
+        num_lines = resume_lines
+        replaying = True
+
+class BatchedWriter(object):
+    """
+    Writes lines to stdout from a background thread. Whatever lines have
+    piled up since the last write are joined into a single write so a busy
+    app costs one syscall per batch instead of one per line. The queue
+    between the two is bounded so a slow terminal pushes back on the reader.
+    """
+    def __init__(self, max_pending=MAX_PENDING_LINES, max_batch=MAX_BATCH_LINES):
+        self.max_batch = max_batch
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, line):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(line)
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch and self.error is None:
+                try:
+                    click.echo(u''.join(batch), nl=False)
+                except Exception as e:
+                    # keep draining so write() and close() never block
+                    self.error = e
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+def echo_lines(lines):
+    with BatchedWriter() as writer:
+        for line in lines:
+            writer.write(line)
@@ -1,7 +1,9 @@
 from __future__ import absolute_import
+import contextlib
 import netrc
 import os
 import platform
+import tempfile
 
 def netrc_name():
     if platform.system().lower() == 'windows':
@@ -9,9 +11,12 @@ def netrc_name():
     else:
         return ".netrc"
 
-def get_netrc_file():
+def netrc_path():
     # TODO: support netrc files in locations other than ~/.netrc
-    fname = os.path.join(os.environ['HOME'], netrc_name())
+    return os.path.join(os.environ['HOME'], netrc_name())
+
+def get_netrc_file():
+    fname = netrc_path()
     try:
         netrc_file = netrc.netrc(fname)
     except IOError:
@@ -23,27 +28,63 @@ def get_netrc_file():
     
     return netrc_file, fname
 
+@contextlib.contextmanager
+def locked(fname):
+    """
+    Holds an exclusive lock on fname.lock so that concurrent cli processes
+    take turns reading, changing and rewriting the netrc file.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # windows
+        yield
+        return
+    with open(fname + '.lock', 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+def write_netrc(fname, netrc_file):
+    # write a temp file and rename it over the old one so the netrc is never
+    # seen truncated or half written
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)), prefix=os.path.basename(fname) + '.')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(netrc_repr(netrc_file))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, fname)
+    except:
+        os.remove(tmp)
+        raise
+    from . import credentials
+    credentials.reset()
+
 def clear_netrc():
-    netrc_file, fname = get_netrc_file()
+    with locked(netrc_path()):
+        netrc_file, fname = get_netrc_file()
 
-    del netrc_file.hosts['git.gigalixir.com'] 
-    del netrc_file.hosts['api.gigalixir.com']
-    with open(fname, 'w') as fp:
-        fp.write(netrc_repr(netrc_file))
+        del netrc_file.hosts['git.gigalixir.com'] 
+        del netrc_file.hosts['api.gigalixir.com']
+        write_netrc(fname, netrc_file)
 
 def update_netrc(email, key, env):
-    netrc_file, fname = get_netrc_file()
-    
-    if env == 'prod':
-        netrc_file.hosts['git.gigalixir.com'] = (email, None, key)
-        netrc_file.hosts['api.gigalixir.com'] = (email, None, key)
-    elif env == 'dev':
-        netrc_file.hosts['localhost'] = (email, None, key)
-    else:
-        raise Exception('Invalid env: %s' % env)
+    with locked(netrc_path()):
+        netrc_file, fname = get_netrc_file()
+
+        if env == 'prod':
+            netrc_file.hosts['git.gigalixir.com'] = (email, None, key)
+            netrc_file.hosts['api.gigalixir.com'] = (email, None, key)
+        elif env == 'dev':
+            netrc_file.hosts['localhost'] = (email, None, key)
+        else:
+            raise Exception('Invalid env: %s' % env)
 
-    with open(fname, 'w') as fp:
-        fp.write(netrc_repr(netrc_file))
+        write_netrc(fname, netrc_file)
 
 # Copied from https://github.com/enthought/Python-2.7.3/blob/master/Lib/netrc.py#L105
 # but uses str() instead of repr(). If the .netrc file uses quotes, repr will treat the quotes
@@ -5,69 +5,49 @@ import urllib
 import json
 import re
 import uuid
-import requests
 import sys
 import subprocess
 import time
-from .shell import cast, call
+import shutil
+import tempfile
+from .shell import cast
 from . import app as gigalixir_app
+from . import auth
+from . import ssh_master
+from concurrent.futures import ThreadPoolExecutor
 from six.moves.urllib.parse import quote
 
 def observer(ctx, app_name, erlang_cookie=None, ssh_opts=""):
     if not ctx.obj['router'].supports_multiplexing():
         raise Exception("The observer command is not supported on this platform.")
 
-    host = ctx.obj['host']
-    r = requests.get('%s/api/apps/%s/observer-commands' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
-    if r.status_code != 200:
-        if r.status_code == 401:
-            raise auth.AuthException()
-        raise Exception(r.text)
-    else:
-        command = json.loads(r.text)["data"]
-        get_cookie_command = command["get_cookie"]
-        get_node_name_command = command["get_node_name"]
+    session = ctx.obj['session']
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        commands = pool.submit(observer_commands, session, app_name)
+        ip = pool.submit(app_ssh_ip, session, app_name)
+        command, ssh_ip = commands.result(), ip.result()
+    get_cookie_command = command["get_cookie"]
+    get_node_name_command = command["get_node_name"]
 
-    r = requests.get('%s/api/apps/%s/ssh_ip' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
-    if r.status_code != 200:
-        if r.status_code == 401:
-            raise auth.AuthException()
-        raise Exception(r.text)
-    else:
-        data = json.loads(r.text)["data"]
-        ssh_ip = data["ssh_ip"]
-
-    ssh_master_pid = None
-    control_path = "/tmp/gigalixir-cm-%s" % uuid.uuid4()
-    ssh_opts += " -S %s" % control_path
-    try: 
-        logging.getLogger("gigalixir-cli").info("Setting up SSH multiplexing master")
-        cmd = "".join(["ssh %s" % (ssh_opts), " root@%s -N -M" % (ssh_ip)])
-        ssh_master_pid = subprocess.Popen(cmd.split()).pid
-
-        # wait for ssh master to connect
-        logging.getLogger("gigalixir-cli").info("Waiting for SSH multiplexing master")
-        time.sleep(5)
-
-        logging.getLogger("gigalixir-cli").info("Fetching erlang cookie")
-        if erlang_cookie is None:
-            ERLANG_COOKIE = gigalixir_app.distillery_eval(host, app_name, ssh_opts, get_cookie_command).strip("'")
-        else:
-            ERLANG_COOKIE = erlang_cookie
+    # the cookie, node name and epmd lookups and the forwarded ports all
+    # run over one shared connection
+    logging.getLogger("gigalixir-cli").info("Connecting to %s" % app_name)
+    control_path = ssh_master.master(app_name, ssh_ip, ssh_opts)
+    if control_path is None:
+        # e.g. an unknown host key, which the shared connection can not ask about
+        raise Exception("Could not connect to %s over ssh. Try `gigalixir ps:ssh -a %s` once to answer any ssh prompts." % (app_name, app_name))
+    ssh_opts = ' '.join(part for part in [ssh_opts, "-o ControlMaster=no -o ControlPath=%s" % control_path] if part)
+    forwarders = []
+    epmd_dir = None
+    try:
+        logging.getLogger("gigalixir-cli").info("Fetching erlang cookie, pod ip, epmd port and app port")
+        cookie, node_name, output = discover(session, app_name, ssh_opts, None if erlang_cookie else get_cookie_command, get_node_name_command)
+        ERLANG_COOKIE = erlang_cookie or cookie.strip("'")
         logging.getLogger("gigalixir-cli").info("Using erlang cookie: %s" % ERLANG_COOKIE)
-
-        logging.getLogger("gigalixir-cli").info("Fetching pod ip")
-        node_name = gigalixir_app.distillery_eval(host, app_name, ssh_opts, get_node_name_command)
         # node_name is surrounded with single quotes
         (sname, MY_POD_IP) = node_name.strip("'").split('@')
         logging.getLogger("gigalixir-cli").info("Using pod ip: %s" % MY_POD_IP)
         logging.getLogger("gigalixir-cli").info("Using node name: %s" % sname)
-        logging.getLogger("gigalixir-cli").info("Fetching epmd port and app port.")
-        output = gigalixir_app.ssh_helper(host, app_name, ssh_opts, True, "--", "epmd", "-names")
         EPMD_PORT=None
         APP_PORT=None
         for line in output.splitlines():
@@ -82,64 +62,146 @@ def observer(ctx, app_name, erlang_cookie=None, ssh_opts=""):
         if APP_PORT == None:
             raise Exception("APP_PORT not found.")
 
-        ensure_port_free(EPMD_PORT)
-        ensure_port_free(APP_PORT)
-
-        try:
-            logging.getLogger("gigalixir-cli").info("Setting up SSH tunnel for ports %s and %s" % (APP_PORT, EPMD_PORT))
-            cmd = "".join(["ssh %s -O forward -L %s" % (ssh_opts, APP_PORT), ":localhost:", "%s -L %s" % (APP_PORT, EPMD_PORT), ":localhost:", "%s root@%s" % (EPMD_PORT, ssh_ip)])
-
-            cast(cmd)
-            # no need to route if pod ip is 127.0.0.1
-            logging.getLogger("gigalixir-cli").info("Routing %s to 127.0.0.1" % MY_POD_IP)
-
-            ctx.obj['router'].route_to_localhost(MY_POD_IP, EPMD_PORT, APP_PORT)
-            name = uuid.uuid4()
-            # cmd = "iex --name %(name)s@%(MY_POD_IP)s --cookie %(ERLANG_COOKIE)s --hidden -e ':observer.start()'" % {"name": name, "MY_POD_IP": MY_POD_IP, "ERLANG_COOKIE": ERLANG_COOKIE}
-            cmd = "erl -name %(name)s@%(MY_POD_IP)s -setcookie %(ERLANG_COOKIE)s -hidden -run observer" % {"name": name, "MY_POD_IP": MY_POD_IP, "ERLANG_COOKIE": ERLANG_COOKIE}
-            logging.getLogger("gigalixir-cli").info("Running observer using: %s" % cmd)
-            logging.getLogger("gigalixir-cli").info("")
-            logging.getLogger("gigalixir-cli").info("")
-            logging.getLogger("gigalixir-cli").info("============")
-            logging.getLogger("gigalixir-cli").info("Instructions")
-            logging.getLogger("gigalixir-cli").info("============")
-
-            logging.getLogger("gigalixir-cli").info("In the 'Node' menu, click 'Connect Node'" )
-            logging.getLogger("gigalixir-cli").info("enter: %(sname)s@%(MY_POD_IP)s" % {"sname": sname, "MY_POD_IP": MY_POD_IP})
-            logging.getLogger("gigalixir-cli").info("and press OK.")
-            logging.getLogger("gigalixir-cli").info("")
-            logging.getLogger("gigalixir-cli").info("")
-            cast(cmd)
-        finally:
-            logging.getLogger("gigalixir-cli").info("Cleaning up route from %s to 127.0.0.1" % MY_POD_IP)
-            ctx.obj['router'].unroute_to_localhost(MY_POD_IP)
+        # both ports are forwarded to free local ports, so nothing needs to
+        # be routed and any number of observers can run at once
+        logging.getLogger("gigalixir-cli").info("Forwarding ports %s and %s" % (APP_PORT, EPMD_PORT))
+        from .forwarder import Forwarder
+        forwarders.append(Forwarder(ssh_opts, ssh_ip, 'localhost', EPMD_PORT))
+        forwarders.append(Forwarder(ssh_opts, ssh_ip, 'localhost', APP_PORT))
+        local_epmd_port, local_app_port = [forwarder.start() for forwarder in forwarders]
+
+        epmd_dir = tempfile.mkdtemp(prefix='gigalixir-observer-')
+        compile_epmd_module(epmd_dir, local_app_port)
+        name = uuid.uuid4()
+        # cmd = "iex --name %(name)s@%(MY_POD_IP)s --cookie %(ERLANG_COOKIE)s --hidden -e ':observer.start()'" % {"name": name, "MY_POD_IP": MY_POD_IP, "ERLANG_COOKIE": ERLANG_COOKIE}
+        cmd = "erl -name %(name)s@127.0.0.1 -setcookie %(ERLANG_COOKIE)s -hidden -start_epmd false -epmd_module %(EPMD_MODULE)s -kernel epmd_port %(EPMD_PORT)s -pa %(EPMD_DIR)s -run observer" % {"name": name, "ERLANG_COOKIE": ERLANG_COOKIE, "EPMD_MODULE": EPMD_MODULE, "EPMD_PORT": local_epmd_port, "EPMD_DIR": epmd_dir}
+        logging.getLogger("gigalixir-cli").info("Running observer using: %s" % cmd)
+        logging.getLogger("gigalixir-cli").info("")
+        logging.getLogger("gigalixir-cli").info("")
+        logging.getLogger("gigalixir-cli").info("============")
+        logging.getLogger("gigalixir-cli").info("Instructions")
+        logging.getLogger("gigalixir-cli").info("============")
+
+        logging.getLogger("gigalixir-cli").info("In the 'Node' menu, click 'Connect Node'" )
+        logging.getLogger("gigalixir-cli").info("enter: %(sname)s@%(MY_POD_IP)s" % {"sname": sname, "MY_POD_IP": MY_POD_IP})
+        logging.getLogger("gigalixir-cli").info("and press OK.")
+        logging.getLogger("gigalixir-cli").info("")
+        logging.getLogger("gigalixir-cli").info("")
+        cast(cmd)
     finally:
-        if ssh_master_pid:
-            # Needed because Ctrl-G -> q leaves it orphaned for some reason. is the subprocess
-            # not sent a signal on graceful termination?
-            logging.getLogger("gigalixir-cli").info("Cleaning up SSH multiplexing master")
-            try:
-                os.kill(ssh_master_pid, signal.SIGTERM)
-            except OSError:
-                # race condition if parent process tries to clean up subprocesses at the same
-                # time
-                pass
-        if os.path.exists(control_path):
-            logging.getLogger("gigalixir-cli").info("Deleting SSH multiplexing file")
-            try:
-                os.remove(control_path)
-            except OSError:
-                # race condition if ssh and we try to clean up the file at the same time
-                pass
-
-def ensure_port_free(port):
+        # the connection stays up for the next command, the forwarders do not
+        for forwarder in forwarders:
+            forwarder.stop()
+        if epmd_dir is not None:
+            shutil.rmtree(epmd_dir, ignore_errors=True)
+
+def observer_commands(session, app_name):
+    r = session.get('/api/apps/%s/observer-commands' % quote(app_name.encode('utf-8')))
+    if r.status_code != 200:
+        if r.status_code == 401:
+            raise auth.AuthException()
+        raise Exception(r.text)
+    else:
+        return json.loads(r.text)["data"]
+
+def app_ssh_ip(session, app_name):
+    r = session.get('/api/apps/%s/ssh_ip' % quote(app_name.encode('utf-8')), cached=True)
+    if r.status_code != 200:
+        if r.status_code == 401:
+            raise auth.AuthException()
+        raise Exception(r.text)
+    else:
+        return json.loads(r.text)["data"]["ssh_ip"]
+
+# runs the cookie and node name lookups and epmd in one ssh round trip. The
+# expressions are passed as arguments so they need no quoting. An empty
+# cookie expression skips that lookup.
+DISCOVERY_MARKER = '==gigalixir:%s=='
+DISCOVERY_SCRIPT = '; '.join([
+    'echo %s' % (DISCOVERY_MARKER % 'cookie'),
+    '[ -z "$1" ] || gigalixir_run distillery_eval -- "$1"',
+    'echo %s' % (DISCOVERY_MARKER % 'node'),
+    'gigalixir_run distillery_eval -- "$2"',
+    'echo %s' % (DISCOVERY_MARKER % 'epmd'),
+    'epmd -names',
+])
+
+def parse_discovery(output):
+    """
+    Splits the discovery script's output into its sections. Returns None if
+    a section is missing.
+    """
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        match = re.match(r'^%s$' % (re.escape(DISCOVERY_MARKER) % r'(\w+)'), line.strip())
+        if match:
+            current = match.group(1)
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line.strip())
+    if sorted(sections) != ['cookie', 'epmd', 'node']:
+        return None
+    def value(lines):
+        lines = [line for line in lines if line]
+        return lines[-1] if lines else ''
+    return value(sections['cookie']), value(sections['node']), '\n'.join(sections['epmd'])
+
+def discover(session, app_name, ssh_opts, get_cookie_command, get_node_name_command):
+    """
+    Returns the erlang cookie, the node name and the output of epmd -names.
+    The cookie is only looked up if get_cookie_command is given.
+    """
+    output = gigalixir_app.ssh_helper(session, app_name, ssh_opts, True, "--", "sh", "-c", DISCOVERY_SCRIPT, "sh",
+                                      get_cookie_command or "", get_node_name_command)
+    found = parse_discovery(output)
+    if found is not None and found[1]:
+        return found
+    # one lookup at a time, like containers without sh need
+    logging.getLogger("gigalixir-cli").debug("Combined lookup failed, output: %s" % output)
+    cookie = gigalixir_app.distillery_eval(session, app_name, ssh_opts, get_cookie_command) if get_cookie_command else ''
+    node_name = gigalixir_app.distillery_eval(session, app_name, ssh_opts, get_node_name_command)
+    return cookie, node_name, gigalixir_app.ssh_helper(session, app_name, ssh_opts, True, "--", "epmd", "-names")
+
+# Stands in for epmd in the local node. Every node name resolves to the
+# app's node through the forwarded ports, whatever its host, so the node
+# name the app uses can be entered as it is. Needs OTP 21 or later.
+EPMD_MODULE = 'gigalixir_epmd'
+EPMD_MODULE_SOURCE = """-module(gigalixir_epmd).
+-export([start_link/0, register_node/2, register_node/3, listen_port_please/2,
+         port_please/2, port_please/3, address_please/3, names/1]).
+
+start_link() -> ignore.
+
+register_node(Name, Port) -> register_node(Name, Port, inet).
+register_node(_Name, _Port, _Family) -> {ok, 1}.
+
+listen_port_please(_Name, _Host) -> {ok, 0}.
+
+port_please(Name, Host) -> port_please(Name, Host, infinity).
+port_please(Name, _Host, Timeout) ->
+    case erl_epmd:port_please(Name, {127,0,0,1}, Timeout) of
+        {port, _Port, Version} -> {port, %(app_port)s, Version};
+        Other -> Other
+    end.
+
+address_please(Name, Host, _Family) ->
+    case port_please(Name, Host) of
+        {port, Port, Version} -> {ok, {127,0,0,1}, Port, Version};
+        _ -> {error, nxdomain}
+    end.
+
+names(_Host) -> erl_epmd:names({127,0,0,1}).
+"""
+
+def epmd_module_source(app_port):
+    return EPMD_MODULE_SOURCE % {"app_port": int(app_port)}
+
+def compile_epmd_module(directory, app_port):
+    path = os.path.join(directory, '%s.erl' % EPMD_MODULE)
+    with open(path, 'w') as f:
+        f.write(epmd_module_source(app_port))
     try:
-        # if the port is in use, then a pid is found, this "succeeds" and continues
-        # if the port is free, then a pid is not found, this "fails" and raises a CalledProcessError
-        pid = call("lsof -wni tcp:%(port)s -t" % {"port": port})
-        # If multiplexing gets supported later, on Windows this command would be: 
-        #   pid = call("netstat -p tcp -n | find \"\"\":%(port)s\"\"\" % {"port": port})
-        raise Exception("It looks like process %s is using port %s on your local machine. We need this port to be able to connect observer. Please kill this process on your local machine and try again. e.g. `kill %s`" % (pid, port, pid))
-    except subprocess.CalledProcessError:
-        # success! continue
-        pass
+        cast("erlc -o %s %s" % (directory, path))
+    except OSError:
+        raise Exception("Sorry, we could not find erlc. Try installing erlang and try again.")
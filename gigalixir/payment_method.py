@@ -1,16 +1,12 @@
 import logging
-import requests
-import stripe
 from . import auth
 from . import presenter
 import urllib
 import json
 import click
 
-def get(host):
-    r = requests.get('%s/api/payment_methods' % host, headers = {
-        'Content-Type': 'application/json',
-    })
+def get(session):
+    r = session.get('/api/payment_methods')
     if r.status_code == 404:
         logging.getLogger("gigalixir-cli").info("No payment method found.")
     elif r.status_code != 200:
@@ -21,7 +17,10 @@ def get(host):
         data = json.loads(r.text)["data"]
         presenter.echo_json(data)
 
-def update(host, card_number, card_exp_month, card_exp_year, card_cvc):
+def update(session, stripe_api_key, card_number, card_exp_month, card_exp_year, card_cvc):
+    # stripe is slow to import and only this command needs it
+    import stripe
+    stripe.api_key = stripe_api_key
     token = stripe.Token.create(
         card={
             "number": card_number,
@@ -30,9 +29,7 @@ def update(host, card_number, card_exp_month, card_exp_year, card_cvc):
             "cvc": card_cvc,
         },
     )
-    r = requests.put('%s/api/payment_methods' % host, headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+    r = session.put('/api/payment_methods', json = {
         "stripe_token": token["id"],
     })
     if r.status_code != 200:
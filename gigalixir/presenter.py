@@ -1,11 +1,162 @@
 import click
+import csv
 import json
-from pygments import highlight, lexers, formatters
+import sys
+from . import timing
 
 # Fix Python 2.x.
 from six import u as unicode
+from six import StringIO
+
+OUTPUTS = ['json', 'ndjson', 'table', 'csv', 'yaml']
+
+def output_options():
+    """
+    Returns the --output and --fields given to the running command. Outside
+    of a command, e.g. when used as a library, that is plain json.
+    """
+    ctx = click.get_current_context(silent=True)
+    obj = ctx.obj if ctx is not None and isinstance(ctx.obj, dict) else {}
+    return obj.get('output'), obj.get('fields')
+
+def parse_fields(fields):
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+def lookup(record, field):
+    # dotted fields reach into nested objects e.g. pods.0.name
+    value = record
+    for part in field.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+def project(data, fields):
+    if fields is None:
+        return data
+    if isinstance(data, list):
+        return [project(record, fields) for record in data]
+    if isinstance(data, dict):
+        return dict((field, lookup(data, field)) for field in fields)
+    return data
+
+def columns(records, fields):
+    if fields is not None:
+        return fields
+    seen = []
+    for record in records:
+        for key in sorted(record):
+            if key not in seen:
+                seen.append(key)
+    return seen
+
+def cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return u'%s' % (value,)
+
+def rows(data, fields):
+    """
+    Returns (header, rows) for a table or csv. A list of objects gets one
+    row per object. A single object gets one row per key.
+    """
+    if isinstance(data, list) and all(isinstance(record, dict) for record in data):
+        header = columns(data, fields)
+        return header, [[cell(record.get(column)) for column in header] for record in data]
+    if isinstance(data, dict):
+        return ['key', 'value'], [[key, cell(data[key])] for key in (fields or sorted(data))]
+    if isinstance(data, list):
+        return ['value'], [[cell(value)] for value in data]
+    return ['value'], [[cell(data)]]
+
+def echo_table(data, fields):
+    header, body = rows(data, fields)
+    widths = [max(len(value) for value in column) for column in zip(header, *body)]
+    for row in [header] + body:
+        click.echo(u'  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+def echo_csv(data, fields):
+    header, body = rows(data, fields)
+    out = StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(body)
+    click.echo(out.getvalue(), nl=False)
+
+def echo_ndjson(data):
+    records = data if isinstance(data, list) else [data]
+    for record in records:
+        click.echo(json.dumps(record, sort_keys=True))
+
+def echo_yaml(data):
+    try:
+        import yaml
+    except ImportError:
+        raise Exception("--output yaml needs PyYAML. Try `pip install pyyaml`.")
+    click.echo(yaml.safe_dump(data, default_flow_style=False, allow_unicode=True), nl=False)
 
 def echo_json(data):
-    formatted_json = json.dumps(data, indent=2, sort_keys=True)
-    colorful_json = highlight(unicode(formatted_json), lexers.JsonLexer(), formatters.TerminalFormatter())
-    click.echo(colorful_json)
+    output, fields = output_options()
+    with timing.span('render', output=output or 'json'):
+        _echo_json(data, output, fields)
+
+def _echo_json(data, output, fields):
+    data = project(data, fields)
+    if output == 'ndjson':
+        echo_ndjson(data)
+    elif output == 'table':
+        echo_table(data, fields)
+    elif output == 'csv':
+        echo_csv(data, fields)
+    elif output == 'yaml':
+        echo_yaml(data)
+    else:
+        formatted_json = json.dumps(data, indent=2, sort_keys=True)
+        if sys.stdout.isatty():
+            # pygments is slow to import so only load it for a terminal
+            from pygments import highlight, lexers, formatters
+            click.echo(highlight(unicode(formatted_json), lexers.JsonLexer(), formatters.TerminalFormatter()))
+        else:
+            # same output as highlighting, minus the colors
+            click.echo(formatted_json + "\n")
+
+def echo_json_list(records):
+    """
+    Prints a list while its records are still being received. json and
+    ndjson print each record right away; the other formats need all of them
+    to line up columns so they collect the list first.
+    """
+    output, fields = output_options()
+    with timing.span('render', output=output or 'json'):
+        _echo_json_list(records, output, fields)
+
+def _echo_json_list(raw_records, output, fields):
+    records = (project(record, fields) for record in raw_records)
+    if output == 'ndjson':
+        for record in records:
+            click.echo(json.dumps(record, sort_keys=True))
+    elif output in (None, 'json'):
+        # prints exactly what json.dumps(list, indent=2) would
+        highlight = None
+        if sys.stdout.isatty():
+            from pygments import highlight as pygments_highlight, lexers, formatters
+            lexer, formatter = lexers.JsonLexer(ensurenl=False), formatters.TerminalFormatter()
+            highlight = lambda text: pygments_highlight(unicode(text), lexer, formatter)
+        separator = u'[\n'
+        for record in records:
+            formatted = u'\n'.join(u'  ' + line for line in json.dumps(record, indent=2, sort_keys=True).split(u'\n'))
+            text = separator + formatted
+            click.echo(highlight(text) if highlight else text, nl=False)
+            separator = u',\n'
+        click.echo(u'[]\n' if separator == u'[\n' else u'\n]\n')
+    else:
+        _echo_json(list(raw_records), output, fields)
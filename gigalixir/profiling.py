@@ -0,0 +1,143 @@
+"""
+Profiles a whole command for `gigalixir --profile cpu|mem`, including its
+error handling, and writes the reports next to each other:
+
+    gigalixir-<command>-<time>-<pid>.pstats     cpu: cProfile stats for pstats or snakeviz
+    gigalixir-<command>-<time>-<pid>.txt        cpu: the slowest calls, mem: the top allocations
+    gigalixir-<command>-<time>-<pid>.collapsed  collapsed stacks for flamegraph.pl or speedscope
+
+The cpu flame graph is built from cProfile's own caller and callee times,
+so nothing else runs alongside the profiler and skews its numbers. A
+function's time is split between the stacks that called it in proportion
+to the time each caller spent in it. Like the rest of the cpu report it
+shows the wall clock time of the thread running the command, waiting on
+the api included.
+The mem flame graph weighs every stack by the bytes still allocated when
+the command finished.
+"""
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+KINDS = ['cpu', 'mem']
+
+TOP = 40
+# paths through the call graph worth less than this many seconds are left
+# out of the cpu flame graph
+MIN_STACK_SECONDS = 1e-6
+# frames kept per allocation
+MEM_FRAMES = 32
+
+def frame_name(filename, lineno, function):
+    return '%s (%s:%s)' % (function, os.path.basename(filename), lineno)
+
+def collapse(stacks):
+    """
+    Lines of "root;...;leaf weight", the format flamegraph.pl reads.
+    """
+    return ['%s %s' % (';'.join(stack), weight) for stack, weight in sorted(stacks.items()) if weight > 0]
+
+def call_graph_stacks(stats):
+    """
+    Collapsed stacks weighted in microseconds from pstats' stats, which map
+    each function to (calls, primitive calls, own time, cumulative time,
+    callers).
+    """
+    callees = defaultdict(list)
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller in callers:
+            callees[caller].append(function)
+    stacks = Counter()
+
+    def walk(function, stack, on_stack, own, cumulative):
+        stack = stack + (frame_name(*function),)
+        stacks[stack] += int(own * 1e6)
+        total = stats[function][3]
+        # the share of the function's time spent below this stack
+        share = cumulative / total if total else 0
+        for callee in callees[function]:
+            if callee in on_stack:
+                continue
+            _, _, callee_own, callee_cumulative = stats[callee][4][function][:4]
+            if callee_cumulative * share >= MIN_STACK_SECONDS:
+                walk(callee, stack, on_stack | set([callee]), callee_own * share, callee_cumulative * share)
+
+    for function, (_, _, own, cumulative, callers) in stats.items():
+        if not callers:
+            walk(function, (), set([function]), own, cumulative)
+    return stacks
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+@contextmanager
+def cpu(prefix):
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(prefix + '.pstats')
+        with open(prefix + '.txt', 'w') as f:
+            stats = pstats.Stats(profile, stream=f)
+            stats.sort_stats('cumulative').print_stats(TOP)
+        write_lines(prefix + '.collapsed', collapse(call_graph_stacks(stats.stats)))
+
+@contextmanager
+def mem(prefix):
+    import tracemalloc
+    # tracing may already be on, e.g. with PYTHONTRACEMALLOC
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(MEM_FRAMES)
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if started:
+            tracemalloc.stop()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        lines = ['peak %.1f KiB' % (peak / 1024.0), '']
+        for stat in snapshot.statistics('lineno')[:TOP]:
+            frame = stat.traceback[0]
+            lines.append('%10.1f KiB %8d blocks  %s:%s' % (stat.size / 1024.0, stat.count, frame.filename, frame.lineno))
+        write_lines(prefix + '.txt', lines)
+        stacks = Counter()
+        for stat in snapshot.statistics('traceback'):
+            # tracemalloc lists the most recent frame first
+            stack = tuple('%s:%s' % (os.path.basename(frame.filename), frame.lineno) for frame in reversed(stat.traceback))
+            stacks[stack] += stat.size
+        write_lines(prefix + '.collapsed', collapse(stacks))
+
+PROFILERS = {
+    'cpu': cpu,
+    'mem': mem,
+}
+
+def report_prefix(directory, command):
+    name = (command or 'cli').replace(':', '-').replace(os.sep, '-')
+    # the time tells apart commands run by the same agent process
+    return os.path.join(directory or os.getcwd(), 'gigalixir-%s-%s-%s' % (name, time.strftime('%Y%m%dT%H%M%S'), os.getpid()))
+
+@contextmanager
+def profiled(kind, directory=None, command=None):
+    """
+    Profiles the with block with the kind of profiler and tells on stderr
+    where the reports went.
+    """
+    prefix = report_prefix(directory, command)
+    started = time.time()
+    try:
+        with PROFILERS[kind](prefix):
+            yield
+    finally:
+        sys.stderr.write('%s profile of %.2fs written to %s.{%s}\n' % (
+            kind, time.time() - started, prefix, 'pstats,txt,collapsed' if kind == 'cpu' else 'txt,collapsed'))
@@ -1,20 +1,27 @@
-import requests
 from . import auth
 from . import presenter
+from . import json_stream
+from contextlib import closing
 import urllib
 import json
 import click
 from six.moves.urllib.parse import quote
 
-def get(host, app_name):
-    r = requests.get('%s/api/apps/%s/releases' % (host, quote(app_name.encode('utf-8'))), headers = {
-        'Content-Type': 'application/json',
-    })
+def releases(session, app_name):
+    r = session.get('/api/apps/%s/releases' % quote(app_name.encode('utf-8')))
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     else:
-        data = json.loads(r.text)["data"]
-        presenter.echo_json(data)
+        return json.loads(r.text)["data"]
+
+def get(session, app_name):
+    with closing(session.get('/api/apps/%s/releases' % quote(app_name.encode('utf-8')), stream=True)) as r:
+        if r.status_code != 200:
+            if r.status_code == 401:
+                raise auth.AuthException()
+            raise Exception(r.text)
+        else:
+            presenter.echo_json_list(json_stream.iter_response_data(r))
 
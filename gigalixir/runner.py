@@ -0,0 +1,93 @@
+"""
+Runs cli commands inside an already running process, for `gigalixir batch`
+and `gigalixir agent`.
+"""
+import io
+import logging
+import sys
+import threading
+from contextlib import contextmanager
+
+def exit_code(argv):
+    """
+    Runs the command line argv and returns its exit code instead of
+    exiting.
+    """
+    from . import cli
+    try:
+        cli.main(args=list(argv), prog_name='gigalixir')
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write('%s\n' % e.code)
+        return 1
+    except Exception:
+        import traceback
+        traceback.print_exc()
+        return 1
+    return 0
+
+class RoutedStream(object):
+    """
+    Stands in for sys.stdout or sys.stderr. Writes go to the stream the
+    current thread routed its output to, or to the original stream.
+    """
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def target(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def write(self, data):
+        return self.target().write(data)
+
+    def flush(self):
+        return self.target().flush()
+
+    def isatty(self):
+        return self.target().isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.target(), name)
+
+def text_buffer():
+    # the same kind of stream click's CliRunner captures output with
+    return io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+
+def getvalue(stream):
+    stream.flush()
+    return stream.buffer.getvalue().decode('utf-8', 'replace')
+
+@contextmanager
+def routed_output():
+    """
+    Replaces sys.stdout, sys.stderr and the cli's log output with
+    RoutedStreams for the duration of the block.
+    """
+    stdout, stderr = RoutedStream(sys.stdout), RoutedStream(sys.stderr)
+    logger = logging.getLogger("gigalixir-cli")
+    handler = logging.StreamHandler(stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    saved = sys.stdout, sys.stderr, logger.propagate
+    sys.stdout, sys.stderr = stdout, stderr
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        yield stdout, stderr
+    finally:
+        logger.removeHandler(handler)
+        sys.stdout, sys.stderr, logger.propagate = saved
+
+@contextmanager
+def route(stdout, stderr, out, err):
+    """
+    Sends the current thread's writes to the RoutedStreams stdout and stderr
+    to out and err.
+    """
+    saved = getattr(stdout.local, 'stream', None), getattr(stderr.local, 'stream', None)
+    stdout.local.stream, stderr.local.stream = out, err
+    try:
+        yield
+    finally:
+        stdout.local.stream, stderr.local.stream = saved
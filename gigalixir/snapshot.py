@@ -0,0 +1,304 @@
+"""
+Local SQLite copy of the account's apps for `gigalixir snapshot` and
+`gigalixir query`, e.g.
+
+    gigalixir snapshot
+    gigalixir query "select app from status where replicas_desired > 2"
+    gigalixir query "select app from apps where app not in (select app from drains)"
+
+Refreshing asks the api for every resource with the ETag or Last-Modified
+it returned last time, so unchanged resources cost a 304 and are not
+rewritten. Database passwords and urls, drain tokens and credentials and,
+unless asked for, config values are never stored.
+"""
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from six.moves.urllib.parse import quote, urlsplit, urlunsplit
+from . import api_session
+from . import auth
+from . import cache
+
+MAX_WORKERS = 8
+
+SCHEMA = """
+create table if not exists meta (
+    key text primary key,
+    value text
+);
+create table if not exists responses (
+    app text not null,
+    resource text not null,
+    etag text,
+    last_modified text,
+    fetched_at real not null,
+    primary key (app, resource)
+);
+create table if not exists apps (
+    app text primary key,
+    size real,
+    replicas integer,
+    cloud text,
+    region text,
+    stack text,
+    data text
+);
+create table if not exists status (
+    app text primary key,
+    replicas_desired integer,
+    replicas_running integer,
+    size real,
+    stack text,
+    data text
+);
+create table if not exists releases (
+    app text not null,
+    version integer not null,
+    sha text,
+    summary text,
+    created_at text,
+    data text,
+    primary key (app, version)
+);
+create table if not exists configs (
+    app text not null,
+    key text not null,
+    value text,
+    primary key (app, key)
+);
+create table if not exists databases (
+    app text not null,
+    id text not null,
+    size real,
+    state text,
+    tier text,
+    data text,
+    primary key (app, id)
+);
+create table if not exists domains (
+    app text not null,
+    fqdn text not null,
+    primary key (app, fqdn)
+);
+create table if not exists drains (
+    app text not null,
+    id text not null,
+    url text,
+    primary key (app, id)
+);
+create table if not exists canaries (
+    app text primary key,
+    canary text,
+    weight integer
+);
+create index if not exists apps_replicas on apps (replicas);
+create index if not exists apps_size on apps (size);
+create index if not exists status_replicas on status (replicas_desired);
+create index if not exists releases_created_at on releases (created_at);
+create index if not exists configs_key on configs (key);
+create index if not exists databases_state on databases (state);
+create index if not exists domains_fqdn on domains (fqdn);
+create index if not exists drains_url on drains (url);
+"""
+
+# per app resources and the tables they fill
+RESOURCES = ['status', 'releases', 'configs', 'databases', 'domains', 'drains', 'canaries']
+APP_TABLES = ['apps'] + RESOURCES
+
+# never stored
+SECRET_FIELDS = ('password', 'url', 'token')
+
+def db_path():
+    return os.path.join(cache.cache_dir(), 'snapshot.sqlite3')
+
+def connect(path):
+    # with --config-values the snapshot holds secrets, so only the user may
+    # read it, like the response cache
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+    os.chmod(path, 0o600)
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+def resource_path(app_name, resource):
+    return '/api/apps/%s/%s' % (quote(app_name.encode('utf-8')), resource)
+
+def without_secrets(record):
+    return dict((key, value) for key, value in record.items() if key not in SECRET_FIELDS)
+
+def without_credentials(url):
+    # drain urls can hold a user and password
+    parts = urlsplit(url or '')
+    if '@' not in parts.netloc:
+        return url
+    return urlunsplit(parts._replace(netloc=parts.netloc.rsplit('@', 1)[1]))
+
+def stack_name(stack):
+    if isinstance(stack, dict):
+        return stack.get('stack')
+    return stack
+
+def fetch(session, path, etag=None, last_modified=None):
+    """
+    Returns (data, etag, last modified) or None if the resource did not
+    change since the given etag or last modified.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    r = session.get(path, headers=headers)
+    if r.status_code == 304:
+        return None
+    if r.status_code != 200:
+        if r.status_code == 401:
+            raise auth.AuthException()
+        raise Exception(r.text)
+    return json.loads(r.text)["data"], r.headers.get('ETag'), r.headers.get('Last-Modified')
+
+def store_apps(db, app_name, record, config_values):
+    db.execute("insert into apps values (?, ?, ?, ?, ?, ?, ?)", (
+        app_name, record.get('size'), record.get('replicas'), record.get('cloud'), record.get('region'),
+        stack_name(record.get('stack')), json.dumps(record, sort_keys=True)))
+
+def store_status(db, app_name, data, config_values):
+    db.execute("insert into status values (?, ?, ?, ?, ?, ?)", (
+        app_name, data.get('replicas_desired', data.get('replicas')), data.get('replicas_running'), data.get('size'),
+        stack_name(data.get('stack')), json.dumps(data, sort_keys=True)))
+
+def store_releases(db, app_name, data, config_values):
+    db.executemany("insert or replace into releases values (?, ?, ?, ?, ?, ?)", [
+        (app_name, release.get('version'), release.get('sha'), release.get('summary'), release.get('created_at'),
+         json.dumps(release, sort_keys=True)) for release in data])
+
+def store_configs(db, app_name, data, config_values):
+    db.executemany("insert into configs values (?, ?, ?)", [
+        (app_name, key, value if config_values else None) for key, value in data.items()])
+
+def store_databases(db, app_name, data, config_values):
+    db.executemany("insert or replace into databases values (?, ?, ?, ?, ?, ?)", [
+        (app_name, u'%s' % database.get('id'), database.get('size'), database.get('state'), database.get('tier'),
+         json.dumps(without_secrets(database), sort_keys=True)) for database in data])
+
+def store_domains(db, app_name, data, config_values):
+    db.executemany("insert or replace into domains values (?, ?)", [(app_name, fqdn) for fqdn in data])
+
+def store_drains(db, app_name, data, config_values):
+    db.executemany("insert or replace into drains values (?, ?, ?)", [
+        (app_name, u'%s' % drain.get('id'), without_credentials(drain.get('url'))) for drain in data])
+
+def store_canaries(db, app_name, data, config_values):
+    if isinstance(data, list):
+        data = data[0] if data else None
+    if data and data.get('canary'):
+        db.execute("insert into canaries values (?, ?, ?)", (app_name, data['canary'], data.get('weight')))
+
+STORES = {
+    'apps': store_apps,
+    'status': store_status,
+    'releases': store_releases,
+    'configs': store_configs,
+    'databases': store_databases,
+    'domains': store_domains,
+    'drains': store_drains,
+    'canaries': store_canaries,
+}
+
+def validators(db, app_name, resource):
+    row = db.execute("select etag, last_modified from responses where app = ? and resource = ?", (app_name, resource)).fetchone()
+    return row if row is not None else (None, None)
+
+def replace(db, app_name, resource, data, etag, last_modified, config_values):
+    db.execute("delete from %s where app = ?" % resource, (app_name,))
+    STORES[resource](db, app_name, data, config_values)
+    db.execute("insert or replace into responses values (?, ?, ?, ?, ?)", (app_name, resource, etag, last_modified, time.time()))
+
+def forget(db, app_name):
+    for table in APP_TABLES + ['responses']:
+        db.execute("delete from %s where app = ?" % table, (app_name,))
+
+def refresh(session, path, config_values=False, max_workers=MAX_WORKERS):
+    """
+    Brings the snapshot at path up to date and returns a summary of what
+    changed.
+    """
+    started = time.time()
+    db = connect(path)
+    try:
+        # storing values is a choice made per snapshot, so changing it
+        # means fetching every config again
+        mode = '1' if config_values else '0'
+        row = db.execute("select value from meta where key = 'config_values'").fetchone()
+        if row is None or row[0] != mode:
+            db.execute("delete from responses where resource = 'configs'")
+            db.execute("insert or replace into meta values ('config_values', ?)", (mode,))
+        # '' stands for the account in the responses table
+        apps = fetch(session, '/api/apps', *validators(db, '', 'apps'))
+        if apps is None:
+            app_names = [row[0] for row in db.execute("select app from apps")]
+        else:
+            data, etag, last_modified = apps
+            app_names = [record['unique_name'] for record in data]
+            for record in data:
+                db.execute("delete from apps where app = ?", (record['unique_name'],))
+                store_apps(db, record['unique_name'], record, config_values)
+            db.execute("insert or replace into responses values ('', 'apps', ?, ?, ?)", (etag, last_modified, time.time()))
+        known = db.execute("select app from apps union select app from responses where app != ''")
+        removed = [row[0] for row in known if row[0] not in set(app_names)]
+        for app_name in removed:
+            forget(db, app_name)
+
+        tasks = [(app_name, resource) for app_name in app_names for resource in RESOURCES]
+        changed = set()
+        errors = []
+        workers = max(1, min(max_workers, api_session.POOL_MAXSIZE, len(tasks) or 1))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = dict((pool.submit(fetch, session, resource_path(app_name, resource), *validators(db, app_name, resource)),
+                            (app_name, resource)) for app_name, resource in tasks)
+            # sqlite is only touched from this thread
+            for future in as_completed(futures):
+                app_name, resource = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append("%s %s: %s" % (app_name, resource, e))
+                    continue
+                if result is not None:
+                    replace(db, app_name, resource, result[0], result[1], result[2], config_values)
+                    changed.add(app_name)
+        db.commit()
+    finally:
+        db.close()
+    summary = {
+        "apps": len(app_names),
+        "changed_apps": sorted(changed),
+        "removed_apps": sorted(removed),
+        "requests": len(tasks) + 1,
+        "seconds": round(time.time() - started, 3),
+    }
+    if errors:
+        summary["errors"] = sorted(errors)
+    return summary
+
+def query(path, sql, params=()):
+    """
+    Runs sql against the snapshot at path and returns the rows as dicts.
+    """
+    if not os.path.exists(path):
+        raise Exception("No snapshot yet. Run `gigalixir snapshot` first.")
+    # opened read-only so a query can not change the snapshot
+    db = sqlite3.connect('file:%s?mode=ro' % quote(os.path.abspath(path)), uri=True)
+    try:
+        cursor = db.execute(sql, params)
+        columns = [column[0] for column in cursor.description or []]
+        return [dict(zip(columns, row)) for row in cursor]
+    except sqlite3.Error as e:
+        raise Exception("%s" % e)
+    finally:
+        db.close()
@@ -1,14 +1,11 @@
-import requests
 from . import auth
 from . import presenter
 import json
 import click
 import logging
 
-def ssh_keys(host):
-    r = requests.get('%s/api/ssh_keys' % host, headers = {
-        'Content-Type': 'application/json',
-    })
+def ssh_keys(session, cached=False):
+    r = session.get('/api/ssh_keys', cached=cached)
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -16,14 +13,12 @@ def ssh_keys(host):
     else:
         return json.loads(r.text)["data"]
 
-def get(host):
-    data = ssh_keys(host)
+def get(session):
+    data = ssh_keys(session)
     presenter.echo_json(data)
 
-def create(host, key):
-    r = requests.post('%s/api/ssh_keys' % host, headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def create(session, key):
+    r = session.post('/api/ssh_keys', json = {
         "ssh_key": key,
     })
     if r.status_code != 201:
@@ -32,10 +27,8 @@ def create(host, key):
         raise Exception(r.text)
     logging.getLogger("gigalixir-cli").info('Please allow a few minutes for the SSH key to propagate to your run containers.')
 
-def delete(host, key_id):
-    r = requests.delete('%s/api/ssh_keys' % (host), headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def delete(session, key_id):
+    r = session.delete('/api/ssh_keys', idempotent=True, json = {
         "id": key_id
     })
     if r.status_code != 200:
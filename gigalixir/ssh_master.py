@@ -0,0 +1,184 @@
+"""
+Shared ssh connections to app containers. The first ssh command for an app
+starts a ControlMaster in the background and later commands, including the
+observer's, run over it instead of doing their own handshake. A master
+exits on its own CONTROL_PERSIST seconds after its last session.
+
+Sockets live in a directory only the user can read, named by a hash of
+the app, ssh ip and ssh options. A json file next to each socket says what
+it is for, for `gigalixir ssh:connections`.
+"""
+import hashlib
+import json
+import logging
+import os
+import stat
+import subprocess
+import tempfile
+import time
+from . import cache
+
+CONTROL_PERSIST = 600
+# seconds to wait for a new master to connect
+CONNECT_TIMEOUT = 30
+POLL_BASE = 0.01
+POLL_MAX = 0.2
+DISABLE_ENV = 'GIGALIXIR_SSH_MULTIPLEX'
+
+def enabled():
+    # windows' ssh has no ControlMaster
+    return os.name != 'nt' and os.environ.get(DISABLE_ENV, '1') != '0'
+
+def socket_dir():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        directory = os.path.join(runtime_dir, 'gigalixir', 'ssh')
+    else:
+        directory = os.path.join(cache.cache_dir(), 'ssh')
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    # anyone who can reach a master's socket can run commands through it
+    info = os.stat(directory)
+    if info.st_uid != os.getuid():
+        raise Exception("%s belongs to someone else. Remove it or set %s=0." % (directory, DISABLE_ENV))
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+def control_path(app_name, ssh_ip, ssh_opts):
+    name = hashlib.sha1(json.dumps([app_name, ssh_ip, ssh_opts]).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(socket_dir(), name)
+
+def ssh(ssh_opts, ssh_ip, *args):
+    return ['ssh'] + ssh_opts.split() + list(args) + ['root@%s' % ssh_ip]
+
+def run(command, stderr=None):
+    with open(os.devnull, 'r+b') as devnull:
+        return subprocess.call(command, stdin=devnull, stdout=devnull, stderr=stderr or devnull)
+
+def alive(path, ssh_ip, ssh_opts):
+    return os.path.exists(path) and run(ssh(ssh_opts, ssh_ip, '-o', 'ControlPath=%s' % path, '-O', 'check')) == 0
+
+def remove(path):
+    for filename in (path, path + '.json'):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+def wait_until_ready(process, path, ssh_ip, ssh_opts, timeout=CONNECT_TIMEOUT):
+    """
+    Polls the master's socket with a short backoff until it answers.
+    Returns False as soon as the master exits with an error or after
+    timeout seconds.
+    """
+    deadline = time.time() + timeout
+    delay = POLL_BASE
+    while time.time() < deadline:
+        if alive(path, ssh_ip, ssh_opts):
+            return True
+        # ssh exits with 0 when it goes to the background, which can be
+        # a moment before the socket answers
+        code = process.poll()
+        if code is not None and code != 0:
+            return False
+        time.sleep(delay)
+        delay = min(POLL_MAX, delay * 2)
+    return False
+
+def start(path, app_name, ssh_ip, ssh_opts):
+    """
+    Starts a master and returns once it is connected, or False if it could
+    not connect.
+    """
+    # -f backgrounds the master once it is connected. It keeps its stderr
+    # open, so that goes to a file rather than to our stderr. Nobody can
+    # answer a host key or passphrase prompt from here, so BatchMode makes
+    # the master fail at once and the direct ssh that follows prompts.
+    with tempfile.TemporaryFile() as errors, open(os.devnull, 'r+b') as devnull:
+        process = subprocess.Popen(ssh(ssh_opts, ssh_ip, '-o', 'BatchMode=yes', '-o', 'ControlMaster=yes', '-o', 'ControlPath=%s' % path,
+                                       '-o', 'ControlPersist=%s' % CONTROL_PERSIST, '-N', '-f'),
+                                   stdin=devnull, stdout=devnull, stderr=errors)
+        if not wait_until_ready(process, path, ssh_ip, ssh_opts):
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            errors.seek(0)
+            logging.getLogger("gigalixir-cli").info("Could not open a shared ssh connection to %s: %s" % (app_name, errors.read().decode('utf-8', 'replace').strip()))
+            return False
+    with open(path + '.json', 'w') as f:
+        json.dump({"app": app_name, "ssh_ip": ssh_ip, "ssh_opts": ssh_opts, "started_at": time.time()}, f)
+    return True
+
+def master(app_name, ssh_ip, ssh_opts):
+    """
+    Returns the socket of a connected master for the app, starting one if
+    needed, or None if there is none.
+    """
+    path = control_path(app_name, ssh_ip, ssh_opts)
+    if alive(path, ssh_ip, ssh_opts):
+        return path
+    remove(path)
+    if start(path, app_name, ssh_ip, ssh_opts):
+        return path
+    # another command may have started one at the same time
+    if alive(path, ssh_ip, ssh_opts):
+        return path
+    return None
+
+def multiplexed(app_name, ssh_ip, ssh_opts):
+    """
+    ssh_opts plus what makes ssh run over the app's master. Without a
+    master, ssh_opts are returned as they are and ssh connects on its own.
+    """
+    if not enabled() or 'ControlPath' in ssh_opts or '-S' in ssh_opts.split():
+        return ssh_opts
+    path = master(app_name, ssh_ip, ssh_opts)
+    if path is None:
+        return ssh_opts
+    # ControlMaster=no still connects directly if the master went away
+    return ' '.join(part for part in [ssh_opts, '-o ControlMaster=no -o ControlPath=%s' % path] if part)
+
+def connections():
+    """
+    Returns the masters that are still running. Stale sockets are removed.
+    """
+    if not enabled():
+        return []
+    directory = socket_dir()
+    found = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(directory, filename[:-len('.json')])
+        try:
+            with open(path + '.json') as f:
+                info = json.load(f)
+        except (IOError, ValueError):
+            remove(path)
+            continue
+        if not alive(path, info["ssh_ip"], info["ssh_opts"]):
+            remove(path)
+            continue
+        found.append({
+            "app": info["app"],
+            "ssh_ip": info["ssh_ip"],
+            "socket": path,
+            "started_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(info["started_at"])),
+        })
+    return found
+
+def close(app_name=None):
+    """
+    Stops the masters of app_name, or all of them, and returns them.
+    """
+    closed = []
+    for connection in connections():
+        if app_name is not None and connection["app"] != app_name:
+            continue
+        with open(connection["socket"] + '.json') as f:
+            ssh_opts = json.load(f)["ssh_opts"]
+        run(ssh(ssh_opts, connection["ssh_ip"], '-o', 'ControlPath=%s' % connection["socket"], '-O', 'exit'))
+        remove(connection["socket"])
+        closed.append(connection)
+    return closed
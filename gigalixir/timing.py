@@ -0,0 +1,268 @@
+"""
+Lightweight spans around the phases of a command: imports, app detection,
+netrc parsing, every http request and rendering. Each request is split into
+connect, tls, ttfb and download spans taken from the connection itself.
+
+Spans are always recorded, which costs a list append. They are only
+reported with `gigalixir --timing` (a summary on stderr) or written to
+GIGALIXIR_TRACE as Chrome trace events (chrome://tracing, Perfetto) or,
+with GIGALIXIR_TRACE_FORMAT=otlp, as OTLP json.
+
+Spans go to the process's Recorder unless the thread recording them is
+inside recording(), which gives commands that run side by side in one
+process, e.g. `gigalixir batch --parallel`, spans of their own.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FORMATS = ['chrome', 'otlp']
+
+class Recorder(object):
+    def __init__(self):
+        self.spans = []
+        # whether the timings will be reported, which is when the transport
+        # is instrumented too
+        self.enabled = False
+
+_default = Recorder()
+_local = threading.local()
+_ids = itertools.count(1)
+
+def _recorder():
+    return getattr(_local, 'recorder', None) or _default
+
+@contextmanager
+def recording():
+    """
+    Records the spans of this thread in the with block, and only those,
+    with a Recorder of their own. Spans from threads started in the block
+    still go to the process's Recorder.
+    """
+    saved = getattr(_local, 'recorder', None)
+    _local.recorder = Recorder()
+    try:
+        yield _local.recorder
+    finally:
+        _local.recorder = saved
+
+def now():
+    return time.time()
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def record(name, start, end, category='cli', parent=None, **args):
+    """
+    Records a span that already ended. Returns its id.
+    """
+    span_id = next(_ids)
+    if parent is None:
+        stack = _stack()
+        parent = stack[-1] if stack else None
+    _recorder().spans.append({
+        "id": span_id,
+        "parent": parent,
+        "name": name,
+        "category": category,
+        "start": start,
+        "end": end,
+        "thread": threading.current_thread().ident,
+        "args": args,
+    })
+    return span_id
+
+class span(object):
+    """
+    Times the with block, e.g.
+
+        with timing.span('detect_app'):
+            ...
+
+    Spans opened inside the block on the same thread are its children.
+    args can be added to while the block runs.
+    """
+    def __init__(self, name, category='cli', **args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.id = next(_ids)
+
+    def __enter__(self):
+        self.stack = _stack()
+        self.parent = self.stack[-1] if self.stack else None
+        self.stack.append(self.id)
+        self.start = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = now()
+        self.stack.pop()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        _recorder().spans.append({
+            "id": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "category": self.category,
+            "start": self.start,
+            "end": end,
+            "thread": threading.current_thread().ident,
+            "args": self.args,
+        })
+
+def spans():
+    return sorted(_recorder().spans, key=lambda s: s['start'])
+
+def reset():
+    recorder = _recorder()
+    del recorder.spans[:]
+    recorder.enabled = False
+
+# transport
+
+def instrument(adapter):
+    """
+    Makes the connections of a requests HTTPAdapter record connect, tls,
+    ttfb and download spans.
+    """
+    from requests.packages.urllib3 import connection, connectionpool
+
+    class Timed(object):
+        def _new_conn(self):
+            start = now()
+            sock = super(Timed, self)._new_conn()
+            self._connected = now()
+            record('connect', start, self._connected, 'http', host=self.host)
+            return sock
+
+        def connect(self):
+            self._connected = None
+            super(Timed, self).connect()
+            if self._connected is not None and self.scheme == 'https':
+                record('tls', self._connected, now(), 'http', host=self.host)
+
+        def getresponse(self, *args, **kwargs):
+            start = now()
+            response = super(Timed, self).getresponse(*args, **kwargs)
+            _local.headers_at = now()
+            record('ttfb', start, _local.headers_at, 'http', host=self.host)
+            return response
+
+    class TimedHTTPConnection(Timed, connection.HTTPConnection):
+        scheme = 'http'
+
+    class TimedHTTPSConnection(Timed, connection.HTTPSConnection):
+        scheme = 'https'
+
+    class TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool,
+    }
+
+def enabled():
+    return _recorder().enabled
+
+def enable():
+    _recorder().enabled = True
+
+def headers_received_at():
+    """
+    When the last response on this thread finished sending its headers.
+    """
+    return getattr(_local, 'headers_at', None)
+
+# reports
+
+def depth(span, by_id):
+    depth = 0
+    while span['parent'] in by_id:
+        span = by_id[span['parent']]
+        depth += 1
+    return depth
+
+def summary(recorded=None):
+    """
+    Returns one line per span, indented under its parent.
+    """
+    recorded = spans() if recorded is None else recorded
+    if not recorded:
+        return []
+    by_id = dict((s['id'], s) for s in recorded)
+    lines = []
+    for s in recorded:
+        extra = ' '.join('%s=%s' % (key, s['args'][key]) for key in sorted(s['args']))
+        lines.append("%9.1fms  %s%s%s" % (
+            (s['end'] - s['start']) * 1000, '  ' * depth(s, by_id), s['name'], ' ' + extra if extra else ''))
+    total = max(s['end'] for s in recorded) - min(s['start'] for s in recorded)
+    lines.append("%9.1fms  total" % (total * 1000))
+    return lines
+
+def chrome_trace(recorded=None):
+    recorded = spans() if recorded is None else recorded
+    pid = os.getpid()
+    return {"traceEvents": [{
+        "name": s['name'],
+        "cat": s['category'],
+        "ph": "X",
+        "ts": int(s['start'] * 1e6),
+        "dur": int((s['end'] - s['start']) * 1e6),
+        "pid": pid,
+        "tid": s['thread'],
+        "args": s['args'],
+    } for s in recorded], "displayTimeUnit": "ms"}
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": u'%s' % (value,)}
+
+def otlp_trace(recorded=None):
+    """
+    The spans as an OTLP/JSON ExportTraceServiceRequest.
+    """
+    import binascii
+    recorded = spans() if recorded is None else recorded
+    trace_id = binascii.hexlify(os.urandom(16)).decode('ascii')
+    def span_id(i):
+        return '%016x' % i
+    otlp_spans = []
+    for s in recorded:
+        otlp_span = {
+            "traceId": trace_id,
+            "spanId": span_id(s['id']),
+            "name": s['name'],
+            "kind": 3 if s['category'] == 'http' else 1,
+            "startTimeUnixNano": str(int(s['start'] * 1e9)),
+            "endTimeUnixNano": str(int(s['end'] * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in sorted(s['args'].items())]
+                          + [{"key": "thread.id", "value": _otlp_value(s['thread'])}],
+        }
+        if s['parent'] is not None:
+            otlp_span["parentSpanId"] = span_id(s['parent'])
+        otlp_spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "gigalixir-cli"}}]},
+        "scopeSpans": [{"scope": {"name": "gigalixir"}, "spans": otlp_spans}],
+    }]}
+
+def write_trace(path, trace_format='chrome'):
+    trace = otlp_trace() if trace_format == 'otlp' else chrome_trace()
+    with open(path, 'w') as f:
+        json.dump(trace, f)
@@ -1,18 +1,14 @@
-import requests
 from . import auth
 from . import netrc
 from . import presenter
 import logging
 import urllib
 import click
-import stripe
 import json
 from six.moves.urllib.parse import quote
 
-def create(host, email, password, accept_terms_of_service_and_privacy_policy):
-    r = requests.post('%s/api/free_users' % host, headers = {
-        'Content-Type': 'application/json',
-    }, json = {
+def create(session, email, password, accept_terms_of_service_and_privacy_policy):
+    r = session.post('/api/free_users', json = {
         'email': email,
         'password': password,
     })
@@ -23,32 +19,28 @@ def create(host, email, password, accept_terms_of_service_and_privacy_policy):
     logging.getLogger("gigalixir-cli").info('Created account for %s. Confirmation email sent.' % email)
     logging.getLogger("gigalixir-cli").info('Please check your email and click confirm before continuing.')
 
-def upgrade(host):
-    r = requests.put('%s/api/users/upgrade' % host, headers = {
-        'Content-Type': 'application/json',
-    })
+def upgrade(session):
+    r = session.put('/api/users/upgrade')
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
     logging.getLogger("gigalixir-cli").info('Account upgraded.')
 
-def validate_email(host, email):
-    r = requests.get('%s/api/validate_email' % host, headers = {
-        'Content-Type': 'application/json',
-    }, params = {
+def validate_email(session, email):
+    r = session.get('/api/validate_email', params = {
         "email": email
     })
     if r.status_code != 200:
         errors = json.loads(r.text)["errors"]
         raise Exception("\n".join(errors))
 
-def validate_password(host, password):
+def validate_password(session, password):
     if len(password) < 4:
         raise Exception("Password should be at least 4 characters.")
 
-def change_password(host, email, current_password, new_password):
-    r = requests.patch('%s/api/users' % host, auth = (quote(email.encode('utf-8')), quote(current_password.encode('utf-8'))), json = {
+def change_password(session, email, current_password, new_password):
+    r = session.patch('/api/users', auth = (quote(email.encode('utf-8')), quote(current_password.encode('utf-8'))), json = {
         "new_password": new_password
     })
     if r.status_code != 200:
@@ -59,8 +51,8 @@ def change_password(host, email, current_password, new_password):
 def logout():
     netrc.clear_netrc()
 
-def login(host, email, password, yes, env):
-    r = requests.get('%s/api/login' % host, auth = (quote(email.encode('utf-8')), quote(password.encode('utf-8'))))
+def login(session, email, password, yes, env):
+    r = session.get('/api/login', auth = (quote(email.encode('utf-8')), quote(password.encode('utf-8'))))
     if r.status_code != 200:
         if r.status_code == 401:
             raise Exception("Sorry, we could not authenticate you. If you need to reset your password, run `gigalixir account:password:reset --email=%s`." % email)
@@ -81,8 +73,8 @@ def login(host, email, password, yes, env):
             logging.getLogger("gigalixir-cli").info('\tlogin %s' % email)
             logging.getLogger("gigalixir-cli").info('\tpassword %s' % key)
 
-def get_reset_password_token(host, email):
-    r = requests.put('%s/api/users/reset_password' % host, json = {"email": email})
+def get_reset_password_token(session, email):
+    r = session.put('/api/users/reset_password', json = {"email": email})
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -91,15 +83,15 @@ def get_reset_password_token(host, email):
     else:
         logging.getLogger("gigalixir-cli").info("Reset password token has been sent to your email.")
 
-def reset_password(host, token, password):
-    r = requests.post('%s/api/users/reset_password' % host, json = {"token": token, "password": password})
+def reset_password(session, token, password):
+    r = session.post('/api/users/reset_password', json = {"token": token, "password": password})
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
         raise Exception(r.text)
 
-def get_confirmation_token(host, email):
-    r = requests.put('%s/api/users/reconfirm_email' % host, json = {"email": email})
+def get_confirmation_token(session, email):
+    r = session.put('/api/users/reconfirm_email', json = {"email": email})
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -107,8 +99,8 @@ def get_confirmation_token(host, email):
     else:
         logging.getLogger("gigalixir-cli").info("Confirmation token has been sent to your email.")
 
-def account(host):
-    r = requests.get('%s/api/users' % host)
+def account(session):
+    r = session.get('/api/users')
     if r.status_code != 200:
         if r.status_code == 401:
             raise auth.AuthException()
@@ -0,0 +1,184 @@
+"""
+Entry point of the `gigalixir` executable and client of `gigalixir agent`.
+
+Every invocation normally pays for starting python, importing the cli,
+reading ~/.netrc and .git/config and a new TLS handshake with the api. Run
+
+    gigalixir agent &
+
+and later invocations hand their arguments, environment and working
+directory to the agent over a unix socket instead. The agent runs the
+command with its warm imports, caches and keep-alive connections and
+streams stdout, stderr and the exit code back. When no agent is listening
+the command simply runs in-process as before.
+
+This module lives outside the gigalixir package so that handing a command
+to a running agent does not pay for importing the cli.
+"""
+import io
+import json
+import os
+import socket
+import struct
+import sys
+
+SOCKET_ENV = 'GIGALIXIR_AGENT_SOCKET'
+NO_AGENT_ENV = 'GIGALIXIR_NO_AGENT'
+
+# frames are a one byte kind, a four byte length and the payload
+HEADER = struct.Struct('!cI')
+REQUEST = b'r'
+STOP = b's'
+STDOUT = b'o'
+STDERR = b'e'
+STDIN = b'i'
+EXIT = b'x'
+
+# group options that are followed by a value. Importing the cli to read
+# them would cost what the agent saves, so the tests compare them instead.
+GROUP_OPTIONS = ('--env', '--apps', '--retries', '-o', '--output', '--fields', '--trace', '--trace-format', '--profile-dir')
+# --profile is followed by one of these or by nothing, which means cpu
+PROFILE_OPTION = '--profile'
+PROFILE_KINDS = ('cpu', 'mem')
+
+# commands that need the user's terminal, e.g. for a password or an ssh
+# session, or that run until interrupted always run in the client.
+LOCAL_COMMANDS = set([
+    'agent',
+    'login', 'signup', 'logout',
+    'account:password:set', 'set_password',
+    'account:password:change', 'change_password',
+    'account:payment_method:set', 'set_payment_method',
+    'ps:ssh', 'ssh',
+    'ps:run', 'ps:distillery',
+    'ps:remote_console', 'remote_console',
+    'ps:observer', 'observer',
+    'ps:migrate', 'migrate',
+    'logs', 'logs:search',
+    'pg:psql',
+])
+
+def socket_path():
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'gigalixir', 'agent.sock')
+    # same directory as gigalixir.cache.cache_dir()
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'gigalixir', 'agent.sock')
+
+def send_frame(sock, kind, payload=b''):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+def recv_frame(sock):
+    kind, size = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return kind, recv_exactly(sock, size)
+
+def command_name(argv):
+    """
+    Returns the command argv runs, skipping the group options before it.
+    """
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in GROUP_OPTIONS:
+            i += 2
+        elif arg == PROFILE_OPTION and i + 1 < len(argv) and argv[i + 1] in PROFILE_KINDS:
+            i += 2
+        elif arg.startswith('-'):
+            i += 1
+        else:
+            return arg
+    return None
+
+def connect(path=None):
+    """
+    Returns a socket connected to the agent or None if none is running.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+    except (IOError, OSError):
+        sock.close()
+        return None
+    return sock
+
+# client
+
+def _isatty(f):
+    try:
+        return f.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+def _binary(f):
+    return getattr(f, 'buffer', f)
+
+def forward(sock, argv, stdin=None, stdout=None, stderr=None):
+    """
+    Runs argv in the agent connected to sock and returns its exit code.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    request = {
+        "argv": list(argv),
+        "env": dict(os.environ),
+        "cwd": os.getcwd(),
+        "stdin_tty": _isatty(stdin),
+        "stdout_tty": _isatty(stdout),
+        "stderr_tty": _isatty(stderr),
+    }
+    send_frame(sock, REQUEST, json.dumps(request).encode('utf-8'))
+    outputs = {STDOUT: stdout, STDERR: stderr}
+    try:
+        while True:
+            kind, payload = recv_frame(sock)
+            if kind in outputs:
+                out = outputs[kind]
+                out.flush()
+                _binary(out).write(payload)
+                _binary(out).flush()
+            elif kind == STDIN:
+                size = struct.unpack('!I', payload)[0]
+                try:
+                    data = os.read(stdin.fileno(), size)
+                except (AttributeError, ValueError, io.UnsupportedOperation):
+                    data = _binary(stdin).readline(size)
+                send_frame(sock, STDIN, data)
+            elif kind == EXIT:
+                return json.loads(payload.decode('utf-8'))
+    except (EOFError, socket.error):
+        stderr.write("Lost connection to the gigalixir agent.\n")
+        return 1
+    finally:
+        sock.close()
+
+def main():
+    """
+    Entry point of the `gigalixir` executable.
+    """
+    argv = sys.argv[1:]
+    sock = None
+    if not os.environ.get(NO_AGENT_ENV) and command_name(argv) not in LOCAL_COMMANDS | set([None]):
+        sock = connect()
+    if sock is None:
+        from gigalixir import cli
+        cli(prog_name='gigalixir')
+    else:
+        sys.exit(forward(sock, argv))
+
+if __name__ == '__main__':
+    main()
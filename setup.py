@@ -7,7 +7,9 @@ setup(
     author_email='jesse@gigalixir.com',
     version='1.1.3',
     packages=find_packages(),
+    py_modules=['gigalixir_agent_client'],
     include_package_data=True,
+    python_requires='>=3.7',
     install_requires=[
         'click~=6.7',
         'requests~=2.13.0',
@@ -17,7 +19,7 @@ setup(
     ],
     entry_points='''
         [console_scripts]
-        gigalixir=gigalixir:cli
+        gigalixir=gigalixir_agent_client:main
     ''',
     setup_requires=[
         'pytest-runner',
@@ -37,5 +39,11 @@ setup(
             'HTTPretty',
             'sure',
         ],
+        'async': [
+            'httpx',
+        ],
+        'yaml': [
+            'PyYAML',
+        ],
     }
 )
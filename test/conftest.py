@@ -0,0 +1,14 @@
+import pytest
+import gigalixir
+
+@pytest.fixture(autouse=True)
+def disable_rollbar():
+    # commands that fail report to rollbar from a background thread, which
+    # would otherwise reach the real network while httpretty is enabled for
+    # the next test. rollbar is initialized lazily so do that first or it
+    # would turn itself back on.
+    rollbar = gigalixir.get_rollbar()
+    enabled = rollbar.SETTINGS['enabled']
+    rollbar.SETTINGS['enabled'] = False
+    yield
+    rollbar.SETTINGS['enabled'] = enabled